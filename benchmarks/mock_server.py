@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+# Local stand-in for the Darksky Time Machine API, for offline benchmarks (see run_benchmark.py).
+# Serves GET /forecast/<secret_key>/<lat>,<lon>,<datetime>?exclude=...&lang=...&units=...
+#   with synthetic forecast payloads (deterministic per location and date), or with recorded
+#   payloads (*.json files from payload_dir, picked per location and date).
+# latency: seconds added to every response (plus up to latency_jitter seconds)
+# error_429_rate, error_5xx_rate: fraction of requests answered with 429 / 503 errors
+# Stats: GET /_stats returns request and error counts; GET /_reset resets them.
+
+import argparse
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+import zlib
+
+import pytz
+
+# Timezone of the synthetic locations
+TIMEZONE = 'America/Denver'
+
+
+# Local midnight of the forecast date (as the API's times), so that every record of the day
+#   has that forecast_date
+def day_start(forecast_date):
+    day = datetime.strptime(forecast_date[0:10], '%Y-%m-%d')
+    return int(pytz.timezone(TIMEZONE).localize(day).timestamp())
+
+
+# UTC offset in hours at a time (-6 in summer time, -7 otherwise)
+def utc_offset(timestamp):
+    local_time = datetime.fromtimestamp(timestamp, pytz.timezone(TIMEZONE))
+    return int(local_time.utcoffset().total_seconds() / 3600)
+
+
+def hourly_point(rnd, point_time):
+    return {
+        'time': point_time,
+        'summary': 'Partly Cloudy',
+        'icon': 'partly-cloudy-day',
+        'precipIntensity': round(rnd.random(), 4),
+        'precipProbability': round(rnd.random(), 2),
+        'precipType': 'rain',
+        'temperature': round(5 + rnd.random() * 20, 2),
+        'apparentTemperature': round(4 + rnd.random() * 20, 2),
+        'dewPoint': round(rnd.random() * 10, 2),
+        'humidity': round(rnd.random(), 2),
+        'pressure': round(1000 + rnd.random() * 30, 1),
+        'windSpeed': round(rnd.random() * 10, 2),
+        'windGust': round(rnd.random() * 20, 2),
+        'windBearing': rnd.randint(0, 359),
+        'cloudCover': round(rnd.random(), 2),
+        'uvIndex': rnd.randint(0, 10),
+        'visibility': 16.093,
+        'ozone': round(250 + rnd.random() * 100, 1)
+    }
+
+
+def daily_point(rnd, base):
+    return {
+        'time': base,
+        'summary': 'Partly cloudy throughout the day.',
+        'icon': 'partly-cloudy-day',
+        'sunriseTime': base + 22000,
+        'sunsetTime': base + 63000,
+        'moonPhase': round(rnd.random(), 2),
+        'precipIntensity': round(rnd.random(), 4),
+        'precipIntensityMax': round(rnd.random() * 2, 4),
+        'precipIntensityMaxTime': base + rnd.randint(0, 86399),
+        'precipProbability': round(rnd.random(), 2),
+        'precipType': 'rain',
+        'temperatureHigh': round(15 + rnd.random() * 10, 2),
+        'temperatureHighTime': base + 50400,
+        'temperatureLow': round(rnd.random() * 10, 2),
+        'temperatureLowTime': base + 18000,
+        'apparentTemperatureHigh': round(14 + rnd.random() * 10, 2),
+        'apparentTemperatureHighTime': base + 50400,
+        'apparentTemperatureLow': round(rnd.random() * 10, 2),
+        'apparentTemperatureLowTime': base + 18000,
+        'dewPoint': round(rnd.random() * 10, 2),
+        'humidity': round(rnd.random(), 2),
+        'pressure': round(1000 + rnd.random() * 30, 1),
+        'windSpeed': round(rnd.random() * 10, 2),
+        'windGust': round(rnd.random() * 20, 2),
+        'windGustTime': base + rnd.randint(0, 86399),
+        'windBearing': rnd.randint(0, 359),
+        'cloudCover': round(rnd.random(), 2),
+        'uvIndex': rnd.randint(0, 10),
+        'uvIndexTime': base + 45000,
+        'visibility': 16.093,
+        'ozone': round(250 + rnd.random() * 100, 1),
+        'temperatureMin': round(rnd.random() * 10, 2),
+        'temperatureMinTime': base + 18000,
+        'temperatureMax': round(15 + rnd.random() * 10, 2),
+        'temperatureMaxTime': base + 50400,
+        'apparentTemperatureMin': round(rnd.random() * 10, 2),
+        'apparentTemperatureMinTime': base + 18000,
+        'apparentTemperatureMax': round(14 + rnd.random() * 10, 2),
+        'apparentTemperatureMaxTime': base + 50400
+    }
+
+
+# Synthetic Time Machine response for a location and date: 24 hourly points, 1 daily point
+def build_forecast(latitude, longitude, forecast_date, units='us'):
+    base = day_start(forecast_date)
+    rnd = random.Random('{},{},{}'.format(latitude, longitude, forecast_date[0:10]))
+    return {
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'timezone': TIMEZONE,
+        'offset': utc_offset(base),
+        'currently': hourly_point(rnd, base),
+        'hourly': {
+            'summary': 'Partly cloudy throughout the day.',
+            'icon': 'partly-cloudy-day',
+            'data': [hourly_point(rnd, base + 3600 * hour) for hour in range(24)]
+        },
+        'daily': {
+            'data': [daily_point(rnd, base)]
+        },
+        'alerts': [{
+            'title': 'Wind Advisory',
+            'time': base,
+            'expires': base + 86400,
+            'description': 'Synthetic alert.',
+            'uri': 'https://alerts.weather.gov'
+        }],
+        'flags': {
+            'sources': ['cmc', 'gfs', 'hrrr', 'icon', 'isd', 'madis', 'nam', 'sref'],
+            'nearest-station': 1.835,
+            'units': units
+        }
+    }
+
+
+def load_payloads(payload_dir):
+    payloads = []
+    for file_name in sorted(os.listdir(payload_dir)):
+        if file_name.endswith('.json'):
+            with open(os.path.join(payload_dir, file_name)) as file:
+                payloads.append(json.load(file))
+    if not payloads:
+        raise ValueError('No *.json payloads in: {}'.format(payload_dir))
+    return payloads
+
+
+class MockDarkskyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Write headers and body in one send (flushed per request), avoiding delayed ACK stalls
+    wbufsize = 64 * 1024
+
+    def do_GET(self):
+        server = self.server
+        split_url = urlsplit(self.path)
+        if split_url.path == '/_stats':
+            return self.send_json(200, server.get_stats())
+        if split_url.path == '/_reset':
+            server.reset_stats()
+            return self.send_json(200, server.get_stats())
+
+        path = split_url.path.strip('/').split('/')
+        try:
+            latitude, longitude, forecast_date = path[2].split(',')
+            float(latitude)
+            float(longitude)
+            day_start(forecast_date)
+        except (IndexError, ValueError):
+            return self.send_json(400, {'code': 400, 'error': 'The given location is invalid.'})
+
+        status = server.next_status()
+        if server.latency or server.latency_jitter:
+            time.sleep(server.latency + random.random() * server.latency_jitter)
+        if status == 429:
+            return self.send_json(429, {'code': 429, 'error': 'Too Many Requests'},
+                                  {'Retry-After': str(server.retry_after)})
+        if status == 503:
+            return self.send_json(503, {'code': 503, 'error': 'Service Unavailable'})
+
+        params = parse_qs(split_url.query)
+        exclude = params.get('exclude', [''])[0].split(',')
+        data = server.get_payload(latitude, longitude, forecast_date, params.get('units', ['us'])[0])
+        for section in exclude:
+            data.pop(section, None)
+        return self.send_json(200, data, {'X-Forecast-API-Calls': str(server.api_calls)})
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+class MockDarkskyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self,
+                 host='127.0.0.1',
+                 port=0,
+                 latency=0.0,
+                 latency_jitter=0.0,
+                 error_429_rate=0.0,
+                 error_5xx_rate=0.0,
+                 retry_after=1,
+                 payload_dir=None,
+                 seed=0):
+        super().__init__((host, port), MockDarkskyHandler)
+        self.latency = float(latency)
+        self.latency_jitter = float(latency_jitter)
+        self.error_429_rate = float(error_429_rate)
+        self.error_5xx_rate = float(error_5xx_rate)
+        self.retry_after = retry_after
+        self.payloads = load_payloads(payload_dir) if payload_dir else None
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(*self.server_address[0:2])
+
+    def reset_stats(self):
+        self.requests = 0
+        self.api_calls = 0
+        self.errors_429 = 0
+        self.errors_5xx = 0
+
+    def get_stats(self):
+        return {
+            'requests': self.requests,
+            'api_calls': self.api_calls,
+            'errors_429': self.errors_429,
+            'errors_5xx': self.errors_5xx
+        }
+
+    # Status of the next forecast request: 200, or an injected 429 / 503 error
+    def next_status(self):
+        with self.__lock:
+            self.requests = self.requests + 1
+            draw = self.__random.random()
+            if draw < self.error_429_rate:
+                self.errors_429 = self.errors_429 + 1
+                return 429
+            if draw < self.error_429_rate + self.error_5xx_rate:
+                self.errors_5xx = self.errors_5xx + 1
+                return 503
+            self.api_calls = self.api_calls + 1
+            return 200
+
+    def get_payload(self, latitude, longitude, forecast_date, units):
+        if not self.payloads:
+            return build_forecast(latitude, longitude, forecast_date, units)
+        # Recorded payloads are picked deterministically, and moved to the requested location
+        index = zlib.crc32('{},{},{}'.format(
+            latitude, longitude, forecast_date[0:10]).encode('utf-8')) % len(self.payloads)
+        data = json.loads(json.dumps(self.payloads[index]))
+        data['latitude'] = float(latitude)
+        data['longitude'] = float(longitude)
+        return data
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Mock Darksky API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-429-rate', type=float, default=0.0)
+    parser.add_argument('--error-5xx-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--payload-dir')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = MockDarkskyServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_429_rate=args.error_429_rate,
+        error_5xx_rate=args.error_5xx_rate,
+        retry_after=args.retry_after,
+        payload_dir=args.payload_dir,
+        seed=args.seed)
+    print('Mock Darksky API listening on {}'.format(server.base_url), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
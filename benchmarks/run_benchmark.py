@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Offline throughput benchmark: runs sync.sync against the local mock Darksky API
+#   (mock_server.py), for each combination of location count, date span and max_workers.
+# Each run is a separate process, so peak RSS and CPU are measured per run; the mock server
+#   runs in this (parent) process.
+# Reports requests/s, records/s, CPU seconds per phase and peak RSS; with --baseline, runs
+#   whose records/s dropped by more than --max-regression are reported, and the exit code is 1.
+#
+# Examples:
+#   python benchmarks/run_benchmark.py --locations 1,10,50 --days 7,30 --max-workers 1,8
+#   python benchmarks/run_benchmark.py --latency 0.05 --error-429-rate 0.01 --output run.json
+#   python benchmarks/run_benchmark.py --baseline run.json --max-regression 0.1
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import itertools
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+# Benchmark the checkout this script is in
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from mock_server import MockDarkskyServer
+from tap_darksky.instrumentation import PHASES
+
+# Output stream for MessageWriter that counts RECORD messages and discards the output
+class CountingSink(object):
+    def __init__(self):
+        self.buffer = self
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        self.records = self.records + chunk.count(b'"type":"RECORD"')
+        self.bytes = self.bytes + len(chunk)
+
+    def flush(self):
+        pass
+
+
+def get_locations(count):
+    return ';'.join(['{},{}'.format(
+        round(25 + (index % 200) * 0.1, 4),
+        round(-125 + (index // 200) * 0.1, 4)) for index in range(count)])
+
+
+def get_catalog(streams):
+    # pylint: disable=import-outside-toplevel
+    from singer.catalog import Catalog
+    from tap_darksky.discover import discover
+
+    catalog = discover().to_dict()
+    for stream in catalog['streams']:
+        for mdata in stream['metadata']:
+            mdata['metadata']['selected'] = stream['stream'] in streams
+    return Catalog.from_dict(catalog)
+
+
+# Run one scenario in this process; returns its measurements
+def run_scenario(scenario, base_url):
+    # pylint: disable=import-outside-toplevel
+    from tap_darksky.client import DarkskyClient
+    from tap_darksky.instrumentation import PhaseTimer
+    from tap_darksky.output import MessageWriter
+    from tap_darksky.ratelimit import RateLimiter
+    from tap_darksky.sync import sync
+
+    logging.disable(logging.INFO)
+
+    start_date = datetime.now(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0) - timedelta(days=scenario['days'] - 1)
+    config = {
+        'secret_key': 'benchmark',
+        'language': 'en',
+        'units': 'us',
+        'user_agent': 'tap-darksky benchmark',
+        'location_list': get_locations(scenario['locations']),
+        'start_date': start_date.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'max_workers': scenario['max_workers'],
+        'rate_limit_calls': 1000000,
+        'rate_limit_period': 1
+    }
+    config.update(scenario.get('config', {}))
+    catalog = get_catalog(scenario['streams'])
+    sink = CountingSink()
+    phase_timer = PhaseTimer()
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    with DarkskyClient(config['secret_key'],
+                       config['user_agent'],
+                       config['max_workers'],
+                       RateLimiter.from_config(config),
+                       phase_timer=phase_timer) as client:
+        client.base_url = base_url
+        sync(client=client,
+             config=config,
+             catalog=catalog,
+             state={},
+             writer=MessageWriter.from_config(config, stream=sink),
+             phase_timer=phase_timer)
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+
+    # CPU seconds per phase (see tap_darksky.instrumentation), summed over all threads
+    phase_totals = phase_timer.get_phase_totals()
+    phase_cpu = {phase: round(phase_totals.get(phase, [0, 0, 0])[2], 4) for phase in PHASES}
+    phase_cpu['other'] = round(max(cpu - sum(phase_cpu.values()), 0), 4)
+    return {
+        'wall_seconds': round(wall, 4),
+        'cpu_seconds': round(cpu, 4),
+        'records': sink.records,
+        'output_bytes': sink.bytes,
+        'requests': phase_totals.get('request', [0])[0],
+        'phase_cpu_seconds': phase_cpu,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def get_scenario_key(scenario):
+    return '{locations}x{days}d/w{max_workers}/{stream_list}'.format(
+        stream_list='+'.join(scenario['streams']), **scenario)
+
+
+def run_scenario_process(scenario, server):
+    server.reset_stats()
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__),
+         '--run-scenario', json.dumps(scenario),
+         '--base-url', server.base_url],
+        stdout=subprocess.PIPE,
+        check=True)
+    result = json.loads(process.stdout.decode('utf-8'))
+    stats = server.get_stats()
+    result.update({
+        'key': get_scenario_key(scenario),
+        'scenario': scenario,
+        'http_requests': stats['requests'],
+        'errors_429': stats['errors_429'],
+        'errors_5xx': stats['errors_5xx'],
+        'requests_per_second': round(stats['requests'] / result['wall_seconds'], 2),
+        'records_per_second': round(result['records'] / result['wall_seconds'], 2)
+    })
+    return result
+
+
+def print_results(results):
+    columns = ['key', 'http_requests', 'requests_per_second', 'records', 'records_per_second',
+               'cpu_seconds'] + PHASES + ['other', 'peak_rss_mb']
+    rows = [columns]
+    for result in results:
+        row = dict(result, **result['phase_cpu_seconds'])
+        rows.append([str(row[column]) for column in columns])
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    for row in rows:
+        print('  '.join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+# Runs in results whose records/s dropped by more than max_regression (fraction) vs. baseline
+def get_regressions(results, baseline, max_regression):
+    baseline_results = {result['key']: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(result['key'])
+        if not previous or not previous['records_per_second']:
+            continue
+        change = result['records_per_second'] / previous['records_per_second'] - 1
+        if change < -max_regression:
+            regressions.append((result['key'], previous['records_per_second'],
+                                result['records_per_second'], change))
+    return regressions
+
+
+def parse_list(value, cast=int):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline tap-darksky sync benchmark')
+    parser.add_argument('--locations', default='1,10', help='Location counts (comma-separated)')
+    parser.add_argument('--days', default='7,30', help='Date spans in days (comma-separated)')
+    parser.add_argument('--max-workers', default='1,4', help='max_workers (comma-separated)')
+    parser.add_argument('--streams', default='forecast', help='Selected streams (comma-separated)')
+    parser.add_argument('--config', default='{}', help='Extra tap config (JSON)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per scenario (best is kept)')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-429-rate', type=float, default=0.0)
+    parser.add_argument('--error-5xx-rate', type=float, default=0.0)
+    parser.add_argument('--payload-dir', help='Directory of recorded *.json responses to serve')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare records/s with this results JSON file')
+    parser.add_argument('--max-regression', type=float, default=0.1)
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.run_scenario:
+        result = run_scenario(json.loads(args.run_scenario), args.base_url)
+        sys.stdout.write(json.dumps(result))
+        return 0
+
+    server = MockDarkskyServer(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_429_rate=args.error_429_rate,
+        error_5xx_rate=args.error_5xx_rate,
+        payload_dir=args.payload_dir).start()
+    results = []
+    try:
+        for locations, days, max_workers in itertools.product(
+                parse_list(args.locations), parse_list(args.days), parse_list(args.max_workers)):
+            scenario = {
+                'locations': locations,
+                'days': days,
+                'max_workers': max_workers,
+                'streams': parse_list(args.streams, str),
+                'config': json.loads(args.config)
+            }
+            runs = [run_scenario_process(scenario, server) for _ in range(max(args.repeat, 1))]
+            results.append(max(runs, key=lambda result: result['records_per_second']))
+    finally:
+        server.stop()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = get_regressions(results, json.load(file), args.max_regression)
+        for key, previous, current, change in regressions:
+            print('REGRESSION {}: {} -> {} records/s ({:.1%})'.format(key, previous, current, change))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,9 +13,22 @@ setup(name='tap-darksky',
           'requests==2.22.0',
           'singer-python==5.8.1'
       ],
+      extras_require={
+          'fast': [
+              'orjson'
+          ],
+          'streaming': [
+              'ijson'
+          ],
+          'test': [
+              'pytest'
+          ]
+      },
       entry_points='''
           [console_scripts]
           tap-darksky=tap_darksky:main
+          tap-darksky-backfill=tap_darksky.backfill:main
+          tap-darksky-daemon=tap_darksky.daemon:main
       ''',
       packages=find_packages(),
       package_data={
@@ -2,12 +2,8 @@
 
 import sys
 import json
-import argparse
 import singer
-from singer import metadata, utils
-from tap_darksky.client import DarkskyClient
 from tap_darksky.discover import discover
-from tap_darksky.sync import sync
 
 LOGGER = singer.get_logger()
 
@@ -15,11 +11,20 @@ REQUIRED_CONFIG_KEYS = [
     'secret_key',
     'language',
     'units',
-    'location_list',
     'start_date',
     'user_agent'
 ]
 
+# Locations are read from location_list, location_file or both: one of them is required
+LOCATION_CONFIG_KEYS = ['location_list', 'location_file']
+
+
+# As singer.utils.check_config, for the location config keys
+def check_location_config(config):
+    if not any(config.get(key) for key in LOCATION_CONFIG_KEYS):
+        raise Exception('Config is missing required keys: {}'.format(
+            ' or '.join(LOCATION_CONFIG_KEYS)))
+
 def do_discover():
     LOGGER.info('Starting discover')
     catalog = discover()
@@ -27,25 +32,66 @@ def do_discover():
     LOGGER.info('Finished discover')
 
 
+# The client and sync modules (and their dependencies) are only imported for sync mode,
+#   so discovery and short scheduled runs start fast.
+# Returns the API client (or, in replay mode, the response archive client) for config
+def create_client(config, phase_timer):
+    # pylint: disable=import-outside-toplevel
+    from tap_darksky.archive import ArchiveClient, is_replay, ResponseArchive
+    from tap_darksky.cache import ResponseCache
+    from tap_darksky.client import DarkskyClient
+    from tap_darksky.ratelimit import RateLimiter
+    from tap_darksky.retry import CircuitBreaker
+
+    archive = ResponseArchive.from_config(config)
+    if is_replay(config):
+        # Replay mode: sync from the response archive, without API calls
+        if not archive:
+            raise ValueError('response_archive_replay requires response_archive_path')
+        return ArchiveClient(archive, phase_timer)
+    # The secret_key is verified by the first API request, not by a separate (billed) call
+    rate_limiter = RateLimiter.from_config(config)
+    return DarkskyClient(config['secret_key'],
+                         config['user_agent'],
+                         int(config.get('max_workers', 1)),
+                         rate_limiter,
+                         ResponseCache.from_config(config),
+                         phase_timer,
+                         archive,
+                         CircuitBreaker.from_config(config, rate_limiter.pause))
+
+
+def do_sync(config, catalog, state):
+    # pylint: disable=import-outside-toplevel
+    from tap_darksky.instrumentation import PhaseTimer, SamplingProfiler
+    from tap_darksky.sync import sync
+
+    phase_timer = PhaseTimer.from_config(config)
+    client = create_client(config, phase_timer)
+    with SamplingProfiler.from_config(config), client:
+        sync(client=client,
+             config=config,
+             catalog=catalog,
+             state=state,
+             phase_timer=phase_timer)
+
+
 @singer.utils.handle_top_exception(LOGGER)
 def main():
 
     parsed_args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
+    check_location_config(parsed_args.config)
 
-    with DarkskyClient(parsed_args.config['secret_key'],
-                       parsed_args.config['user_agent']) as client:
-
-        state = {}
-        if parsed_args.state:
-            state = parsed_args.state
+    state = {}
+    if parsed_args.state:
+        state = parsed_args.state
 
-        if parsed_args.discover:
-            do_discover()
-        elif parsed_args.catalog:
-            sync(client=client,
-                 config=parsed_args.config,
-                 catalog=parsed_args.catalog,
-                 state=state)
+    if parsed_args.discover:
+        do_discover()
+    elif parsed_args.catalog:
+        do_sync(config=parsed_args.config,
+                catalog=parsed_args.catalog,
+                state=state)
 
 if __name__ == '__main__':
     main()
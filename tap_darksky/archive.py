@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+import singer
+from tap_darksky.cache import parse_forecast_url
+from tap_darksky.instrumentation import is_enabled, PhaseTimer
+from tap_darksky.transform import decode_json
+
+LOGGER = singer.get_logger()
+
+DEFAULT_SEGMENT_MB = 64
+
+INDEX_FILE = 'index.jsonl'
+
+
+def get_segment_file(segment):
+    return 'segment-{:05d}.bin'.format(segment)
+
+
+# Append-only archive of raw API responses (config response_archive_path), in a directory:
+#   segment files of zlib-compressed response bodies, each up to segment_bytes, and an index
+#   (index.jsonl) of each response's location, date, request parameters and position.
+# Bodies are appended before their index entry, so an interrupted write leaves at most an
+#   unindexed body (and a partial last index line, which is ignored).
+# A response is archived once per location, date, exclude list, lang and units; get returns
+#   the latest archived response with all the sections requested (i.e. with the same or
+#   fewer sections excluded), so one full archive serves any later selection.
+# Thread-safe: writes and reads are serialized under a lock.
+class ResponseArchive(object):
+    def __init__(self, path, segment_bytes=DEFAULT_SEGMENT_MB * 1024 * 1024):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.archived = 0
+        self.replayed = 0
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        self.__readers = {}
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, INDEX_FILE)
+        self.__segment = 0
+        if os.path.exists(index_path):
+            with open(index_path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # Interrupted write
+                    self.__add_entry(entry)
+                    self.__segment = max(self.__segment, entry['segment'])
+        self.__index = open(index_path, 'a')
+        self.__writer = open(os.path.join(path, get_segment_file(self.__segment)), 'ab')
+
+    @classmethod
+    def from_config(cls, config):
+        path = config.get('response_archive_path')
+        if not path:
+            return None
+        return cls(
+            path=path,
+            segment_bytes=int(float(config.get(
+                'response_archive_segment_mb', DEFAULT_SEGMENT_MB)) * 1024 * 1024))
+
+    def __add_entry(self, entry):
+        key = (entry['location'], entry['date'], entry['lang'], entry['units'])
+        self.__entries.setdefault(key, []).append(entry)
+
+    def __find_entry(self, url_parts, exact=False):
+        latitude, longitude, forecast_date, exclude, lang, units = url_parts
+        key = ('{},{}'.format(latitude, longitude), forecast_date[0:10], lang, units)
+        for entry in reversed(self.__entries.get(key, [])):
+            if entry['exclude'] == exclude or \
+                (not exact and set(entry['exclude']).issubset(exclude)):
+                return entry
+        return None
+
+    # Archive a raw response body (bytes), unless it is already archived
+    def put(self, url, body):
+        url_parts = parse_forecast_url(url)
+        if url_parts is None or not body:
+            return
+        data = zlib.compress(body)
+        with self.__lock:
+            if self.__find_entry(url_parts, exact=True):
+                return
+            if self.__writer.tell() > 0 and \
+                self.__writer.tell() + len(data) > self.segment_bytes:
+                self.__writer.close()
+                self.__segment = self.__segment + 1
+                self.__writer = open(
+                    os.path.join(self.path, get_segment_file(self.__segment)), 'ab')
+            latitude, longitude, forecast_date, exclude, lang, units = url_parts
+            entry = {
+                'location': '{},{}'.format(latitude, longitude),
+                'date': forecast_date[0:10],
+                'exclude': exclude,
+                'lang': lang,
+                'units': units,
+                'segment': self.__segment,
+                'offset': self.__writer.tell(),
+                'length': len(data),
+                'archived_at': time.time()
+            }
+            self.__writer.write(data)
+            self.__writer.flush()
+            self.__index.write(json.dumps(entry) + '\n')
+            self.__index.flush()
+            self.__add_entry(entry)
+            self.archived = self.archived + 1
+
+    # Raw response body (bytes) for a forecast URL; None if it was not archived
+    def get(self, url):
+        url_parts = parse_forecast_url(url)
+        if url_parts is None:
+            return None
+        with self.__lock:
+            entry = self.__find_entry(url_parts)
+            if entry is None:
+                return None
+            if entry['segment'] == self.__segment:
+                self.__writer.flush()
+            reader = self.__readers.get(entry['segment'])
+            if reader is None:
+                reader = open(os.path.join(self.path, get_segment_file(entry['segment'])), 'rb')
+                self.__readers[entry['segment']] = reader
+            reader.seek(entry['offset'])
+            data = reader.read(entry['length'])
+            self.replayed = self.replayed + 1
+        return zlib.decompress(data)
+
+    def close(self):
+        LOGGER.info('Response archive: {} responses archived, {} replayed'.format(
+            self.archived, self.replayed))
+        with self.__lock:
+            self.__writer.close()
+            self.__index.close()
+            for reader in self.__readers.values():
+                reader.close()
+
+
+# Replay mode: sync from the archive (config response_archive_replay) instead of the API
+def is_replay(config):
+    return is_enabled(config.get('response_archive_replay'), False)
+
+
+# Replay mode: a stand-in for DarkskyClient that serves location-day requests from a
+#   ResponseArchive, without API calls (or quota).
+# Days missing from the archive return no data, which ends the sync of their location.
+class ArchiveClient(object):
+    def __init__(self, archive, phase_timer=None):
+        self.__archive = archive
+        self.__phase_timer = phase_timer or PhaseTimer(enabled=False)
+        self.base_url = 'https://api.darksky.net'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.__archive.close()
+
+    # Same as DarkskyClient.get
+    # pylint: disable=unused-argument
+    def get(self, url, decode=True, projection_keys=None, **kwargs):
+        with self.__phase_timer.phase('archive'):
+            body = self.__archive.get(url)
+        if body is None:
+            LOGGER.warning('Replay: no archived response for {}'.format(url))
+            return None
+        if not decode:
+            return body
+        with self.__phase_timer.phase('decode'):
+            return decode_json(body, projection_keys)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import sys
+
+import singer
+from tap_darksky.locations import LocationRegistry
+
+LOGGER = singer.get_logger()
+
+DEFAULT_SHARD_DAYS = 90
+
+
+# A location group and a range of forecast dates, synced with its own bookmarks.
+# A normal sync runs one shard per location group, from its bookmark through today
+#   (end_date None, key: the location group key, state: the tap state); a backfill shard
+#   covers start_date through end_date, with its state kept in the tap state under
+#   backfill.<key> (see get_shard_state).
+class Shard(object):
+    def __init__(self, location_group, start_date, end_date=None):
+        self.location_group = location_group
+        self.start_date = start_date
+        self.end_date = end_date
+        if end_date is None:
+            self.key = location_group.key
+        else:
+            self.key = '{}:{}:{}'.format(location_group.key, start_date[0:10], end_date)
+
+
+# State with the bookmarks of a shard: the tap state itself for a normal sync
+def get_shard_state(state, shard):
+    if shard.end_date is None:
+        return state
+    return state.setdefault('backfill', {}).setdefault(shard.key, {})
+
+
+# Bookmark store (see bookmarks.BookmarkStore) of a shard: None for a backfill shard, whose
+#   bookmarks are kept in its shard state
+def get_shard_bookmark_store(bookmark_store, shard):
+    if shard.end_date is None:
+        return bookmark_store
+    return None
+
+
+# A backfill shard is complete once all its dates were synced (see sync.sync_endpoint)
+def is_shard_complete(state, shard):
+    if shard.end_date is None:
+        return False
+    return get_shard_state(state, shard).get('complete', False)
+
+
+# Checkpointer for shard states: bookmarks are written to the shard state, but STATE
+#   messages always contain the whole tap state
+class ShardCheckpointer(object):
+    def __init__(self, checkpointer, state):
+        self.checkpointer = checkpointer
+        self.state = state
+
+    def records_written(self, count):
+        self.checkpointer.records_written(count)
+
+    def update(self, state): # pylint: disable=unused-argument
+        self.checkpointer.update(self.state)
+
+    def checkpoint(self, state): # pylint: disable=unused-argument
+        self.checkpointer.checkpoint(self.state)
+
+
+# Splits the (location group x date range) space of a backfill into shards of shard_days,
+#   from start_date through end_date, and assigns them round-robin to shard_count processes
+#   (or hosts). Every process must use the same locations, start_date, end_date, shard_days
+#   and shard_count, so they all derive the same plan.
+class BackfillPlan(object):
+    def __init__(self,
+                 location_groups,
+                 start_date,
+                 end_date,
+                 shard_days=DEFAULT_SHARD_DAYS,
+                 shard_count=1,
+                 shard_index=0):
+        if not 0 <= shard_index < shard_count:
+            raise ValueError('Invalid backfill_shard_index: {}, must be 0 to {}'.format(
+                shard_index, shard_count - 1))
+        self.location_groups = location_groups
+        self.start_date = start_date[0:10]
+        self.end_date = end_date[0:10]
+        self.shard_days = shard_days
+        self.shard_count = shard_count
+        self.shard_index = shard_index
+
+    # Backfill mode is enabled by config backfill_shard_count; None otherwise
+    @classmethod
+    def from_config(cls, config, location_groups):
+        shard_count = config.get('backfill_shard_count')
+        if not shard_count:
+            return None
+        end_date = config.get('backfill_end_date')
+        if not end_date:
+            raise ValueError('backfill_end_date is required with backfill_shard_count')
+        return cls(
+            location_groups=location_groups,
+            start_date=config.get('start_date'),
+            end_date=end_date,
+            shard_days=int(config.get('backfill_shard_days', DEFAULT_SHARD_DAYS)),
+            shard_count=int(shard_count),
+            shard_index=int(config.get('backfill_shard_index', 0)))
+
+    def get_date_ranges(self):
+        start_dt = datetime.strptime(self.start_date, '%Y-%m-%d').date()
+        end_dt = datetime.strptime(self.end_date, '%Y-%m-%d').date()
+        date_ranges = []
+        while start_dt <= end_dt:
+            range_end_dt = min(start_dt + timedelta(days=self.shard_days - 1), end_dt)
+            date_ranges.append((str(start_dt), str(range_end_dt)))
+            start_dt = range_end_dt + timedelta(days=1)
+        return date_ranges
+
+    # All shards, by location group, then date
+    def get_shards(self):
+        return [Shard(location_group, '{}T00:00:00Z'.format(range_start), range_end) \
+            for location_group in self.location_groups \
+                for range_start, range_end in self.get_date_ranges()]
+
+    # Shards of this process (backfill_shard_index)
+    def get_assigned_shards(self):
+        shards = self.get_shards()[self.shard_index::self.shard_count]
+        LOGGER.info('Backfill shard {} of {}: {} shards, {} through {}'.format(
+            self.shard_index, self.shard_count, len(shards), self.start_date, self.end_date))
+        return shards
+
+    # Merge the shard states of all processes into per-location bookmarks: for each stream
+    #   and location, the bookmark is where its contiguous, synced date ranges end, from
+    #   start_date (the last complete shard, or the progress of the first incomplete one).
+    # Bookmarks already in state are kept if they are later.
+    def merge_states(self, shard_states, state=None):
+        merged_state = json.loads(json.dumps(state or {}))
+        merged_state.pop('backfill', None)
+        backfill_state = {}
+        for shard_state in shard_states:
+            backfill_state.update(shard_state.get('backfill', {}))
+        stream_names = sorted(set(stream_name for value in backfill_state.values() \
+            for stream_name in value.get('bookmarks', {})))
+
+        bookmarks = merged_state.setdefault('bookmarks', {})
+        incomplete = 0
+        for location_group in self.location_groups:
+            shards = [shard for shard in self.get_shards() \
+                if shard.location_group is location_group]
+            for stream_name in stream_names:
+                for location in location_group.members:
+                    bookmark = None
+                    for shard in shards:
+                        shard_state = backfill_state.get(shard.key, {})
+                        shard_bookmark = shard_state.get('bookmarks', {}).get(
+                            stream_name, {}).get(location.key)
+                        if shard_bookmark:
+                            bookmark = shard_bookmark
+                        if not shard_state.get('complete'):
+                            incomplete = incomplete + 1
+                            break
+                    if bookmark is None:
+                        continue
+                    stream_bookmarks = bookmarks.setdefault(stream_name, {})
+                    if stream_bookmarks.get(location.key, '') < bookmark:
+                        stream_bookmarks[location.key] = bookmark
+        if incomplete:
+            LOGGER.warning('Backfill: {} stream locations are not complete, bookmarked where '
+                           'their synced date ranges end'.format(incomplete))
+        return merged_state
+
+
+def read_json(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Plan backfill shards, or merge the states of backfill shards')
+    parser.add_argument('command', choices=['plan', 'merge'])
+    parser.add_argument('-c', '--config', required=True, help='Tap config file')
+    parser.add_argument('-s', '--state', help='merge: tap state to merge the shard states into')
+    parser.add_argument('shard_states', nargs='*', help='merge: shard state files')
+    # Intermixed: the shard state files may follow the options (see README)
+    return parser.parse_intermixed_args()
+
+
+# tap-darksky-backfill plan: prints the shards of each backfill_shard_index, as JSON lines
+# tap-darksky-backfill merge: prints the merged tap state, for the next (normal) sync
+def main():
+    args = parse_args()
+    config = read_json(args.config)
+    config.setdefault('backfill_shard_count', 1)
+    location_groups = LocationRegistry.from_config(config).get_groups()
+    plan = BackfillPlan.from_config(config, location_groups)
+
+    if args.command == 'plan':
+        for shard_number, shard in enumerate(plan.get_shards()):
+            sys.stdout.write(json.dumps({
+                'backfill_shard_index': shard_number % plan.shard_count,
+                'shard': shard.key,
+                'locations': [location.key for location in shard.location_group.members]
+            }) + '\n')
+    else:
+        state = read_json(args.state) if args.state else {}
+        shard_states = [read_json(path) for path in args.shard_states]
+        json.dump(plan.merge_states(shard_states, state), sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import datetime
+import gzip
+import os
+import pathlib
+
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_BATCH_STREAMS = ['forecast']
+DEFAULT_BATCH_MB = 100
+COMPRESS_LEVEL = 6
+
+# Encoding of the batch files, in BATCH messages
+BATCH_ENCODING = {'format': 'jsonl', 'compression': 'gzip'}
+
+
+# Batch files of one stream: records as JSON lines, gzip-compressed. Written to a .part file,
+#   renamed when finished, so a finished file is always complete.
+class BatchFile(object):
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.records = 0
+        self.__file = gzip.open(path + '.part', 'wb', compresslevel=COMPRESS_LEVEL)
+
+    def write(self, lines):
+        self.__file.write(lines)
+        self.size = self.size + len(lines)
+        self.records = self.records + lines.count(b'\n')
+
+    def finish(self):
+        self.__file.close()
+        os.replace(self.path + '.part', self.path)
+        return pathlib.Path(self.path).absolute().as_uri()
+
+
+# Batch mode (config batch_path): records of the batch streams are written to local
+#   gzip-compressed JSONL files of about max_bytes (uncompressed) each, in path, instead of
+#   RECORD messages; each finished file is announced by a BATCH message (see
+#   output.MessageWriter), so targets can bulk-load it.
+# Files are named {stream}-{run}-{sequence}.jsonl.gz, run being the UTC start time of the sync.
+class BatchFiles(object):
+    def __init__(self, path, streams=None, max_bytes=DEFAULT_BATCH_MB * 1024 * 1024):
+        self.path = path
+        self.streams = streams or DEFAULT_BATCH_STREAMS
+        self.max_bytes = max_bytes
+        self.files = 0
+        self.records = 0
+        self.__run = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        self.__open = {}
+        os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        path = config.get('batch_path')
+        if not path:
+            return None
+        streams = config.get('batch_streams', DEFAULT_BATCH_STREAMS)
+        if isinstance(streams, str):
+            streams = [stream.strip() for stream in streams.split(',') if stream.strip()]
+        return cls(
+            path=path,
+            streams=streams,
+            max_bytes=int(float(config.get('batch_size_mb', DEFAULT_BATCH_MB)) * 1024 * 1024))
+
+    def has_records(self):
+        return bool(self.__open)
+
+    # Write serialized record lines to the open file of the stream; returns True once the
+    #   file is full (to be finished, see finish)
+    def write(self, stream_name, lines):
+        batch_file = self.__open.get(stream_name)
+        if batch_file is None:
+            self.files = self.files + 1
+            batch_file = BatchFile(os.path.join(self.path, '{}-{}-{:05d}.jsonl.gz'.format(
+                stream_name, self.__run, self.files)))
+            self.__open[stream_name] = batch_file
+        batch_file.write(lines)
+        return batch_file.size >= self.max_bytes
+
+    # Finish all open files; returns [(stream_name, [file URL])]
+    def finish(self):
+        finished = []
+        for stream_name, batch_file in self.__open.items():
+            url = batch_file.finish()
+            self.records = self.records + batch_file.records
+            LOGGER.info('Batch file for stream {}: {}, {} records'.format(
+                stream_name, url, batch_file.records))
+            finished.append((stream_name, [url]))
+        self.__open = {}
+        return finished
@@ -0,0 +1,195 @@
+import json
+import sqlite3
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_MMAP_MB = 256
+
+# Stream key of other per-location values (see BookmarkStore.get_value): {kind}:{stream}
+VALUE_KEY_SEPARATOR = ':'
+
+
+def get_value_key(kind, stream):
+    return '{}{}{}'.format(kind, VALUE_KEY_SEPARATOR, stream)
+
+
+def is_value_key(stream):
+    return VALUE_KEY_SEPARATOR in stream
+
+
+# Per-location bookmarks in a local SQLite table (config bookmark_store_path), instead of
+#   inline in the Singer state, so state size and checkpoint cost stay flat with the number
+#   of locations. The table is keyed (and sorted) by stream and location, and memory-mapped.
+# The Singer state only keeps a summary (bookmark_store): the checkpoint of the last STATE
+#   message, and the earliest bookmark (watermark) of each stream.
+# Bookmarks are written to the table when STATE is written (see commit), tagged with a new
+#   checkpoint; on start, bookmarks of checkpoints later than the state's (STATE messages the
+#   target did not confirm) are rolled back to their values before that run (or removed, if
+#   they had none, to sync from start_date), so the table never runs ahead of the state the
+#   tap is started with.
+# If the table lost confirmed bookmarks (e.g. it was deleted or restored from a backup),
+#   locations without a bookmark sync from their stream's watermark (kept in the summary as
+#   fallback, see get_fallback), not from start_date, until as many locations as the stream
+#   had (kept in the summary as locations) have a bookmark again; locations added after that
+#   sync from start_date.
+# Bookmarks missing from the table are read from the inline state bookmarks (earlier
+#   versions), and moved to the table when they are next written.
+# Other per-location values of the state (e.g. fetched days, see intervals.GapTracker, and
+#   record hashes, see dedup.RecordDedup) are kept in the same table, as JSON (see get_value),
+#   so they are committed and rolled back with the bookmarks; they have no watermarks.
+# Thread-safe: one connection, shared by all threads under a lock.
+class BookmarkStore(object):
+    def __init__(self, path, state, mmap_bytes=DEFAULT_MMAP_MB * 1024 * 1024):
+        self.path = path
+        summary = state.get('bookmark_store', {})
+        self.confirmed = int(summary.get('checkpoint', 0))
+        self.watermarks = dict(summary.get('watermarks', {}))
+        self.locations = dict(summary.get('locations', {}))
+        self.fallback = dict(summary.get('fallback', {}))
+        self.checkpoint = self.confirmed
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('PRAGMA mmap_size = {}'.format(int(mmap_bytes)))
+        for table in ['bookmarks', 'history']:
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} (stream TEXT, location TEXT, value TEXT, '
+                'checkpoint INTEGER, PRIMARY KEY (stream, location)) WITHOUT ROWID'.format(table))
+        self.__connection.execute(
+            'CREATE INDEX IF NOT EXISTS bookmarks_value ON bookmarks (stream, value)')
+        self.__connection.commit()
+        if self.__recover():
+            LOGGER.warning('Bookmark store {} is behind the state (checkpoint {}): locations '
+                           'without a bookmark sync from their stream watermark'.format(
+                               path, self.confirmed))
+            for stream, watermark in self.watermarks.items():
+                if self.__count(stream) < self.locations.get(stream, 0):
+                    self.fallback[stream] = min(
+                        [value for value in [watermark, self.fallback.get(stream)] if value])
+
+    # Bookmark store is enabled by config bookmark_store_path; None otherwise
+    @classmethod
+    def from_config(cls, config, state):
+        path = config.get('bookmark_store_path')
+        if not path:
+            return None
+        return cls(
+            path=path,
+            state=state,
+            mmap_bytes=int(float(config.get('bookmark_store_mmap_mb', DEFAULT_MMAP_MB)) * \
+                1024 * 1024))
+
+    # Roll back bookmarks written after the confirmed checkpoint; returns True if the table
+    #   is behind the confirmed checkpoint (lost bookmarks)
+    def __recover(self):
+        with self.__lock:
+            last_checkpoint = self.__connection.execute(
+                'SELECT COALESCE(MAX(checkpoint), 0) FROM bookmarks').fetchone()[0]
+            unconfirmed = self.__connection.execute(
+                'SELECT COUNT(*) FROM bookmarks WHERE checkpoint > ?',
+                (self.confirmed,)).fetchone()[0]
+            if unconfirmed:
+                LOGGER.info('Bookmark store: rolling back {} unconfirmed bookmarks'.format(
+                    unconfirmed))
+                self.__connection.execute(
+                    'INSERT OR REPLACE INTO bookmarks (stream, location, value, checkpoint) '
+                    'SELECT history.stream, history.location, history.value, history.checkpoint '
+                    'FROM history JOIN bookmarks USING (stream, location) '
+                    'WHERE bookmarks.checkpoint > ?', (self.confirmed,))
+                # Bookmarks first written after the confirmed checkpoint: removed, as the
+                #   location had none in the state (it syncs from start_date)
+                self.__connection.execute(
+                    'DELETE FROM bookmarks WHERE checkpoint > ?', (self.confirmed,))
+            self.__connection.execute('DELETE FROM history')
+            self.__connection.commit()
+        return last_checkpoint < self.confirmed
+
+    # Number of locations with a bookmark of a stream in the table
+    def __count(self, stream):
+        return self.__connection.execute(
+            'SELECT COUNT(*) FROM bookmarks WHERE stream = ?', (stream,)).fetchone()[0]
+
+    # Bookmark of a stream and location; None if it has none
+    def get(self, stream, location):
+        with self.__lock:
+            value = self.__pending.get((stream, location))
+            if value is None:
+                row = self.__connection.execute(
+                    'SELECT value FROM bookmarks WHERE stream = ? AND location = ?',
+                    (stream, location)).fetchone()
+                value = row[0] if row else None
+        return value
+
+    # Bookmark of the locations of a stream without one (neither in the table nor inline in
+    #   the state), while the table is missing lost bookmarks of the stream; None otherwise
+    def get_fallback(self, stream):
+        return self.fallback.get(stream)
+
+    # Set a bookmark, written to the table with the next STATE message (see commit)
+    def set(self, stream, location, value):
+        with self.__lock:
+            self.__pending[(stream, location)] = value
+
+    # Other per-location value of a kind (e.g. fetched_days); None if it has none
+    def get_value(self, kind, stream, location):
+        value = self.get(get_value_key(kind, stream), location)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    # Set another per-location value (JSON), written with the bookmarks (see commit)
+    def set_value(self, kind, stream, location, value):
+        self.set(get_value_key(kind, stream), location, json.dumps(value, sort_keys=True))
+
+    # Write the pending bookmarks with a new checkpoint, and update the state summary;
+    #   called just before the state is written (see checkpoint.StateCheckpointer)
+    def commit(self, state):
+        with self.__lock:
+            if self.__pending:
+                checkpoint = self.checkpoint + 1
+                rows = [(stream, location, value, checkpoint) \
+                    for (stream, location), value in sorted(self.__pending.items())]
+                # Keep the confirmed bookmarks, to roll back to (see __recover)
+                self.__connection.executemany(
+                    'INSERT OR IGNORE INTO history (stream, location, value, checkpoint) '
+                    'SELECT stream, location, value, checkpoint FROM bookmarks '
+                    'WHERE stream = ? AND location = ? AND checkpoint <= ?',
+                    [(stream, location, self.confirmed) for stream, location, _, _ in rows])
+                self.__connection.executemany(
+                    'INSERT OR REPLACE INTO bookmarks (stream, location, value, checkpoint) '
+                    'VALUES (?, ?, ?, ?)', rows)
+                for stream in set(row[0] for row in rows if not is_value_key(row[0])):
+                    count = self.__count(stream)
+                    if stream in self.fallback:
+                        if count < self.locations.get(stream, 0):
+                            # Lost bookmarks not written again yet
+                            count = self.locations[stream]
+                        else:
+                            del self.fallback[stream]
+                    self.locations[stream] = count
+                    self.watermarks[stream] = min([value for value in [
+                        self.__connection.execute(
+                            'SELECT MIN(value) FROM bookmarks WHERE stream = ?',
+                            (stream,)).fetchone()[0],
+                        self.fallback.get(stream)] if value])
+                self.__connection.commit()
+                self.checkpoint = checkpoint
+                self.__pending = {}
+        state['bookmark_store'] = {
+            'checkpoint': self.checkpoint,
+            'watermarks': dict(self.watermarks),
+            'locations': dict(self.locations)
+        }
+        if self.fallback:
+            state['bookmark_store']['fallback'] = dict(self.fallback)
+
+    def close(self):
+        with self.__lock:
+            count = self.__connection.execute(
+                "SELECT COUNT(*) FROM bookmarks WHERE stream NOT LIKE '%{}%'".format(
+                    VALUE_KEY_SEPARATOR)).fetchone()[0]
+            self.__connection.close()
+        LOGGER.info('Bookmark store: {} bookmarks, checkpoint {}'.format(count, self.checkpoint))
@@ -0,0 +1,150 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+import zlib
+
+import singer
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+
+# Time Machine responses for days that have ended in every timezone never change.
+def is_immutable_date(forecast_date):
+    oldest_mutable = datetime.datetime.utcnow().date() - datetime.timedelta(days=1)
+    return forecast_date[0:10] < str(oldest_mutable)
+
+
+# Parts of a forecast URL: (latitude, longitude, forecast_date, sorted exclude list, lang,
+#   units); None if the URL is not a location-day request.
+def parse_forecast_url(url):
+    split_url = urlsplit(url)
+    location_date = split_url.path.rstrip('/').split('/')[-1].split(',')
+    if len(location_date) != 3:
+        return None
+    latitude, longitude, forecast_date = location_date
+    params = dict(parse_qsl(split_url.query))
+    exclude = sorted(filter(None, params.get('exclude', '').split(',')))
+    return latitude, longitude, forecast_date, exclude, params.get('lang'), params.get('units')
+
+
+# Cache key for a forecast URL: location, forecast_date, exclude list, lang and units.
+# Returns (key, forecast_date); (None, None) if the URL is not a location-day request.
+def get_cache_key(url):
+    url_parts = parse_forecast_url(url)
+    if url_parts is None:
+        return None, None
+    return json.dumps(list(url_parts)), url_parts[2]
+
+
+# Persistent (SQLite) response cache for DarkskyClient.get, with LRU eviction.
+# get returns the cached JSON body (bytes), put stores decoded response data (or a raw JSON
+#   body: keys are converted to snake_case when decoding, either way).
+# Responses for past days are cached without expiry; today's and future days are only cached
+#   when ttl (seconds) is set, and expire after ttl.
+# Thread-safe: one connection, shared by all worker threads under a lock.
+class ResponseCache(object):
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024, ttl=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, body BLOB, size INTEGER, accessed REAL, expires REAL)')
+        self.__connection.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.__connection.commit()
+        self.__size = self.__connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @classmethod
+    def from_config(cls, config):
+        path = config.get('response_cache_path')
+        if not path:
+            return None
+        return cls(
+            path=path,
+            max_bytes=int(float(config.get('response_cache_max_mb', 1024)) * 1024 * 1024),
+            ttl=int(config.get('response_cache_ttl', 0)))
+
+    def get(self, url):
+        key, _ = get_cache_key(url)
+        if key is None:
+            return None
+        now = time.time()
+        with self.__lock:
+            row = self.__connection.execute(
+                'SELECT body, size, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row and row[2] is not None and row[2] <= now:
+                self.__delete(key, row[1])
+                row = None
+            if row is None:
+                self.misses = self.misses + 1
+                return None
+            self.__connection.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.__connection.commit()
+            self.hits = self.hits + 1
+        return zlib.decompress(row[0])
+
+    def put(self, url, data):
+        key, forecast_date = get_cache_key(url)
+        if key is None or not data:
+            return
+        now = time.time()
+        if is_immutable_date(forecast_date):
+            expires = None
+        elif self.ttl > 0:
+            expires = now + self.ttl
+        else:
+            return
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode('utf-8')
+        body = zlib.compress(data)
+        with self.__lock:
+            row = self.__connection.execute(
+                'SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row:
+                self.__size = self.__size - row[0]
+            self.__connection.execute(
+                'INSERT OR REPLACE INTO responses (key, body, size, accessed, expires) '
+                'VALUES (?, ?, ?, ?, ?)', (key, body, len(body), now, expires))
+            self.__size = self.__size + len(body)
+            self.__evict()
+            self.__connection.commit()
+
+    def __delete(self, key, size):
+        self.__connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+        self.__size = self.__size - size
+
+    # Remove least recently used responses until the cache fits in max_bytes
+    def __evict(self):
+        while self.__size > self.max_bytes:
+            rows = self.__connection.execute(
+                'SELECT key, size FROM responses ORDER BY accessed LIMIT 100').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.__size <= self.max_bytes:
+                    break
+                self.__delete(key, size)
+                self.evictions = self.evictions + 1
+
+    def close(self):
+        LOGGER.info('Response cache: {} hits, {} misses, {} evictions, {} bytes'.format(
+            self.hits, self.misses, self.evictions, self.__size))
+        for metric, value in [('response_cache_hits', self.hits),
+                              ('response_cache_misses', self.misses),
+                              ('response_cache_evictions', self.evictions)]:
+            with metrics.Counter(metric) as counter:
+                counter.increment(value)
+        with self.__lock:
+            self.__connection.close()
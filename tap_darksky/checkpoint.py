@@ -0,0 +1,73 @@
+import time
+
+import singer
+from tap_darksky.instrumentation import PhaseTimer
+
+LOGGER = singer.get_logger()
+
+# Checkpoint policies, config state_checkpoint_policy:
+#   every_update (default): write STATE on every bookmark update (each location-day)
+#   records: write STATE once at least state_checkpoint_interval records were written
+#   seconds: write STATE at most once per state_checkpoint_interval seconds
+#   stream_end: write STATE only at the end of each stream
+POLICIES = ['every_update', 'records', 'seconds', 'stream_end']
+
+
+# Coalesces STATE messages: bookmarks are updated in the state dict as before, but only
+#   written when the policy is due (or when forced at the end of a stream).
+# The state dict is only updated after the records it covers are written, so an emitted
+#   STATE never runs ahead of the records.
+# bookmark_store: optional bookmarks.BookmarkStore, committed with each STATE message
+class StateCheckpointer(object):
+    def __init__(self, writer, policy='every_update', interval=None, phase_timer=None,
+                 bookmark_store=None):
+        if policy not in POLICIES:
+            raise ValueError('Invalid state_checkpoint_policy: {}, must be one of: {}'.format(
+                policy, ', '.join(POLICIES)))
+        self.writer = writer
+        self.policy = policy
+        self.interval = float(interval or 0)
+        self.records = 0
+        self.last_checkpoint = time.time()
+        self.dirty = False
+        self.phase_timer = phase_timer or PhaseTimer(enabled=False)
+        self.bookmark_store = bookmark_store
+
+    @classmethod
+    def from_config(cls, config, writer, phase_timer=None, bookmark_store=None):
+        return cls(
+            writer=writer,
+            policy=config.get('state_checkpoint_policy', 'every_update'),
+            interval=config.get('state_checkpoint_interval'),
+            phase_timer=phase_timer,
+            bookmark_store=bookmark_store)
+
+    def records_written(self, count):
+        self.records = self.records + count
+
+    def is_due(self):
+        if self.policy == 'every_update':
+            return True
+        if self.policy == 'records':
+            return self.records >= self.interval
+        if self.policy == 'seconds':
+            return time.time() - self.last_checkpoint >= self.interval
+        return False
+
+    # State was updated (bookmark or currently_syncing): write it if the policy is due
+    def update(self, state):
+        self.dirty = True
+        if self.is_due():
+            self.checkpoint(state)
+
+    # Write state now (if it changed since the last checkpoint)
+    def checkpoint(self, state):
+        if not self.dirty:
+            return
+        with self.phase_timer.phase('write_state'):
+            if self.bookmark_store:
+                self.bookmark_store.commit(state)
+            self.writer.write_state(state)
+        self.records = 0
+        self.last_checkpoint = time.time()
+        self.dirty = False
@@ -1,12 +1,16 @@
-import backoff
 import requests
 from requests.exceptions import ConnectionError
-from singer import metrics, utils
-from singer.utils import strftime
+from singer import metrics
 import singer
+from tap_darksky.instrumentation import PhaseTimer
+from tap_darksky.ratelimit import RateLimiter
+from tap_darksky.retry import call_with_retries, CircuitBreaker
+from tap_darksky.transform import decode_json
 
 LOGGER = singer.get_logger()
 
+DEFAULT_POOL_MAXSIZE = requests.adapters.DEFAULT_POOLSIZE
+
 
 class Server5xxError(Exception):
     pass
@@ -20,6 +24,10 @@ class DarkskyError(Exception):
     pass
 
 
+class DarkskyQuotaExceededError(DarkskyError):
+    pass
+
+
 class DarkskyBadRequestError(DarkskyError):
     pass
 
@@ -58,6 +66,20 @@ ERROR_CODE_EXCEPTION_MAPPING = {
     500: DarkskyInternalServiceError}
 
 
+# Retry policies by error class (see retry.call_with_retries):
+#   tries: attempts made inline, with exponential backoff of factor seconds
+#   defer: once the tries are used up, retry the location later (see retry.DeferredRetryQueue)
+#     instead of failing the sync
+#   trip: count towards the circuit breaker (see retry.CircuitBreaker)
+# Other errors (e.g. 400, 401, 403, 404 in ERROR_CODE_EXCEPTION_MAPPING) are not retried.
+# 429 responses already pause all requests for Retry-After (see check_rate_limit).
+ERROR_RETRY_POLICIES = {
+    Server5xxError: {'tries': 3, 'factor': 1, 'defer': True, 'trip': True},
+    DarkskyInternalServiceError: {'tries': 3, 'factor': 1, 'defer': True, 'trip': True},
+    ConnectionError: {'tries': 3, 'factor': 1, 'defer': True, 'trip': True},
+    Server429Error: {'tries': 3, 'factor': 1, 'defer': True, 'trip': False}}
+
+
 def get_exception_for_error_code(status_code):
     return ERROR_CODE_EXCEPTION_MAPPING.get(status_code, DarkskyError)
 
@@ -83,66 +105,69 @@ def raise_for_error(response):
 class DarkskyClient(object):
     def __init__(self,
                  secret_key,
-                 user_agent=None):
+                 user_agent=None,
+                 max_workers=1,
+                 rate_limiter=None,
+                 cache=None,
+                 phase_timer=None,
+                 archive=None,
+                 circuit_breaker=None):
         self.__secret_key = secret_key
         self.__user_agent = user_agent
+        self.__rate_limiter = rate_limiter or RateLimiter()
+        self.__circuit_breaker = circuit_breaker or CircuitBreaker(
+            pause=self.__rate_limiter.pause, threshold=0)
+        self.__cache = cache
+        self.__archive = archive
+        self.__phase_timer = phase_timer or PhaseTimer(enabled=False)
         self.__session = requests.Session()
+        if max_workers > DEFAULT_POOL_MAXSIZE:
+            # Keep one pooled connection per worker thread (see sync max_workers)
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+            self.__session.mount('https://', adapter)
+            self.__session.mount('http://', adapter)
         self.base_url = 'https://api.darksky.net'
-        self.__verified = False
 
+    # There is no separate secret_key check: an invalid key fails the first request (see request)
     def __enter__(self):
-        self.__verified = self.check_secret_key()
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
         self.__session.close()
-
-    @backoff.on_exception(backoff.expo,
-                          Server5xxError,
-                          max_tries=7,
-                          factor=3)
-    def check_secret_key(self):
-        if self.__secret_key is None:
-            raise Exception('Error: Missing secret_key.')
-        headers = {}
-        if self.__user_agent:
-            headers['User-Agent'] = self.__user_agent
-        headers['Accept'] = 'application/json'
-        endpoint = 'forecast'
-        location = '38.840544,-105.0444233'
-        now_date = strftime(utils.now())[0:10]
-        param_string = 'exclude=currently,minutely,hourly,daily,alerts,flags&lang=en&units=us'
-        url = '{}/{}/{}/{},{}T00:00:00?{}'.format(
-            self.base_url,
-            endpoint,
-            self.__secret_key,
-            location,
-            now_date,
-            param_string)
-        response = self.__session.get(
-            # Simple endpoint that returns 1 record (to check API secret_key access):
-            url=url,
-            headers=headers)
-        if response.status_code != 200:
-            LOGGER.error('Error status_code = {}'.format(response.status_code))
-            raise_for_error(response)
-        else:
-            resp = response.json()
-            if 'latitude' in resp:
-                return True
-            else:
-                return False
-
-
-    @backoff.on_exception(backoff.expo,
-                          (Server5xxError, ConnectionError, Server429Error),
-                          max_tries=7,
-                          factor=3)
-    @utils.ratelimit(800, 60)
-    def request(self, method, url, **kwargs):
-        if not self.__verified:
-            self.__verified = self.check_secret_key()
-
+        if self.__cache:
+            self.__cache.close()
+        if self.__archive:
+            self.__archive.close()
+
+    def acquire_rate_limit(self):
+        with self.__phase_timer.phase('rate_limit'):
+            acquired = self.__rate_limiter.acquire()
+        if not acquired:
+            raise DarkskyQuotaExceededError(
+                'Daily API call limit of {} reached.'.format(self.__rate_limiter.call_limit))
+
+    # Update the shared rate limiter from the response headers; on 429, pause all requests
+    #   for Retry-After seconds (default: one rate limit period) and raise to retry
+    def check_rate_limit(self, response):
+        self.__rate_limiter.update_from_headers(response.headers)
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                retry_after = self.__rate_limiter.period
+            self.__rate_limiter.pause(retry_after)
+            raise Server429Error()
+
+    # Errors are retried by their policy in ERROR_RETRY_POLICIES
+    # decode: return the decoded JSON response, or the raw response body (bytes) if False
+    # projection_keys: optional keys to keep while decoding (see transform.decode_json)
+    def request(self, method, url, decode=True, projection_keys=None, **kwargs):
+        return call_with_retries(
+            lambda: self.__request(method, url, decode, projection_keys, **kwargs),
+            ERROR_RETRY_POLICIES,
+            self.__circuit_breaker)
+
+    def __request(self, method, url, decode, projection_keys, **kwargs):
         url = url.replace('<secret_key>', self.__secret_key)
 
         if 'endpoint' in kwargs:
@@ -161,20 +186,55 @@ class DarkskyClient(object):
         if method == 'POST':
             kwargs['headers']['Content-Type'] = 'application/json'
 
-        with metrics.http_request_timer(endpoint) as timer:
-            response = self.__session.request(method, url, **kwargs)
+        self.acquire_rate_limit()
+        with metrics.http_request_timer(endpoint) as timer, \
+            self.__phase_timer.phase('request'):
+            # Stream the body, to decode it incrementally (see decode_json)
+            response = self.__session.request(method, url, stream=True, **kwargs)
             timer.tags[metrics.Tag.http_status_code] = response.status_code
 
-        if response.status_code >= 500:
-            raise Server5xxError()
-
-        if response.status_code != 200:
-            raise_for_error(response)
-
-        return response.json()
-
-    def get(self, url, **kwargs):
-        return self.request('GET', url=url, **kwargs)
+        with response:
+            self.check_rate_limit(response)
+
+            if response.status_code >= 500:
+                raise Server5xxError()
+
+            if response.status_code != 200:
+                # An invalid secret_key fails here, on the first request (401/403)
+                raise_for_error(response)
+
+            if not decode:
+                return response.content
+            # Keys are converted to snake_case while decoding
+            response.raw.decode_content = True
+            with self.__phase_timer.phase('decode'):
+                return decode_json(response.raw, projection_keys)
+
+    # GET, served from the response cache (if any) for location-day requests; API responses
+    #   are also archived, if a response archive is set (see archive.py)
+    # Returns the decoded response, with keys converted to snake_case (see decode_json),
+    #   or the raw (or cached) JSON body if decode is False
+    def get(self, url, decode=True, projection_keys=None, **kwargs):
+        if not self.__cache and not self.__archive:
+            return self.request('GET', url=url, decode=decode, projection_keys=projection_keys,
+                                **kwargs)
+        body = None
+        if self.__cache:
+            with self.__phase_timer.phase('cache'):
+                body = self.__cache.get(url)
+        if body is None:
+            # Cache (and archive) the full response body, not its (projected) decoded data
+            body = self.request('GET', url=url, decode=False, **kwargs)
+            if self.__cache:
+                with self.__phase_timer.phase('cache'):
+                    self.__cache.put(url, body)
+            if self.__archive:
+                with self.__phase_timer.phase('archive'):
+                    self.__archive.put(url, body)
+        if not decode:
+            return body
+        with self.__phase_timer.phase('decode'):
+            return decode_json(body, projection_keys)
 
     def post(self, url, **kwargs):
         return self.request('POST', url=url, **kwargs)
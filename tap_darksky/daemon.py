@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+from contextlib import contextmanager
+import copy
+import datetime
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import singer
+from tap_darksky import check_location_config, create_client, REQUIRED_CONFIG_KEYS
+from tap_darksky.client import DarkskyPaymentRequiredError, DarkskyForbiddenError, \
+    DarkskyUnauthorizedError
+from tap_darksky.instrumentation import PhaseTimer, SamplingProfiler
+from tap_darksky.output import MessageWriter
+from tap_darksky.sync import sync
+from tap_darksky.units import UnitConverter
+from tap_darksky.workers import TransformPool
+
+LOGGER = singer.get_logger()
+
+# Seconds between the starts of scheduled syncs, by default (config daemon_interval)
+DEFAULT_INTERVAL = 900
+
+# Output files kept, by default (config daemon_output_keep): one day of 15-minute syncs
+DEFAULT_OUTPUT_KEEP = 96
+
+# Errors that a later sync cannot recover from: the daemon stops
+FATAL_ERRORS = (DarkskyUnauthorizedError, DarkskyForbiddenError, DarkskyPaymentRequiredError)
+
+
+# Output of each sync of the daemon:
+#   path (config daemon_output_path): a new file per sync, in the path directory, named
+#     sync-{UTC start time}-{sequence}.jsonl (written as .part, renamed when the sync
+#     completes, removed if it fails); only the newest keep files are kept
+#   socket_path (config daemon_output_socket): a connection per sync to a local (Unix domain)
+#     socket, e.g. a target listening on it
+# Without either, messages are written to stdout, as by the tap.
+class DaemonOutput(object):
+    def __init__(self, path=None, socket_path=None, keep=DEFAULT_OUTPUT_KEEP):
+        self.path = path
+        self.socket_path = socket_path
+        self.keep = keep
+        self.files = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            path=config.get('daemon_output_path'),
+            socket_path=config.get('daemon_output_socket'),
+            keep=int(config.get('daemon_output_keep', DEFAULT_OUTPUT_KEEP)))
+
+    # Text stream (with a binary buffer, see output.MessageWriter) for the messages of a sync
+    @contextmanager
+    def open(self):
+        if self.socket_path:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(self.socket_path)
+            try:
+                with io.TextIOWrapper(connection.makefile('wb'), encoding='utf-8') as stream:
+                    yield stream
+            finally:
+                connection.close()
+        elif self.path:
+            self.files = self.files + 1
+            file_path = os.path.join(self.path, 'sync-{}-{:05d}.jsonl'.format(
+                datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'), self.files))
+            try:
+                with open(file_path + '.part', 'w', encoding='utf-8') as stream:
+                    yield stream
+            except BaseException:
+                # The output of a failed sync is never published
+                os.remove(file_path + '.part')
+                raise
+            os.replace(file_path + '.part', file_path)
+            self.rotate()
+        else:
+            yield sys.stdout
+
+    # Remove all but the newest keep output files
+    def rotate(self):
+        files = sorted(name for name in os.listdir(self.path) \
+            if name.startswith('sync-') and name.endswith('.jsonl'))
+        for name in files[:max(len(files) - self.keep, 0)]:
+            os.remove(os.path.join(self.path, name))
+
+
+# Long-running sync: keeps the API client (session, pooled TLS connections, rate limiter,
+#   response cache), the parsed catalog, transform worker processes and module caches
+#   (schemas, timezones) warm, and syncs every interval seconds, or at once on a local
+#   trigger (SIGUSR1). SIGTERM or SIGINT stop it after the current sync.
+# The state of the last completed sync is kept in memory, and in state_path (config
+#   daemon_state_path), to resume from after a restart; a failed sync is retried (from that
+#   state) at the next scheduled time.
+class Daemon(object):
+    def __init__(self, config, catalog, state, interval=DEFAULT_INTERVAL, output=None,
+                 state_path=None):
+        self.config = config
+        self.catalog = catalog
+        self.state = state
+        self.interval = interval
+        self.output = output or DaemonOutput()
+        self.state_path = state_path
+        self.syncs = 0
+        self.__trigger = threading.Event()
+        self.__stopping = False
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as file:
+                self.state = json.load(file)
+            LOGGER.info('Daemon state read from {}'.format(state_path))
+
+    @classmethod
+    def from_config(cls, config, catalog, state):
+        return cls(
+            config=config,
+            catalog=catalog,
+            state=state,
+            interval=float(config.get('daemon_interval', DEFAULT_INTERVAL)),
+            output=DaemonOutput.from_config(config),
+            state_path=config.get('daemon_state_path'))
+
+    # Sync now (e.g. from a signal handler)
+    def trigger(self, *args): # pylint: disable=unused-argument
+        self.__trigger.set()
+
+    # Stop after the current sync (e.g. from a signal handler)
+    def stop(self, *args): # pylint: disable=unused-argument
+        self.__stopping = True
+        self.__trigger.set()
+
+    def run(self):
+        signal.signal(signal.SIGUSR1, self.trigger)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        phase_timer = PhaseTimer.from_config(self.config)
+        client = create_client(self.config, phase_timer)
+        # Transform workers get the catalog of each sync: with a units field, in multi-unit mode
+        catalog = self.catalog
+        if UnitConverter.from_config(self.config):
+            catalog = UnitConverter.get_catalog(catalog)
+        transform_pool = TransformPool.from_config(self.config, catalog)
+        try:
+            with SamplingProfiler.from_config(self.config), client:
+                next_sync = time.time()
+                while not self.__stopping:
+                    wait = next_sync - time.time()
+                    if wait > 0:
+                        self.__trigger.wait(wait)
+                    if self.__stopping:
+                        break
+                    self.__trigger.clear()
+                    next_sync = time.time() + self.interval
+                    self.sync_once(client, phase_timer, transform_pool)
+        finally:
+            if transform_pool:
+                transform_pool.close()
+        LOGGER.info('Daemon stopped after {} syncs'.format(self.syncs))
+
+    def sync_once(self, client, phase_timer, transform_pool=None):
+        state = copy.deepcopy(self.state)
+        phase_timer.reset()
+        started = time.time()
+        try:
+            with self.output.open() as stream:
+                sync(client=client,
+                     config=self.config,
+                     catalog=self.catalog,
+                     state=state,
+                     writer=MessageWriter.from_config(self.config, stream),
+                     phase_timer=phase_timer,
+                     transform_pool=transform_pool)
+        except FATAL_ERRORS:
+            raise
+        except Exception as err: # pylint: disable=broad-except
+            LOGGER.error('Sync failed, retrying at the next sync: {}'.format(err))
+            return
+        self.state = state
+        self.syncs = self.syncs + 1
+        if self.state_path:
+            with open(self.state_path + '.tmp', 'w') as file:
+                json.dump(state, file)
+            os.replace(self.state_path + '.tmp', self.state_path)
+        LOGGER.info('Sync {} completed in {:.1f} seconds'.format(
+            self.syncs, time.time() - started))
+
+
+@singer.utils.handle_top_exception(LOGGER)
+def main():
+    parsed_args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
+    check_location_config(parsed_args.config)
+    if not parsed_args.catalog:
+        raise ValueError('tap-darksky-daemon requires a --catalog')
+    Daemon.from_config(
+        config=parsed_args.config,
+        catalog=parsed_args.catalog,
+        state=parsed_args.state or {}).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import hashlib
+
+import singer
+from tap_darksky.instrumentation import is_enabled
+from tap_darksky.output import dumps
+
+LOGGER = singer.get_logger()
+
+
+# Compact content hash (16 hex chars) of a list of records, without the ignored fields
+def hash_records(records, ignore_fields=None):
+    digest = hashlib.blake2b(digest_size=8)
+    for record in records:
+        if ignore_fields:
+            record = {key: value for key, value in record.items() if key not in ignore_fields}
+        digest.update(dumps(record))
+    return digest.hexdigest()
+
+
+# Hashes of the records last written for a location group: {stream: {location: {date: hash}}}
+# is_changed hashes the records of one stream, location and forecast date, and collects the
+#   new hash in updates (see pop_updates, RecordDedup.update). Picklable, for transform worker
+#   processes.
+class GroupRecordHashes(object):
+    def __init__(self, hashes, ignore_fields=None):
+        self.hashes = hashes
+        self.ignore_fields = ignore_fields
+        self.updates = {}
+
+    def is_changed(self, stream_name, location, bookmark_field, records):
+        date_key = str(records[0].get(bookmark_field))[0:10]
+        digest = hash_records(records, self.ignore_fields)
+        self.updates.setdefault(stream_name, {}).setdefault(location, {})[date_key] = digest
+        return self.hashes.get(stream_name, {}).get(location, {}).get(date_key) != digest
+
+    def pop_updates(self):
+        updates = self.updates
+        self.updates = {}
+        return updates
+
+
+# Suppresses records that were already written unchanged (config record_dedup).
+# Each run re-fetches the bookmark day (bookmarks are inclusive) and today; the content hash
+#   of the records written for each stream, location and forecast date is kept in the state
+#   (record_hashes), from the bookmark date on, and records whose hash did not change are
+#   not written again.
+# With a bookmark store (see bookmarks.BookmarkStore), the hashes are kept in its table with
+#   the bookmarks instead, so state size stays flat with the number of locations;
+#   record_hashes of the state (earlier versions) are moved to it as they are updated.
+# ignore_fields: volatile fields, left out of the hash (config record_dedup_ignore_fields)
+class RecordDedup(object):
+    def __init__(self, ignore_fields=None):
+        self.ignore_fields = set(ignore_fields or [])
+
+    # Record dedup is enabled by config record_dedup; None otherwise
+    @classmethod
+    def from_config(cls, config):
+        if not is_enabled(config.get('record_dedup'), False):
+            return None
+        ignore_fields = config.get('record_dedup_ignore_fields', [])
+        if isinstance(ignore_fields, str):
+            ignore_fields = [field.strip() for field in ignore_fields.split(',') if field.strip()]
+        return cls(ignore_fields)
+
+    # Hashes of a stream and location: {date: hash}
+    # bookmark_store: optional bookmarks.BookmarkStore, read before the state
+    @staticmethod
+    def get_hashes(state, stream_name, location, bookmark_store=None):
+        location_hashes = None
+        if bookmark_store:
+            location_hashes = bookmark_store.get_value('record_hashes', stream_name, location)
+        if location_hashes is None:
+            location_hashes = state.get('record_hashes', {}).get(stream_name, {}).get(location)
+        return dict(location_hashes or {})
+
+    # Set the hashes of a stream and location, in the bookmark_store (if any) or the state
+    @staticmethod
+    def set_hashes(state, stream_name, location, location_hashes, bookmark_store=None):
+        if bookmark_store:
+            bookmark_store.set_value('record_hashes', stream_name, location, location_hashes)
+            # Moved from the state (earlier versions)
+            record_hashes = state.get('record_hashes', {})
+            if location in record_hashes.get(stream_name, {}):
+                del record_hashes[stream_name][location]
+                if not record_hashes[stream_name]:
+                    del record_hashes[stream_name]
+                if not record_hashes:
+                    del state['record_hashes']
+            return
+        state.setdefault('record_hashes', {}).setdefault(stream_name, {})[location] = \
+            location_hashes
+
+    # Hashes of the location group, for its synced streams
+    def for_group(self, state, stream_names, location_group, bookmark_store=None):
+        hashes = {}
+        for stream_name in stream_names:
+            for location in location_group.members:
+                location_hashes = self.get_hashes(state, stream_name, location.key,
+                                                  bookmark_store)
+                if location_hashes:
+                    hashes.setdefault(stream_name, {})[location.key] = location_hashes
+        return GroupRecordHashes(hashes, self.ignore_fields)
+
+    # Store the hashes of the records written (GroupRecordHashes.pop_updates)
+    def update(self, state, updates, bookmark_store=None):
+        for stream_name, locations in updates.items():
+            for location, date_hashes in locations.items():
+                location_hashes = self.get_hashes(state, stream_name, location, bookmark_store)
+                location_hashes.update(date_hashes)
+                self.set_hashes(state, stream_name, location, location_hashes, bookmark_store)
+
+    # Drop the hashes of dates before the bookmark, which are not fetched again
+    def prune(self, state, stream_name, location, bookmark_value, bookmark_store=None):
+        if not bookmark_value:
+            return
+        location_hashes = self.get_hashes(state, stream_name, location, bookmark_store)
+        pruned_hashes = {date_key: digest for date_key, digest in location_hashes.items() \
+            if date_key >= bookmark_value[0:10]}
+        if len(pruned_hashes) < len(location_hashes):
+            self.set_hashes(state, stream_name, location, pruned_hashes, bookmark_store)
@@ -1,18 +1,28 @@
+import copy
+from functools import lru_cache
 from singer.catalog import Catalog, CatalogEntry, Schema
-from tap_darksky.schema import get_schemas, STREAMS
+from tap_darksky.schema import get_schemas
+from tap_darksky.streams import flatten_streams
 
+# Memoized: the catalog is built once per process (callers get a copy, since it is mutable)
 def discover():
+    return copy.deepcopy(build_catalog())
+
+
+@lru_cache(maxsize=None)
+def build_catalog():
     schemas, field_metadata = get_schemas()
+    flat_streams = flatten_streams()
     catalog = Catalog([])
 
     for stream_name, schema_dict in schemas.items():
-        schema = Schema.from_dict(schema_dict)
-        mdata = field_metadata[stream_name]
+        schema = Schema.from_dict(copy.deepcopy(schema_dict))
+        mdata = copy.deepcopy(field_metadata[stream_name])
 
         catalog.streams.append(CatalogEntry(
             stream=stream_name,
             tap_stream_id=stream_name,
-            key_properties=STREAMS[stream_name]['key_properties'],
+            key_properties=flat_streams[stream_name]['key_properties'],
             schema=schema,
             metadata=mdata
         ))
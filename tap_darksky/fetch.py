@@ -0,0 +1,164 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import islice
+import queue
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Items queued between pipeline stages, by default (see prefetch, config pipeline_queue_size)
+DEFAULT_PIPELINE_QUEUE_SIZE = 4
+
+# End of the items of a pipeline stage (see prefetch)
+STAGE_END = object()
+
+
+# Like executor.map, but lazy: at most window calls are submitted ahead of the consumer,
+#   so long task lists do not queue (or buffer) every request at once.
+# Results are yielded in task order; an exception is raised when its result is reached.
+def ordered_map(executor, func, tasks, window):
+    tasks = iter(tasks)
+    pending = deque(executor.submit(func, *task) for task in islice(tasks, window))
+    try:
+        while pending:
+            future = pending.popleft()
+            for task in islice(tasks, 1):
+                pending.append(executor.submit(func, *task))
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# Like ordered_map, but results of a group of tasks (group(task), e.g. a location) are yielded
+#   as they complete, in any order. Groups are yielded in task order: results of the next
+#   groups (submitted ahead, within the window) wait until the current group is done.
+def grouped_unordered_map(executor, func, tasks, group, window):
+    tasks = iter(tasks)
+    pending = deque()
+
+    def submit(count):
+        for task in islice(tasks, count):
+            pending.append((group(task), executor.submit(func, *task)))
+
+    submit(window)
+    try:
+        while pending:
+            current = pending[0][0]
+            futures = [future for key, future in pending if key == current]
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in futures:
+                if future in done:
+                    pending.remove((current, future))
+                    submit(1)
+                    yield future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+# Runs a pipeline stage (an iterable, e.g. fetching responses) in its own thread, up to
+#   queue_size items ahead of the consumer (e.g. transforming them): the stages overlap, and
+#   the bounded queue applies backpressure, so memory stays flat.
+# Items are yielded in order; an exception in the stage is raised when it is reached.
+# Closing the generator (e.g. after an early stop) stops the stage, and closes its iterable.
+def prefetch(items, queue_size):
+    output = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def put(item, error=None):
+        while not stopped.is_set():
+            try:
+                output.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run_stage():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+            put(STAGE_END)
+        except Exception as err: # pylint: disable=broad-except
+            put(STAGE_END, err)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+    thread = threading.Thread(target=run_stage, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = output.get()
+            if error is not None:
+                raise error
+            if item is STAGE_END:
+                return
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+# A failed fetch, in place of the response data of its location (see sync.fetch_locations),
+#   so the error is raised when that location reaches it (see raise_fetch_errors), and the
+#   other locations keep syncing
+class FetchError(object):
+    def __init__(self, error):
+        self.error = error
+
+
+# Yields the (location, data, ...) responses, raising the error of a failed fetch (FetchError)
+# skip_error(error): optional check whether a failed fetch is skipped instead
+def raise_fetch_errors(responses, skip_error=None):
+    for response in responses:
+        if isinstance(response[1], FetchError):
+            if skip_error is None or not skip_error(response[1].error):
+                raise response[1].error
+            LOGGER.warning('Skipping failed request ({}): {}'.format(
+                type(response[1].error).__name__, response[1].error))
+            continue
+        yield response
+
+
+# Routes an ordered stream of (location, ...) responses to one location at a time.
+# Locations are consumed in the same order the tasks were generated; responses left over
+#   for a finished location (e.g. after an early stop on a day without data) are discarded.
+class LocationResponses(object):
+    def __init__(self):
+        self.finished = set()
+        self.__responses = iter([])
+        self.__head = None
+
+    def attach(self, responses):
+        self.__responses = iter(responses)
+
+    def close(self):
+        # Stops a generator source early (and with it, any worker pool it owns)
+        close = getattr(self.__responses, 'close', None)
+        if close:
+            close()
+
+    def finish(self, location):
+        self.finished.add(location)
+
+    def for_location(self, location):
+        while True:
+            if self.__head is None:
+                self.__head = next(self.__responses, None)
+                if self.__head is None:
+                    return
+            head_location = self.__head[0]
+            if head_location in self.finished:
+                self.__head = None
+                continue
+            if head_location != location:
+                return
+            response, self.__head = self.__head, None
+            yield response
@@ -0,0 +1,238 @@
+from collections import defaultdict
+import json
+import os
+import sys
+import threading
+import time
+
+import singer
+from singer import metrics, utils
+
+LOGGER = singer.get_logger()
+
+# Sync phases timed by PhaseTimer:
+#   rate_limit: waiting for the rate limiter (client)
+#   request: HTTP request, until the response headers (client)
+#   decode: reading and decoding the response body (client, streamed: includes the download)
+#   cache: response cache lookups and writes (client)
+#   archive: response archive writes, or reads in replay mode (client, see archive.py)
+#   transform_json: de-nesting the response to stream records (transform_json, incl. the
+#     daily min/max times, and the child records)
+#   transform: schema transformation and field selection of each record (RecordTransformer)
+#   write_record: serializing RECORD messages (MessageWriter)
+#   write_state: writing STATE messages, incl. flushing the output
+PHASES = ['rate_limit', 'request', 'decode', 'cache', 'archive', 'transform_json', 'transform',
+          'write_record', 'write_state']
+
+
+def is_enabled(value, default):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.lower() not in ('false', '0', 'no', '')
+    return bool(value)
+
+
+class PhaseContext(object):
+    __slots__ = ['phase_timer', 'phase', 'start', 'start_cpu']
+
+    def __init__(self, phase_timer, phase):
+        self.phase_timer = phase_timer
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.phase_timer.add(
+            self.phase,
+            time.perf_counter() - self.start,
+            time.thread_time() - self.start_cpu)
+
+
+class NullContext(object):
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        pass
+
+
+NULL_CONTEXT = NullContext()
+
+
+# Stream and location of the phases timed in the current thread (see PhaseTimer.context)
+class PhaseTags(object):
+    __slots__ = ['local', 'tags', 'previous']
+
+    def __init__(self, local, stream_name, location):
+        self.local = local
+        self.tags = (stream_name, location)
+
+    def __enter__(self):
+        self.previous = getattr(self.local, 'tags', (None, None))
+        self.local.tags = self.tags
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.local.tags = self.previous
+
+
+# Wall and CPU (thread) seconds, and call counts, per phase, by stream (and location, with
+#   by_location).
+# The stream and location are set per thread (see context), so phases timed in the client
+#   (e.g. from fetch worker threads) are attributed to the location-day being fetched.
+# by_location: keep the totals per location too; off by default, as with thousands of
+#   locations it means thousands of totals (and metrics) per phase
+# report logs the totals as Singer timer metrics (metric: phase), and appends them as
+#   JSON lines to path (local exporter), if set.
+class PhaseTimer(object):
+    def __init__(self, enabled=True, path=None, by_location=False):
+        self.enabled = enabled
+        self.path = path
+        self.by_location = by_location
+        # (phase, stream_name, location): [count, seconds, cpu_seconds]
+        self.totals = {}
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            enabled=is_enabled(config.get('phase_metrics'), True),
+            path=config.get('phase_metrics_path'),
+            by_location=is_enabled(config.get('phase_metrics_by_location'), False))
+
+    # Attribute the phases timed in this thread to stream_name (and location, by_location)
+    def context(self, stream_name, location):
+        return PhaseTags(self.__local, stream_name, location if self.by_location else None)
+
+    def phase(self, phase):
+        if not self.enabled:
+            return NULL_CONTEXT
+        return PhaseContext(self, phase)
+
+    def add(self, phase, seconds, cpu_seconds, count=1):
+        key = (phase,) + getattr(self.__local, 'tags', (None, None))
+        with self.__lock:
+            totals = self.totals.get(key)
+            if totals is None:
+                totals = self.totals[key] = [0, 0.0, 0.0]
+            totals[0] = totals[0] + count
+            totals[1] = totals[1] + seconds
+            totals[2] = totals[2] + cpu_seconds
+
+    # Totals per phase, for all streams and locations: {phase: [count, seconds, cpu_seconds]}
+    def get_phase_totals(self):
+        phase_totals = defaultdict(lambda: [0, 0.0, 0.0])
+        with self.__lock:
+            for (phase, _, _), totals in self.totals.items():
+                for index, value in enumerate(totals):
+                    phase_totals[phase][index] = phase_totals[phase][index] + value
+        return dict(phase_totals)
+
+    # Start over (e.g. for the next sync of a daemon, see daemon.py)
+    def reset(self):
+        with self.__lock:
+            self.totals = {}
+
+    def report(self):
+        if not self.enabled or not self.totals:
+            return
+        with self.__lock:
+            totals = sorted(self.totals.items(), key=lambda item: [str(key) for key in item[0]])
+        rows = []
+        for (phase, stream_name, location), (count, seconds, cpu_seconds) in totals:
+            row = {
+                'phase': phase,
+                'endpoint': stream_name,
+                'count': count,
+                'seconds': round(seconds, 6),
+                'cpu_seconds': round(cpu_seconds, 6)
+            }
+            if self.by_location:
+                row['location'] = location
+            rows.append(row)
+            metrics.log(LOGGER, metrics.Point(
+                'timer',
+                'phase',
+                row['seconds'],
+                {key: value for key, value in row.items() if key != 'seconds'}))
+
+        for phase, (count, seconds, cpu_seconds) in sorted(self.get_phase_totals().items()):
+            LOGGER.info('Phase {}: {} calls, {:.3f} seconds, {:.3f} CPU seconds'.format(
+                phase, count, seconds, cpu_seconds))
+
+        if self.path:
+            reported = utils.strftime(utils.now())
+            with open(self.path, 'a') as file:
+                for row in rows:
+                    file.write(json.dumps(dict(row, time=reported)) + '\n')
+
+
+# Wall-clock sampling profiler for the whole sync (config profile_path): every interval
+#   seconds, samples the stack of every thread. Writes the samples to path in folded stack
+#   format (one line per stack: thread;frame;frame... count), for flame graph tools
+#   (e.g. flamegraph.pl, speedscope), and logs the most sampled functions.
+class SamplingProfiler(object):
+    def __init__(self, path=None, interval=0.005):
+        self.path = path
+        self.interval = float(interval)
+        self.samples = defaultdict(int)
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            path=config.get('profile_path'),
+            interval=config.get('profile_interval', 0.005))
+
+    def __enter__(self):
+        if self.path:
+            self.__thread = threading.Thread(
+                target=self.run, name='tap-darksky-profiler', daemon=True)
+            self.__thread.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if self.__thread:
+            self.__stop.set()
+            self.__thread.join()
+            self.__thread = None
+            self.write()
+
+    def run(self):
+        while not self.__stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items(): # pylint: disable=protected-access
+            if thread_id == threading.get_ident():
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(
+                    os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, str(thread_id)))
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self):
+        with open(self.path, 'w') as file:
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+                file.write('{} {}\n'.format(stack, count))
+
+        total = sum(self.samples.values())
+        leaf_samples = defaultdict(int)
+        for stack, count in self.samples.items():
+            leaf_samples[stack.rsplit(';', 1)[-1]] += count
+        LOGGER.info('Profile: {} samples, written to: {}'.format(total, self.path))
+        for leaf, count in sorted(leaf_samples.items(), key=lambda item: -item[1])[0:10]:
+            LOGGER.info('Profile: {:.1%} {}'.format(count / total, leaf))
@@ -0,0 +1,130 @@
+from bisect import bisect_right
+import datetime
+
+from tap_darksky.cache import is_immutable_date
+
+
+def to_ordinal(day):
+    return datetime.date.fromisoformat(day[0:10]).toordinal()
+
+
+def from_ordinal(ordinal):
+    return str(datetime.date.fromordinal(ordinal))
+
+
+# A set of days, as sorted, disjoint, non-adjacent [first, last] intervals of day ordinals
+#   (a year of daily syncs with no gaps is one interval). Stored as [first, last] date
+#   strings (see to_list), e.g. [['2020-01-01', '2020-03-31'], ['2020-04-02', '2020-06-30']].
+class DayIntervals(object):
+    def __init__(self, intervals=None):
+        self.intervals = [[to_ordinal(first), to_ordinal(last)] \
+            for first, last in intervals or []]
+
+    def to_list(self):
+        return [[from_ordinal(first), from_ordinal(last)] for first, last in self.intervals]
+
+    def __contains__(self, day):
+        ordinal = to_ordinal(day)
+        index = bisect_right(self.intervals, [ordinal, float('inf')]) - 1
+        return index >= 0 and self.intervals[index][1] >= ordinal
+
+    def add(self, day):
+        self.add_range(day, day)
+
+    # Add the days from first through last, merging overlapping and adjacent intervals
+    def add_range(self, first, last):
+        first, last = to_ordinal(first), to_ordinal(last)
+        if first > last:
+            return
+        index = bisect_right(self.intervals, [first, float('inf')])
+        # Merge with the previous interval, if it overlaps or is adjacent
+        if index > 0 and self.intervals[index - 1][1] >= first - 1:
+            index = index - 1
+            first = self.intervals[index][0]
+            last = max(last, self.intervals[index][1])
+        end = index
+        while end < len(self.intervals) and self.intervals[end][0] <= last + 1:
+            last = max(last, self.intervals[end][1])
+            end = end + 1
+        self.intervals[index:end] = [[first, last]]
+
+    # The days (date strings) of days that are not in the set
+    def get_missing(self, days):
+        return [day for day in days if day not in self]
+
+
+# Gap-aware day tracking (config gap_tracking): the days fetched for each stream and location
+#   are kept in the state (fetched_days) as DayIntervals, instead of relying on the bookmark
+#   alone. A location then fetches only the days missing from start_date (or its backfill
+#   shard's dates), in any order: a day without data, or whose request failed, is left as a
+#   gap for a later sync, and does not stop the location.
+# With a bookmark store (see bookmarks.BookmarkStore), the fetched days are kept in its table
+#   with the bookmarks instead, so state size stays flat with the number of locations;
+#   fetched_days of the state (earlier versions) are moved to it as they are updated.
+# Only days that ended in every timezone are recorded (see cache.is_immutable_date): later
+#   days are fetched again by each sync, as with bookmarks.
+# Locations without fetched days (e.g. state of earlier versions) count the days before their
+#   bookmark as fetched.
+class GapTracker(object):
+    @classmethod
+    def from_config(cls, config):
+        if not config.get('gap_tracking'):
+            return None
+        return cls()
+
+    # Days fetched for a stream and location (read only: the state may be written meanwhile)
+    # bookmark_store: optional bookmarks.BookmarkStore, read before the state
+    def get_intervals(self, state, stream, location_key, bookmark, bookmark_store=None):
+        fetched_days = None
+        if bookmark_store:
+            fetched_days = bookmark_store.get_value('fetched_days', stream, location_key)
+        if fetched_days is None:
+            fetched_days = state.get('fetched_days', {}).get(stream, {}).get(location_key)
+        if fetched_days is not None:
+            return DayIntervals(fetched_days)
+        intervals = DayIntervals()
+        if bookmark:
+            intervals.add_range('0001-01-01', from_ordinal(to_ordinal(bookmark) - 1))
+        return intervals
+
+    # Days of date_list (e.g. start_date through today) to fetch for a location group: those
+    #   missing for any of its locations, in any of the synced streams
+    # bookmarks: {(stream, location.key): bookmark}
+    def get_date_list(self, state, stream_names, location_group, bookmarks, date_list,
+                      bookmark_store=None):
+        missing = set()
+        for stream_name in stream_names:
+            for location in location_group.members:
+                intervals = self.get_intervals(
+                    state, stream_name, location.key, bookmarks.get((stream_name, location.key)),
+                    bookmark_store)
+                missing.update(intervals.get_missing(date_list))
+        return [day for day in date_list if day in missing]
+
+    # Record a fetched day for each location of the group, in each synced stream
+    # bookmarks: {(stream, location.key): bookmark}, as in get_date_list
+    # bookmark_store: optional bookmarks.BookmarkStore, to keep the fetched days in (instead of
+    #   the state)
+    def add_day(self, state, stream_names, location_group, bookmarks, day, bookmark_store=None):
+        if not is_immutable_date(day):
+            return
+        for stream_name in stream_names:
+            for location in location_group.members:
+                intervals = self.get_intervals(
+                    state, stream_name, location.key, bookmarks.get((stream_name, location.key)),
+                    bookmark_store)
+                intervals.add(day)
+                if bookmark_store:
+                    bookmark_store.set_value(
+                        'fetched_days', stream_name, location.key, intervals.to_list())
+                    # Moved from the state (earlier versions)
+                    fetched_days = state.get('fetched_days', {})
+                    if location.key in fetched_days.get(stream_name, {}):
+                        del fetched_days[stream_name][location.key]
+                        if not fetched_days[stream_name]:
+                            del fetched_days[stream_name]
+                        if not fetched_days:
+                            del state['fetched_days']
+                    continue
+                state.setdefault('fetched_days', {}).setdefault(stream_name, {})[
+                    location.key] = intervals.to_list()
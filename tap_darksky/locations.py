@@ -0,0 +1,227 @@
+import csv
+from itertools import chain
+import json
+import re
+
+import singer
+
+# ijson (optional, pip install tap-darksky[streaming]) reads GeoJSON location files
+#   incrementally
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+LOGGER = singer.get_logger()
+
+# CSV location file header columns, by coordinate (lower case); without a matching header,
+#   the first two columns are latitude, longitude
+LATITUDE_COLUMNS = ['latitude', 'lat']
+LONGITUDE_COLUMNS = ['longitude', 'lon', 'lng', 'long']
+
+# Maximum decimal places kept for coordinates (about 10 micrometers)
+MAX_PRECISION = 10
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def format_coordinate(value, precision=None):
+    coordinate = '{:.{}f}'.format(value, MAX_PRECISION if precision is None else precision)
+    if '.' in coordinate:
+        coordinate = coordinate.rstrip('0').rstrip('.')
+    if coordinate in ('-0', ''):
+        coordinate = '0'
+    return coordinate
+
+
+# Geohash of a lat,lon point: cells of the same length form a grid (length 5: ~4.9 x 4.9 km,
+#   6: ~1.2 x 0.6 km, 7: ~153 x 153 m); nearby points share a geohash prefix.
+# Reference: https://en.wikipedia.org/wiki/Geohash
+def geohash_encode(latitude, longitude, length):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < length:
+        coordinate, coordinate_range = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (coordinate_range[0] + coordinate_range[1]) / 2
+        bits = bits << 1
+        if coordinate >= mid:
+            bits = bits | 1
+            coordinate_range[0] = mid
+        else:
+            coordinate_range[1] = mid
+        even = not even
+        bit_count = bit_count + 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+# Center (lat, lon) of a geohash cell
+def geohash_center(geohash):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            coordinate_range = lon_range if even else lat_range
+            mid = (coordinate_range[0] + coordinate_range[1]) / 2
+            if (bits >> shift) & 1:
+                coordinate_range[0] = mid
+            else:
+                coordinate_range[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+# (latitude, longitude) strings of the rows of a CSV location file
+def read_csv_coordinates(path):
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [column.strip().lower() for column in header]
+        lat_index = next((columns.index(name) for name in LATITUDE_COLUMNS \
+            if name in columns), None)
+        lon_index = next((columns.index(name) for name in LONGITUDE_COLUMNS \
+            if name in columns), None)
+        rows = reader
+        if lat_index is None or lon_index is None:
+            # No header: the first row is a location
+            lat_index, lon_index = 0, 1
+            rows = chain([header], reader)
+        for row in rows:
+            if len(row) > max(lat_index, lon_index):
+                yield row[lat_index].strip(), row[lon_index].strip()
+
+
+# (latitude, longitude) of the Point features of a GeoJSON FeatureCollection; GeoJSON
+#   coordinates are [longitude, latitude]. Other geometries are skipped.
+def read_geojson_coordinates(path):
+    with open(path, 'rb') as file:
+        if ijson:
+            features = ijson.items(file, 'features.item', use_float=True)
+        else:
+            features = json.load(file).get('features', [])
+        for feature in features:
+            geometry = (feature or {}).get('geometry') or {}
+            coordinates = geometry.get('coordinates') or []
+            if geometry.get('type') != 'Point' or len(coordinates) < 2:
+                LOGGER.warning('Skipping location file feature without a Point geometry')
+                continue
+            yield coordinates[1], coordinates[0]
+
+
+# A configured location; key is the normalized lat,lon used for bookmarks.
+# aliases: the raw location strings it was configured as (bookmarks from earlier versions)
+class Location(object):
+    def __init__(self, latitude, longitude, precision=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.key = '{},{}'.format(
+            format_coordinate(latitude, precision),
+            format_coordinate(longitude, precision))
+        self.aliases = []
+
+
+# Locations fetched with one API request per day: a single location, or all locations
+#   in one grid cell (fetched at the cell center). key is the lat,lon used in the API URL.
+class LocationGroup(object):
+    def __init__(self, key, snapped=False):
+        self.key = key
+        self.snapped = snapped
+        self.members = []
+
+
+# Parses, normalizes and de-duplicates locations.
+# precision: decimal places to round coordinates to, before de-duplicating
+#   (e.g. 4: 45.587467,-122.404503 and 45.5875,-122.4045 are the same location)
+# grid_precision: optional geohash length; locations in the same geohash cell share one
+#   API request per day, at the cell center
+class LocationRegistry(object):
+    def __init__(self, precision=None, grid_precision=None):
+        self.precision = precision
+        self.grid_precision = grid_precision
+        self.locations = {}
+        self.groups = {}
+
+    @classmethod
+    def from_config(cls, config):
+        precision = config.get('location_precision')
+        grid_precision = config.get('location_grid_precision')
+        registry = cls(
+            precision=int(precision) if precision is not None else None,
+            grid_precision=int(grid_precision) if grid_precision else None)
+        registry.add_location_list(config.get('location_list', ''))
+        if config.get('location_file'):
+            registry.add_location_file(config['location_file'])
+        return registry
+
+    # location_list should be delimited like: lat1,lon1;lat2,lon2;lat3,lon3
+    #   commas separating lat,lon and semicolons ; separating locations
+    def add_location_list(self, location_list):
+        # Remove non-numeric chars except commas, semicolons, minus signs
+        #   and Split to list of locations by semicolon
+        for raw_location in re.sub('[^0-9,.;-]', '', location_list).split(';'):
+            if raw_location:
+                self.add(raw_location)
+        LOGGER.info('Locations: {} unique, in {} API request groups'.format(
+            len(self.locations), len(self.groups)))
+
+    # location_file: a CSV file (latitude, longitude columns) or a GeoJSON FeatureCollection
+    #   of Point features (.geojson or .json), read as a stream, one location at a time
+    def add_location_file(self, path):
+        if path.lower().endswith(('.geojson', '.json')):
+            coordinates = read_geojson_coordinates(path)
+        else:
+            coordinates = read_csv_coordinates(path)
+        for latitude, longitude in coordinates:
+            self.add('{},{}'.format(latitude, longitude))
+        LOGGER.info('Locations: {} unique (with {}), in {} API request groups'.format(
+            len(self.locations), path, len(self.groups)))
+
+    def add(self, raw_location):
+        try:
+            latitude, longitude = [float(value) for value in raw_location.split(',')]
+        except ValueError:
+            LOGGER.warning('Skipping invalid location: {}'.format(raw_location))
+            return None
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            LOGGER.warning('Skipping out of range location: {}'.format(raw_location))
+            return None
+        if self.precision is not None:
+            latitude = round(latitude, self.precision)
+            longitude = round(longitude, self.precision)
+
+        location = Location(latitude, longitude, self.precision)
+        if location.key in self.locations:
+            location = self.locations[location.key]
+        else:
+            self.locations[location.key] = location
+            self.get_group(location).members.append(location)
+        if raw_location != location.key and raw_location not in location.aliases:
+            location.aliases.append(raw_location)
+        return location
+
+    def get_group(self, location):
+        if self.grid_precision:
+            geohash = geohash_encode(location.latitude, location.longitude, self.grid_precision)
+            if geohash not in self.groups:
+                latitude, longitude = geohash_center(geohash)
+                # Cell centers need no more than 7 decimals (~1 cm)
+                key = '{},{}'.format(format_coordinate(latitude, 7), format_coordinate(longitude, 7))
+                self.groups[geohash] = LocationGroup(key, snapped=True)
+            return self.groups[geohash]
+        self.groups[location.key] = LocationGroup(location.key)
+        return self.groups[location.key]
+
+    # Location groups, in the order their first location was configured
+    def get_groups(self):
+        return list(self.groups.values())
@@ -0,0 +1,169 @@
+from decimal import Decimal
+import json
+import sys
+
+import pytz
+import singer
+from singer import utils
+from tap_darksky.batch import BATCH_ENCODING, BatchFiles
+
+# orjson (optional, pip install tap-darksky[fast]) serializes records several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOGGER = singer.get_logger()
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+if orjson:
+    def dumps(message):
+        return orjson.dumps(message, default=json_default)
+else:
+    def dumps(message):
+        return json.dumps(message, default=json_default, separators=(',', ':')).encode('utf-8')
+
+
+# Writes Singer messages to stdout (or another stream).
+# RECORD and SCHEMA messages are serialized to a buffer, written out in chunks of about
+#   buffer_size bytes, and only flushed when a STATE message is written (or on flush), so
+#   every STATE still follows the records it covers.
+# batch_files: optional batch.BatchFiles (batch mode); records of its streams are written to
+#   batch files, announced by BATCH messages once finished. A STATE message is then held
+#   back until the batch files open when it was written are finished (when one is full, or
+#   on flush), so it never covers records of an unfinished file.
+# batch_streams: without batch_files, streams whose records are serialized as batch file
+#   lines, returned separately by drain (e.g. in a transform worker)
+class MessageWriter(object):
+    def __init__(self, stream=None, buffer_size=DEFAULT_BUFFER_SIZE, batch_files=None,
+                 batch_streams=None):
+        self.stream = stream or sys.stdout
+        self.buffer_size = buffer_size
+        self.batch_files = batch_files
+        self.batch_streams = set(batch_files.streams if batch_files else batch_streams or [])
+        self.__buffer = []
+        self.__buffered = 0
+        self.__batch_buffers = {}
+        self.__pending_state = None
+        # Write bytes to the binary stream under a text stream (e.g. sys.stdout), if it has one
+        self.__binary = getattr(self.stream, 'buffer', None)
+        if self.__binary is not None:
+            self.stream.flush()
+
+    @classmethod
+    def from_config(cls, config, stream=None):
+        return cls(
+            stream=stream,
+            buffer_size=int(config.get('output_buffer_size', DEFAULT_BUFFER_SIZE)),
+            batch_files=BatchFiles.from_config(config))
+
+    def write_message(self, message):
+        line = dumps(message) + b'\n'
+        self.__buffer.append(line)
+        self.__buffered = self.__buffered + len(line)
+        if self.__buffered >= self.buffer_size:
+            self.write_buffer()
+
+    def write_schema(self, stream_name, schema, key_properties):
+        self.write_message({
+            'type': 'SCHEMA',
+            'stream': stream_name,
+            'schema': schema,
+            'key_properties': key_properties
+        })
+
+    def write_record(self, stream_name, record, time_extracted=None):
+        if stream_name in self.batch_streams:
+            self.write_batch_records(stream_name, dumps(record) + b'\n')
+            return
+        message = {
+            'type': 'RECORD',
+            'stream': stream_name,
+            'record': record
+        }
+        if time_extracted:
+            message['time_extracted'] = utils.strftime(time_extracted.astimezone(pytz.utc))
+        self.write_message(message)
+
+    def write_state(self, state):
+        message = {
+            'type': 'STATE',
+            'value': state
+        }
+        if self.batch_files and self.batch_files.has_records():
+            # Serialized now: the state changes until it is written (see finish_batches)
+            self.__pending_state = dumps(message) + b'\n'
+            return
+        self.write_message(message)
+        self.flush()
+
+    # Serialized records (JSON lines) of a batch stream
+    def write_batch_records(self, stream_name, lines):
+        if self.batch_files is None:
+            self.__batch_buffers.setdefault(stream_name, []).append(lines)
+            return
+        if self.batch_files.write(stream_name, lines):
+            self.flush()
+
+    # Finish the open batch files, and write their BATCH messages, then the STATE message
+    #   held back for them (if any)
+    def finish_batches(self):
+        for stream_name, manifest in self.batch_files.finish():
+            self.write_message({
+                'type': 'BATCH',
+                'stream': stream_name,
+                'encoding': BATCH_ENCODING,
+                'manifest': manifest
+            })
+        if self.__pending_state:
+            self.write_serialized(self.__pending_state)
+            self.__pending_state = None
+
+    # Write messages already serialized (e.g. by a transform worker process, see drain), and
+    #   batch_lines, serialized batch stream records by stream
+    def write_serialized(self, lines, batch_lines=None):
+        if lines:
+            self.__buffer.append(lines)
+            self.__buffered = self.__buffered + len(lines)
+            if self.__buffered >= self.buffer_size:
+                self.write_buffer()
+        for stream_name, stream_lines in (batch_lines or {}).items():
+            self.write_batch_records(stream_name, stream_lines)
+
+    # Return the buffered (serialized) messages, and the serialized batch stream records by
+    #   stream, instead of writing them (see write_serialized)
+    def drain(self):
+        lines = b''.join(self.__buffer)
+        self.__buffer = []
+        self.__buffered = 0
+        batch_lines = {stream_name: b''.join(stream_lines) \
+            for stream_name, stream_lines in self.__batch_buffers.items()}
+        self.__batch_buffers = {}
+        return lines, batch_lines
+
+    def write_buffer(self):
+        if not self.__buffer:
+            return
+        chunk = b''.join(self.__buffer)
+        self.__buffer = []
+        self.__buffered = 0
+        if self.__binary is not None:
+            self.__binary.write(chunk)
+        else:
+            self.stream.write(chunk.decode('utf-8'))
+
+    def flush(self):
+        if self.batch_files:
+            self.finish_batches()
+        self.write_buffer()
+        if self.__binary is not None:
+            self.__binary.flush()
+        self.stream.flush()
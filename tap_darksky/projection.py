@@ -0,0 +1,53 @@
+from singer import metadata
+from tap_darksky.streams import flatten_streams
+from tap_darksky.transform import CHILD_PARENT_FIELDS, get_schema_keys
+from tap_darksky.transformer import is_selected_field
+
+# Forecast API response sections, which may be excluded from the request (exclude parameter)
+# Reference: https://darksky.net/dev/docs (Request Parameters, exclude)
+RESPONSE_SECTIONS = ['currently', 'minutely', 'hourly', 'daily', 'alerts', 'flags']
+
+# Keys read by transform_json, to derive start_time, end_time, local_date and forecast_date
+DERIVED_FIELD_KEYS = {'timezone', 'hourly', 'daily', 'data', 'time'}
+
+
+# Projection of API responses to the selected fields of the synced streams of an endpoint,
+#   compiled once from the catalog selection metadata:
+# keys: snake_case keys to keep while decoding responses (see transform.decode_json), at any
+#   depth; keys of unselected fields are dropped before they are converted or transformed.
+# sections: response sections to request; the others are excluded in the API request.
+# Parent sections (hourly, daily, flags) must be explicitly selected; a child stream
+#   (forecast_hourly, forecast_daily) requests its own section (data_key).
+class Projection(object):
+    def __init__(self, keys, sections):
+        self.keys = frozenset(keys)
+        self.sections = sections
+
+    @classmethod
+    def from_catalog(cls, catalog, stream_names):
+        flat_streams = flatten_streams()
+        keys = set(DERIVED_FIELD_KEYS)
+        sections = []
+        for stream_name in stream_names:
+            stream = catalog.get_stream(stream_name)
+            schema = stream.schema.to_dict()
+            mdata = metadata.to_map(stream.metadata)
+            data_key = flat_streams[stream_name].get('data_key')
+            if data_key and data_key not in sections:
+                sections.append(data_key)
+            for field_name, field_schema in schema.get('properties', {}).items():
+                if not is_selected_field(mdata, field_name):
+                    continue
+                keys.add(field_name)
+                keys.update(get_schema_keys(field_schema))
+                if not data_key and field_name in RESPONSE_SECTIONS and \
+                    field_name not in sections and \
+                    metadata.get(mdata, ('properties', field_name), 'selected'):
+                    sections.append(field_name)
+            if data_key:
+                keys.update(CHILD_PARENT_FIELDS)
+        return cls(keys, sections)
+
+    # Response sections to exclude from the API request (exclude parameter)
+    def get_exclusions(self):
+        return [section for section in RESPONSE_SECTIONS if section not in self.sections]
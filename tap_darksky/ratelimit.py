@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+import datetime
+import fcntl
+import json
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Darksky API usage is counted per calendar day (UTC), reported in this response header
+API_CALLS_HEADER = 'X-Forecast-API-Calls'
+
+
+def utc_today():
+    return str(datetime.datetime.utcnow().date())
+
+
+# Token bucket rate limiter, shared by all threads of the tap.
+# rate: calls allowed per period (seconds); the bucket holds at most rate tokens (burst).
+# path: optional local file used to share the bucket across processes (e.g. parallel taps
+#   on one secret_key); the file is locked (flock) for every update.
+# call_limit: optional daily API call quota; acquire returns False once the calls made today
+#   (counted locally and from the X-Forecast-API-Calls header) reach the quota.
+class RateLimiter(object):
+    def __init__(self, rate=800, period=60, path=None, call_limit=None):
+        self.rate = float(rate)
+        self.period = float(period)
+        self.path = path
+        self.call_limit = call_limit
+        self.__lock = threading.Lock()
+        self.__state = self.new_state()
+
+    @classmethod
+    def from_config(cls, config):
+        call_limit = config.get('api_call_limit')
+        return cls(
+            rate=config.get('rate_limit_calls', 800),
+            period=config.get('rate_limit_period', 60),
+            path=config.get('rate_limit_file'),
+            call_limit=int(call_limit) if call_limit else None)
+
+    def new_state(self):
+        return {
+            'tokens': self.rate,
+            'updated': time.time(),
+            'paused_until': 0,
+            'day': utc_today(),
+            'calls': 0
+        }
+
+    # Bucket state, read and written back under the thread lock (and file lock, if shared)
+    @contextmanager
+    def shared_state(self):
+        with self.__lock:
+            if not self.path:
+                yield self.__state
+                return
+            with open(self.path, 'a+') as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    file.seek(0)
+                    content = file.read()
+                    state = json.loads(content) if content else self.new_state()
+                    yield state
+                    file.seek(0)
+                    file.truncate()
+                    json.dump(state, file)
+                    # Flushed (not synced to disk) before unlocking: the bucket only needs to
+                    #   be shared by the processes of this host, not survive a crash
+                    file.flush()
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    # Take one token, or return the number of seconds to wait for the next one
+    #   (None when the daily call quota is used up).
+    def try_acquire(self):
+        with self.shared_state() as state:
+            now = time.time()
+            if state['day'] != utc_today():
+                state['day'] = utc_today()
+                state['calls'] = 0
+            if self.call_limit and state['calls'] >= self.call_limit:
+                return None
+            if state['paused_until'] > now:
+                return state['paused_until'] - now
+            elapsed = max(now - state['updated'], 0)
+            state['tokens'] = min(self.rate, state['tokens'] + elapsed * self.rate / self.period)
+            state['updated'] = now
+            if state['tokens'] >= 1:
+                state['tokens'] = state['tokens'] - 1
+                state['calls'] = state['calls'] + 1
+                return 0
+            return (1 - state['tokens']) * self.period / self.rate
+
+    # Block until a call is allowed; returns False if the daily call quota is used up
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait is None:
+                return False
+            if wait <= 0:
+                return True
+            time.sleep(wait)
+
+    # Sync the daily call count with the API usage reported in the response headers
+    def update_from_headers(self, headers):
+        calls = headers.get(API_CALLS_HEADER)
+        if not calls:
+            return
+        try:
+            calls = int(calls)
+        except ValueError:
+            return
+        with self.shared_state() as state:
+            if state['day'] == utc_today():
+                state['calls'] = max(state['calls'], calls)
+
+    # Stop all callers (every thread and process sharing the bucket) for seconds,
+    #   e.g. from the Retry-After header of a 429 response
+    def pause(self, seconds, reason='Rate limited'):
+        LOGGER.warning('{}, pausing API requests for {} seconds'.format(reason, seconds))
+        with self.shared_state() as state:
+            state['paused_until'] = max(state['paused_until'], time.time() + seconds)
+            # The bucket refills from the end of the pause: no burst when it ends
+            state['tokens'] = 0
+            state['updated'] = state['paused_until']
@@ -0,0 +1,175 @@
+import heapq
+import threading
+import time
+
+import backoff
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_BREAKER_THRESHOLD = 10
+DEFAULT_BREAKER_COOLDOWN = 30
+MAX_BREAKER_COOLDOWN = 600
+
+DEFAULT_DEFERRED_TRIES = 3
+DEFAULT_DEFERRED_DELAY = 30
+
+
+# Retry policy of an error, by the first of its classes found in policies (see
+#   client.ERROR_RETRY_POLICIES); None if the error is not retried.
+def get_retry_policy(policies, error):
+    for error_class in type(error).__mro__:
+        if error_class in policies:
+            return policies[error_class]
+    return None
+
+
+# An error is deferrable if its policy retries the failed location later (see
+#   DeferredRetryQueue), instead of failing the sync
+def is_deferrable(policies, error):
+    policy = get_retry_policy(policies, error)
+    return bool(policy and policy['defer'])
+
+
+# Call func, retrying errors with a retry policy (see client.ERROR_RETRY_POLICIES): up to the
+#   policy's tries, with exponential backoff (factor seconds, full jitter), inline. Errors
+#   counted by the circuit_breaker (policy trip) are reported to it.
+# Errors are raised once their tries are used up (or at once, without a policy).
+def call_with_retries(func, policies, circuit_breaker=None):
+    attempt = 0
+    while True:
+        attempt = attempt + 1
+        if circuit_breaker:
+            circuit_breaker.before_request()
+        try:
+            result = func()
+        except Exception as err:
+            policy = get_retry_policy(policies, err)
+            if circuit_breaker:
+                circuit_breaker.after_request(failed=bool(policy and policy['trip']))
+            if policy is None or attempt >= policy['tries']:
+                raise
+            wait = backoff.full_jitter(policy['factor'] * 2 ** (attempt - 1))
+            LOGGER.warning('{}: retrying in {:.1f} seconds (try {} of {})'.format(
+                type(err).__name__, wait, attempt, policy['tries']))
+            time.sleep(wait)
+            continue
+        if circuit_breaker:
+            circuit_breaker.after_request(failed=False)
+        return result
+
+
+# Pauses all API traffic while the API is clearly degraded: after threshold consecutive
+#   failures (of error classes that trip it), requests are paused for cooldown seconds
+#   (with pause, e.g. RateLimiter.pause, so all threads and processes sharing the rate
+#   limiter wait). Then a single request probes the API (half-open) while the others wait:
+#   a success closes the breaker, a failure opens it again, for twice as long (up to
+#   max_cooldown).
+# threshold: 0 disables the breaker
+class CircuitBreaker(object):
+    def __init__(self, pause, threshold=DEFAULT_BREAKER_THRESHOLD,
+                 cooldown=DEFAULT_BREAKER_COOLDOWN, max_cooldown=MAX_BREAKER_COOLDOWN):
+        self.pause = pause
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max(max_cooldown, cooldown)
+        self.trips = 0
+        self.__failures = 0
+        self.__next_cooldown = cooldown
+        self.__half_open = False
+        self.__probe = None
+        self.__condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config, pause):
+        return cls(
+            pause=pause,
+            threshold=int(config.get('circuit_breaker_threshold', DEFAULT_BREAKER_THRESHOLD)),
+            cooldown=float(config.get('circuit_breaker_cooldown', DEFAULT_BREAKER_COOLDOWN)))
+
+    # Wait while another request probes the API; in the half-open state, this request
+    #   becomes the probe
+    def before_request(self):
+        if not self.threshold:
+            return
+        with self.__condition:
+            while self.__probe is not None:
+                self.__condition.wait()
+            if self.__half_open:
+                self.__half_open = False
+                self.__probe = threading.get_ident()
+
+    def after_request(self, failed):
+        if not self.threshold:
+            return
+        with self.__condition:
+            probe = self.__probe == threading.get_ident()
+            if probe:
+                self.__probe = None
+                self.__condition.notify_all()
+            if not failed:
+                self.__failures = 0
+                self.__next_cooldown = self.cooldown
+                return
+            self.__failures = self.__failures + 1
+            if probe or self.__failures >= self.threshold:
+                self.__trip()
+
+    def __trip(self):
+        cooldown = self.__next_cooldown
+        LOGGER.warning('API degraded: {} consecutive failed requests'.format(self.__failures))
+        self.trips = self.trips + 1
+        self.__failures = 0
+        self.__half_open = True
+        self.__next_cooldown = min(cooldown * 2, self.max_cooldown)
+        self.pause(cooldown, 'Circuit breaker open')
+
+
+# Deferred retry queue of failed shards (see backfill.Shard): instead of sleeping inline, a
+#   shard whose request failed with a deferrable error (see is_deferrable) is retried after
+#   delay seconds (doubling on each retry), from its bookmark, while the other shards sync.
+# A shard that failed tries times raises its last error.
+# tries: 0 disables deferred retries (errors are raised at once)
+class DeferredRetryQueue(object):
+    def __init__(self, tries=DEFAULT_DEFERRED_TRIES, delay=DEFAULT_DEFERRED_DELAY):
+        self.tries = tries
+        self.delay = delay
+        self.deferred = 0
+        self.__attempts = {}
+        self.__queue = []
+        self.__sequence = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            tries=int(config.get('retry_deferred_tries', DEFAULT_DEFERRED_TRIES)),
+            delay=float(config.get('retry_deferred_delay', DEFAULT_DEFERRED_DELAY)))
+
+    def __len__(self):
+        return len(self.__queue)
+
+    # Defer a failed shard (with its url), or raise error once its tries are used up
+    def defer(self, shard, url, error):
+        attempts = self.__attempts.get(shard.key, 0) + 1
+        if attempts > self.tries:
+            raise error
+        self.__attempts[shard.key] = attempts
+        wait = self.delay * 2 ** (attempts - 1)
+        LOGGER.warning('Shard {} failed ({}): retrying in {} seconds (deferred retry {} of {})'
+                       .format(shard.key, type(error).__name__, wait, attempts, self.tries))
+        # The sequence keeps shards due at the same time in the order they failed
+        self.__sequence = self.__sequence + 1
+        heapq.heappush(self.__queue, (time.time() + wait, self.__sequence, shard, url))
+        self.deferred = self.deferred + 1
+
+    # Shards (with their url) due for a retry; with wait, all deferred shards, sleeping until
+    #   each is due (shards deferred again meanwhile are included)
+    def pop_ready(self, wait=False):
+        while self.__queue:
+            ready_time = self.__queue[0][0]
+            if ready_time > time.time():
+                if not wait:
+                    return
+                time.sleep(max(ready_time - time.time(), 0))
+            _, _, shard, url = heapq.heappop(self.__queue)
+            yield shard, url
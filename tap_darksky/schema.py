@@ -1,7 +1,8 @@
 import os
 import json
+from functools import lru_cache
 from singer import metadata
-from tap_darksky.streams import STREAMS
+from tap_darksky.streams import flatten_streams
 
 # Reference:
 # https://github.com/singer-io/getting-started/blob/master/docs/DISCOVERY_MODE.md#Metadata
@@ -9,11 +10,13 @@ from tap_darksky.streams import STREAMS
 def get_abs_path(path):
     return os.path.join(os.path.dirname(os.path.realpath(__file__)), path)
 
+# Memoized: schemas are read and parsed once per process
+@lru_cache(maxsize=None)
 def get_schemas():
     schemas = {}
     field_metadata = {}
 
-    for stream_name, stream_metadata in STREAMS.items():
+    for stream_name, stream_metadata in flatten_streams().items():
         schema_path = get_abs_path('schemas/{}.json'.format(stream_name))
         with open(schema_path) as file:
             schema = json.load(file)
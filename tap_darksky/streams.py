@@ -7,7 +7,8 @@
 #   replication_keys: bookmark_field(s), typically a date-time, used for filtering the results
 #        and setting the state
 #   params: Query, sort, and other endpoint specific parameters
-#   data_key: JSON element containing the records for the endpoint
+#   data_key: JSON element containing the records for the endpoint (for children: the time frame,
+#       hourly or daily, whose data list is de-nested from the parent response)
 #   bookmark_query_field: Typically a date-time field used for filtering the query
 #   bookmark_type: Data type for bookmark, integer or datetime
 #   children: A collection of child endpoints (where the endpoint path includes the parent id)
@@ -24,6 +25,34 @@ STREAMS = {
                 'exclude': '<exclusions_list>',
                 'lang': '<language>',
                 'units': '<units>'
+            },
+            'children': {
+                'forecast_hourly': {
+                    'parent': 'forecast',
+                    'data_key': 'hourly',
+                    'key_properties': ['latitude', 'longitude', 'time'],
+                    'replication_method': 'INCREMENTAL',
+                    'replication_keys': ['forecast_date'],
+                    'bookmark_type': 'datetime'
+                },
+                'forecast_daily': {
+                    'parent': 'forecast',
+                    'data_key': 'daily',
+                    'key_properties': ['latitude', 'longitude', 'time'],
+                    'replication_method': 'INCREMENTAL',
+                    'replication_keys': ['forecast_date'],
+                    'bookmark_type': 'datetime'
+                }
             }
         }
     }
+
+
+# All parent and child streams, by stream name
+def flatten_streams():
+    flat_streams = {}
+    for stream_name, endpoint_config in STREAMS.items():
+        flat_streams[stream_name] = endpoint_config
+        for child_name, child_config in endpoint_config.get('children', {}).items():
+            flat_streams[child_name] = child_config
+    return flat_streams
@@ -1,27 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-import re
+from functools import partial
+import sys
 import singer
-from singer import metrics, metadata, Transformer, utils, UNIX_SECONDS_INTEGER_DATETIME_PARSING
+from singer import metrics, utils
 from singer.utils import strptime_to_utc
-from tap_darksky.transform import transform_json
-from tap_darksky.streams import STREAMS
+from tap_darksky.transform import decode_json, transform_child_records, transform_json
+from tap_darksky.streams import flatten_streams, STREAMS
+from tap_darksky.fetch import DEFAULT_PIPELINE_QUEUE_SIZE, FetchError, \
+    grouped_unordered_map, LocationResponses, ordered_map, prefetch, raise_fetch_errors
+from tap_darksky.transformer import RecordTransformer, transform_datetime
+from tap_darksky.output import MessageWriter
+from tap_darksky.checkpoint import StateCheckpointer
+from tap_darksky.locations import LocationRegistry
+from tap_darksky.instrumentation import PhaseTimer
+from tap_darksky.dedup import RecordDedup
+from tap_darksky.units import FETCH_UNITS, UnitConverter
+from tap_darksky.projection import Projection
+from tap_darksky.workers import get_worker_catalog, get_worker_transformer, TransformPool
+from tap_darksky.backfill import BackfillPlan, get_shard_bookmark_store, get_shard_state, \
+    is_shard_complete, Shard, ShardCheckpointer
+from tap_darksky.bookmarks import BookmarkStore
+from tap_darksky.intervals import GapTracker
+from tap_darksky.client import ERROR_RETRY_POLICIES
+from tap_darksky.retry import DeferredRetryQueue, is_deferrable
 
 LOGGER = singer.get_logger()
 
 
-def write_schema(catalog, stream_name):
+# unit_converter: in multi-unit mode (see units.py), records are also keyed by units
+def write_schema(catalog, stream_name, writer, unit_converter=None):
     stream = catalog.get_stream(stream_name)
     schema = stream.schema.to_dict()
+    key_properties = stream.key_properties
+    if unit_converter:
+        key_properties = list(key_properties or []) + ['units']
     try:
-        singer.write_schema(stream_name, schema, stream.key_properties)
+        writer.write_schema(stream_name, schema, key_properties)
     except OSError as err:
         LOGGER.info('OS Error writing schema for: {}'.format(stream_name))
         raise err
 
 
-def write_record(stream_name, record, time_extracted):
+def write_record(stream_name, record, time_extracted, writer):
     try:
-        singer.messages.write_record(stream_name, record, time_extracted=time_extracted)
+        writer.write_record(stream_name, record, time_extracted=time_extracted)
     except OSError as err:
         LOGGER.info('OS Error writing record for: {}'.format(stream_name))
         LOGGER.info('record: {}'.format(record))
@@ -32,32 +55,43 @@ def write_record(stream_name, record, time_extracted):
         raise err
 
 
-def get_bookmark(state, stream, location, default):
+# bookmark_store: optional bookmarks.BookmarkStore, read before the inline state bookmarks
+def get_bookmark(state, stream, location, default, bookmark_store=None):
+    if bookmark_store:
+        bookmark = bookmark_store.get(stream, location)
+        if bookmark is not None:
+            return bookmark
     if (state is None) or ('bookmarks' not in state):
+        bookmark = None
+    else:
+        bookmark = state.get('bookmarks', {}).get(stream, {}).get(location)
+    if bookmark is None and bookmark_store:
+        bookmark = bookmark_store.get_fallback(stream)
+    if bookmark is None:
         return default
-    return (
-        state
-        .get('bookmarks', {})
-        .get(stream, {})
-        .get(location, default)
-    )
-
-
-def write_bookmark(state, stream, location, value):
-    if 'bookmarks' not in state:
-        state['bookmarks'] = {}
-    if stream not in state['bookmarks']:
-        state['bookmarks'][stream] = {}
-    state['bookmarks'][stream][location] = value
+    return bookmark
+
+
+# bookmark_store: optional bookmarks.BookmarkStore, to keep the bookmark in (instead of the
+#   state)
+def write_bookmark(state, stream, location, value, checkpointer, bookmark_store=None):
+    if bookmark_store:
+        bookmark_store.set(stream, location, value)
+        # Moved from the inline state bookmarks (earlier versions)
+        stream_bookmarks = state.get('bookmarks', {}).get(stream)
+        if stream_bookmarks is not None:
+            stream_bookmarks.pop(location, None)
+            if not stream_bookmarks:
+                del state['bookmarks'][stream]
+    else:
+        if 'bookmarks' not in state:
+            state['bookmarks'] = {}
+        if stream not in state['bookmarks']:
+            state['bookmarks'][stream] = {}
+        state['bookmarks'][stream][location] = value
     LOGGER.info('Write state for Stream: {}, Location: {}, value: {}'.format(
         stream, location, value))
-    singer.write_state(state)
-
-
-def transform_datetime(this_dttm):
-    with Transformer() as transformer:
-        new_dttm = transformer._transform_datetime(this_dttm)
-    return new_dttm
+    checkpointer.update(state)
 
 
 def process_records(catalog, #pylint: disable=too-many-branches
@@ -66,205 +100,719 @@ def process_records(catalog, #pylint: disable=too-many-branches
                     time_extracted,
                     bookmark_field=None,
                     max_bookmark_value=None,
-                    last_datetime=None):
-    stream = catalog.get_stream(stream_name)
-    schema = stream.schema.to_dict()
-    stream_metadata = metadata.to_map(stream.metadata)
+                    last_datetime=None,
+                    transformer=None,
+                    writer=None,
+                    phase_timer=None,
+                    record_dedup=None):
+    # Compile the stream transformer, unless the caller compiled it once for the stream
+    if transformer is None:
+        transformer = RecordTransformer.from_catalog(catalog, stream_name)
+    if writer is None:
+        writer = MessageWriter(buffer_size=0)
+    if phase_timer is None:
+        phase_timer = PhaseTimer(enabled=False)
+    transform_phase = phase_timer.phase('transform')
+    write_phase = phase_timer.phase('write_record')
+
+    # Parse bookmark datetimes once, not for every record
+    max_bookmark_dttm = transform_datetime(max_bookmark_value)
+    last_dttm = transform_datetime(last_datetime)
+
+    # record_dedup(records): optional check whether the records changed since they were last
+    #   written (see dedup.py); records are then collected, and only written if changed
+    dedup_records = []
+
+    def emit_record(record):
+        if record_dedup:
+            dedup_records.append(record)
+            return
+        with write_phase:
+            write_record(stream_name, record, time_extracted=time_extracted, writer=writer)
 
     with metrics.record_counter(stream_name) as counter:
         for record in records:
             # Transform record for Singer.io
-            with Transformer(integer_datetime_fmt=UNIX_SECONDS_INTEGER_DATETIME_PARSING) \
-                as transformer:
-                transformed_record = transformer.transform(
-                    record,
-                    schema,
-                    stream_metadata)
-
-                # Reset max_bookmark_value to new value if higher
-                if transformed_record.get(bookmark_field):
-                    if max_bookmark_value is None or \
-                        transformed_record[bookmark_field] > transform_datetime(max_bookmark_value):
-                        max_bookmark_value = transformed_record[bookmark_field]
-
-                if bookmark_field and (bookmark_field in transformed_record):
-                    last_dttm = transform_datetime(last_datetime)
-                    bookmark_dttm = transform_datetime(transformed_record[bookmark_field])
-                    # Keep only records whose bookmark is after the last_datetime
-                    if bookmark_dttm:
-                        if bookmark_dttm >= last_dttm:
-                            write_record(stream_name, transformed_record, \
-                                time_extracted=time_extracted)
-                            counter.increment()
-                else:
-                    write_record(stream_name, transformed_record, time_extracted=time_extracted)
-                    counter.increment()
+            with transform_phase:
+                transformed_record = transformer.transform(record)
+
+            # Reset max_bookmark_value to new value if higher
+            if transformed_record.get(bookmark_field):
+                if max_bookmark_value is None or \
+                    transformed_record[bookmark_field] > max_bookmark_dttm:
+                    max_bookmark_value = transformed_record[bookmark_field]
+                    max_bookmark_dttm = transform_datetime(max_bookmark_value)
+
+            if bookmark_field and (bookmark_field in transformed_record):
+                bookmark_dttm = transform_datetime(transformed_record[bookmark_field])
+                # Keep only records whose bookmark is after the last_datetime
+                if bookmark_dttm:
+                    if bookmark_dttm >= last_dttm:
+                        emit_record(transformed_record)
+                        counter.increment()
+            else:
+                emit_record(transformed_record)
+                counter.increment()
+
+        if dedup_records:
+            if record_dedup(dedup_records):
+                with write_phase:
+                    for record in dedup_records:
+                        write_record(stream_name, record, time_extracted=time_extracted,
+                                     writer=writer)
+            else:
+                LOGGER.info('Stream: {}, {} unchanged records not written'.format(
+                    stream_name, len(dedup_records)))
+                counter.value = 0
 
         return max_bookmark_value, counter.value
 
 
-# Sync a specific parent or child endpoint.
+# date_list provides one date for each date in range, from the bookmark through today
+#   (or through end_date, for a backfill shard)
+def get_date_list(last_datetime, end_date=None):
+    end_dt = utils.now().date()
+    if end_date:
+        end_dt = min(end_dt, strptime_to_utc(end_date).date())
+    start_dt = strptime_to_utc(last_datetime).date()
+    return [str(start_dt + timedelta(days=x)) for x in range((end_dt - start_dt).days + 1)]
+
+
+# API request for a single location-day; safe to run from worker threads.
+# phase_timer: client phases are attributed to the stream and location (see PhaseTimer.context)
+# raw: return the raw response body (bytes), to decode in a transform worker process
+# projection_keys: keys to keep while decoding the response (see projection.Projection)
+def fetch_forecast(client, stream_name, location, url, bookmark_date, phase_timer=None,
+                   raw=False, projection_keys=None):
+    LOGGER.info('Stream: {}, Location: {}, Syncing bookmark_date = {}'.format(
+        stream_name, location, bookmark_date))
+    forecast_date = '{}T00:00:00'.format(bookmark_date)
+    forecast_url = url.replace('<forecast_date>', forecast_date)
+    LOGGER.info('URL for Stream {}: {}'.format(stream_name, forecast_url))
+
+    # API request data
+    if phase_timer is None:
+        phase_timer = PhaseTimer(enabled=False)
+    with phase_timer.context(stream_name, location):
+        data = client.get(
+            url=forecast_url,
+            decode=not raw,
+            projection_keys=projection_keys,
+            endpoint=stream_name)
+
+    # time_extracted: datetime when the data was extracted from the API
+    time_extracted = utils.now()
+    return location, data, time_extracted, bookmark_date
+
+
+# fetch_forecast, returning a failed request as a FetchError in place of the data, so it is
+#   raised (or skipped) when its location reaches it (see fetch.raise_fetch_errors)
+def try_fetch_forecast(client, stream_name, location, url, bookmark_date, **kwargs):
+    try:
+        return fetch_forecast(client, stream_name, location, url, bookmark_date, **kwargs)
+    except Exception as err: # pylint: disable=broad-except
+        return location, FetchError(err), None, bookmark_date
+
+
+# Bookmark for a Location, by its normalized key (see migrate_location_bookmarks)
+def get_location_bookmark(state, stream, location, default, bookmark_store=None):
+    return get_bookmark(state, stream, location.key, default, bookmark_store)
+
+
+# Move the bookmarks of raw location strings (aliases) that earlier versions used as bookmark
+#   keys to the normalized location keys. A location configured as several aliases (e.g.
+#   before rounding) resumes from the earliest of their bookmarks; a bookmark already under
+#   its normalized key is newer, and kept.
+def migrate_location_bookmarks(state, location_groups):
+    for stream_bookmarks in state.get('bookmarks', {}).values():
+        for location_group in location_groups:
+            for location in location_group.members:
+                alias_bookmarks = [stream_bookmarks.pop(alias) for alias in location.aliases \
+                    if alias in stream_bookmarks]
+                if alias_bookmarks and location.key not in stream_bookmarks:
+                    stream_bookmarks[location.key] = min(alias_bookmarks, key=strptime_to_utc)
+
+
+# Fetch a location group from the earliest bookmark of its locations, in all synced streams
+def get_group_bookmark(state, stream_names, location_group, default, bookmark_store=None):
+    return min(
+        [get_location_bookmark(state, stream_name, location, default, bookmark_store) \
+            for stream_name in stream_names for location in location_group.members],
+        key=strptime_to_utc)
+
+
+# Dates to fetch for a location group: from its group bookmark through end_date (default:
+#   today); with a gap_tracker (see intervals.GapTracker), only the days missing from
+#   start_date on
+def get_group_date_list(state, stream_names, location_group, start_date, end_date=None,
+                        bookmark_store=None, gap_tracker=None):
+    if gap_tracker is None:
+        group_datetime = get_group_bookmark(state, stream_names, location_group, start_date,
+                                            bookmark_store)
+        return get_date_list(group_datetime, end_date)
+    bookmarks = {(stream_name, location.key): get_location_bookmark(
+        state, stream_name, location, None, bookmark_store) \
+        for stream_name in stream_names for location in location_group.members}
+    return gap_tracker.get_date_list(state, stream_names, location_group, bookmarks,
+                                     get_date_list(start_date, end_date), bookmark_store)
+
+
+# Transform one API response to the records of each synced stream: the parent record and/or
+#   the de-nested child records (forecast_hourly, forecast_daily), without extra requests
+# unit_converter: optional units.UnitConverter, to convert the records to each unit system
+def transform_stream_records(sync_streams, data, unit_converter=None):
+    flat_streams = flatten_streams()
+    # Child time frame data lists, before the parent daily data is de-nested
+    child_data = {}
+    for sync_stream in sync_streams:
+        data_key = flat_streams[sync_stream].get('data_key')
+        if data_key:
+            child_data[sync_stream] = (data.get(data_key) or {}).get('data') or []
+
+    # Transform data with transform_json from transform.py
+    #   (keys were already converted to snake_case by the client, while decoding)
+    # LOGGER.info('data = {}'.format(data)) # TESTING, comment out
+    transformed_json = transform_json(data, convert_keys=False)
+
+    stream_records = {}
+    for sync_stream in sync_streams:
+        if sync_stream in child_data:
+            stream_records[sync_stream] = transform_child_records(
+                transformed_json, child_data[sync_stream])
+        else:
+            stream_records[sync_stream] = [transformed_json]
+        if unit_converter:
+            stream_records[sync_stream] = unit_converter.convert(
+                sync_stream, stream_records[sync_stream])
+    return stream_records
+
+
+# Later of two bookmark values (either may be None)
+def get_later_bookmark(bookmark_value, other_value):
+    if other_value is None:
+        return bookmark_value
+    if bookmark_value is None or \
+        transform_datetime(other_value) > transform_datetime(bookmark_value):
+        return other_value
+    return bookmark_value
+
+
+# Process one API response (location_group.key, data, time_extracted, forecast_date):
+#   transform it to the
+#   records of each synced stream, and write them for each location of the group.
+# Returns None for an empty response; otherwise (serialized records not yet written, if any,
+#   {(stream, location.key): (max_bookmark_value, record_count)}, new record hashes, if any).
+# record_hashes: optional dedup.GroupRecordHashes; unchanged records are then not written
+# unit_converter: optional units.UnitConverter (multi-unit mode)
+def process_response(catalog,
+                     stream_name,
+                     sync_streams,
+                     location_group,
+                     response,
+                     last_datetimes,
+                     max_bookmark_values,
+                     transformers,
+                     writer,
+                     phase_timer,
+                     record_hashes=None,
+                     unit_converter=None):
+    _, data, time_extracted, forecast_date = response
+    if not data or data is None or data == {}:
+        return None
+    flat_streams = flatten_streams()
+
+    with phase_timer.context(stream_name, location_group.key), \
+        phase_timer.phase('transform_json'):
+        stream_records = transform_stream_records(sync_streams, data, unit_converter)
+
+    response_bookmarks = {}
+    for location in location_group.members:
+        for sync_stream in sync_streams:
+            bookmark_field = next(iter(
+                flat_streams[sync_stream].get('replication_keys', [])), None)
+            bookmark_key = (sync_stream, location.key)
+            transformed_data = stream_records[sync_stream]
+            if location_group.snapped:
+                # Fan out the grid cell forecast to each location in the cell
+                transformed_data = [dict(record,
+                                         latitude=location.latitude,
+                                         longitude=location.longitude) \
+                    for record in transformed_data]
+
+            record_dedup = None
+            if record_hashes and transformed_data:
+                record_dedup = partial(record_hashes.is_changed, sync_stream, location.key,
+                                       bookmark_field)
+
+            with phase_timer.context(sync_stream, location.key):
+                # Process records, get the max_bookmark_value and record_count for the records
+                response_bookmarks[bookmark_key] = process_records(
+                    catalog=catalog,
+                    stream_name=sync_stream,
+                    records=transformed_data,
+                    time_extracted=time_extracted,
+                    bookmark_field=bookmark_field,
+                    max_bookmark_value=max_bookmark_values[bookmark_key],
+                    last_datetime=last_datetimes[bookmark_key],
+                    transformer=transformers.get(sync_stream),
+                    writer=writer,
+                    phase_timer=phase_timer,
+                    record_dedup=record_dedup)
+    return (None, response_bookmarks, record_hashes.pop_updates() if record_hashes else None,
+            forecast_date)
+
+
+# Transform one API response and serialize its records, as process_response, but returning
+#   the serialized records instead of writing them (for a transform stage or process).
+# Bookmarks are the maximum of this response only.
+# batch_streams: streams whose records are serialized as batch file lines (batch mode, see
+#   output.MessageWriter)
+def serialize_response(catalog, stream_name, sync_streams, location_group, last_datetimes,
+                       transformers, phase_timer, record_hashes, unit_converter, batch_streams,
+                       response):
+    writer = MessageWriter(buffer_size=sys.maxsize, batch_streams=batch_streams)
+    result = process_response(
+        catalog=catalog,
+        stream_name=stream_name,
+        sync_streams=sync_streams,
+        location_group=location_group,
+        response=response,
+        last_datetimes=last_datetimes,
+        max_bookmark_values=dict.fromkeys(last_datetimes),
+        transformers=transformers,
+        writer=writer,
+        phase_timer=phase_timer,
+        record_hashes=record_hashes,
+        unit_converter=unit_converter)
+    if result is None:
+        return None
+    return writer.drain(), result[1], result[2], result[3]
+
+
+# Runs in a transform worker process (see workers.TransformPool): decode one raw API
+#   response, then transform and serialize its records (see serialize_response).
+def transform_response(stream_name, sync_streams, location_group, last_datetimes,
+                       record_hashes, unit_converter, projection_keys, batch_streams, response):
+    location, body, time_extracted, forecast_date = response
+    if not body:
+        return None
+    return serialize_response(
+        catalog=get_worker_catalog(),
+        stream_name=stream_name,
+        sync_streams=sync_streams,
+        location_group=location_group,
+        last_datetimes=last_datetimes,
+        transformers={sync_stream: get_worker_transformer(sync_stream) \
+            for sync_stream in sync_streams},
+        phase_timer=PhaseTimer(enabled=False),
+        record_hashes=record_hashes,
+        unit_converter=unit_converter,
+        batch_streams=batch_streams,
+        response=(location, decode_json(body, projection_keys), time_extracted, forecast_date))
+
+
+# Sync a specific parent endpoint and its child streams, for a group of locations sharing one
+#   API request per day (see locations.LocationRegistry); each location gets its own records
+#   and bookmark, in each stream.
+# sync_streams: the selected streams to sync from the endpoint (default: stream_name)
+# transformers: RecordTransformer by stream, compiled once per stream (see sync)
+# end_date: last date to sync (default: today), for backfill shards
+# responses: optional iterable of (location_group.key, data, time_extracted, forecast_date), in
+#   date order, already fetched for this group (see sync); when omitted, each day is fetched
+#   in turn.
+# transform_pool: optional workers.TransformPool; responses are then raw response bodies
+# record_dedup: optional dedup.RecordDedup, to skip records already written unchanged
+# unit_converter: optional units.UnitConverter; responses are then in SI units
+# projection: projection.Projection of the responses to the selected fields of sync_streams
+#   (default: compiled from the catalog)
+# pipeline_queue_size: without a transform_pool, fetch (and decode) and transform responses
+#   in their own threads (pipeline stages, see fetch.prefetch), each up to pipeline_queue_size
+#   responses ahead of the next stage; 0 (default) runs the stages in turn
+# bookmark_store: optional bookmarks.BookmarkStore, to keep the bookmarks in (instead of state)
+# gap_tracker: optional intervals.GapTracker, to fetch only missing days (in any order); a
+#   day without data, or whose request failed, is then skipped, not the end of the sync
 def sync_endpoint(client,
                   catalog,
                   state,
                   start_date,
                   stream_name,
                   url,
-                  location,
-                  bookmark_field=None):
-
-    # Get the latest bookmark for the stream and set the last_integer/datetime
-    last_datetime = get_bookmark(state, stream_name, location, start_date)
-    max_bookmark_value = last_datetime
-
-    end_dttm = utils.now()
-    end_dt = end_dttm.date()
-    start_dttm = strptime_to_utc(last_datetime)
-    start_dt = start_dttm.date()
-
-    # date_list provides one date for each date in range
-    date_list = [str(start_dt + timedelta(days=x)) for x in range((end_dt - start_dt).days + 1)]
+                  location_group,
+                  sync_streams=None,
+                  responses=None,
+                  transformers=None,
+                  writer=None,
+                  checkpointer=None,
+                  phase_timer=None,
+                  end_date=None,
+                  transform_pool=None,
+                  record_dedup=None,
+                  unit_converter=None,
+                  projection=None,
+                  pipeline_queue_size=0,
+                  bookmark_store=None,
+                  gap_tracker=None):
+
+    if sync_streams is None:
+        sync_streams = [stream_name]
+    if transformers is None:
+        transformers = {}
+    if writer is None:
+        writer = MessageWriter(buffer_size=0)
+    if checkpointer is None:
+        checkpointer = StateCheckpointer(writer)
+    if phase_timer is None:
+        phase_timer = PhaseTimer(enabled=False)
+    if projection is None:
+        projection = Projection.from_catalog(catalog, sync_streams)
+    flat_streams = flatten_streams()
+
+    # Get the latest bookmark for the stream and set the last_integer/datetime,
+    #   by stream and location
+    bookmarks = {}
+    for sync_stream in sync_streams:
+        for location in location_group.members:
+            bookmarks[(sync_stream, location.key)] = get_location_bookmark(
+                state, sync_stream, location, None, bookmark_store)
+    last_datetimes = {key: bookmark or start_date for key, bookmark in bookmarks.items()}
+    max_bookmark_values = dict(last_datetimes)
+    if gap_tracker:
+        # Days are fetched in any order, so records before the bookmarks are kept
+        last_datetimes = dict.fromkeys(last_datetimes, start_date)
+    record_hashes = None
+    if record_dedup:
+        record_hashes = record_dedup.for_group(state, sync_streams, location_group,
+                                               bookmark_store)
+
+    if responses is None:
+        fetch = try_fetch_forecast if gap_tracker else fetch_forecast
+        responses = (fetch(client, stream_name, location_group.key, url, bookmark_date,
+                           phase_timer=phase_timer, raw=transform_pool is not None,
+                           projection_keys=projection.keys) \
+            for bookmark_date in get_group_date_list(state, sync_streams, location_group,
+                                                     start_date, end_date, bookmark_store,
+                                                     gap_tracker))
+    # Failed requests fail the sync of the location group (see retry.DeferredRetryQueue);
+    #   with a gap_tracker, those that would be deferred are skipped (left as gaps) instead
+    responses = raise_fetch_errors(
+        responses, partial(is_deferrable, ERROR_RETRY_POLICIES) if gap_tracker else None)
+
+    if transform_pool:
+        # Raw responses are decoded, transformed and serialized by the worker processes
+        results = transform_pool.map(
+            partial(transform_response, stream_name, sync_streams, location_group,
+                    last_datetimes, record_hashes, unit_converter, projection.keys,
+                    writer.batch_streams),
+            responses)
+    elif pipeline_queue_size:
+        # Pipeline: fetch -> transform -> emit (this thread), overlapping, with bounded queues
+        responses = prefetch(responses, pipeline_queue_size)
+        results = prefetch(
+            (serialize_response(catalog, stream_name, sync_streams, location_group,
+                                last_datetimes, transformers, phase_timer, record_hashes,
+                                unit_converter, writer.batch_streams, response) \
+                for response in responses),
+            pipeline_queue_size)
+    else:
+        results = (process_response(catalog, stream_name, sync_streams, location_group,
+                                    response, last_datetimes, max_bookmark_values,
+                                    transformers, writer, phase_timer, record_hashes,
+                                    unit_converter) \
+            for response in responses)
 
     total_records = 0
-    for bookmark_date in date_list:
-        LOGGER.info('Stream: {}, Syncing bookmark_date = {}'.format(
-            stream_name, bookmark_date))
-        forecast_date = '{}T00:00:00'.format(bookmark_date)
-        forecast_url = url.replace('<forecast_date>', forecast_date)
-        LOGGER.info('URL for Stream {}: {}'.format(stream_name, forecast_url))
-
-        # API request data
-        data = {}
-        data = client.get(
-            url=forecast_url,
-            endpoint=stream_name)
-
-        # time_extracted: datetime when the data was extracted from the API
-        time_extracted = utils.now()
-        if not data or data is None or data == {}:
-            break # No data results
-
-        # Transform data with transform_json from transform.py
-        # LOGGER.info('data = {}'.format(data)) # TESTING, comment out
-        transformed_data = [] # initialize the record list
-        transformed_data.append(transform_json(data))
-
-        # LOGGER.info('transformed_data = {}'.format(transformed_data)) # TESTING, comment out
-        if not transformed_data or transformed_data is None or transformed_data == []:
-            LOGGER.info('No transformed data for data = {}'.format(data))
-            break # No data results
-
-        # Process records and get the max_bookmark_value and record_count for the set of records
-        max_bookmark_value, record_count = process_records(
-            catalog=catalog,
-            stream_name=stream_name,
-            records=transformed_data,
-            time_extracted=time_extracted,
-            bookmark_field=bookmark_field,
-            max_bookmark_value=max_bookmark_value,
-            last_datetime=last_datetime)
-
-        total_records = total_records + record_count
-        LOGGER.info('Stream {}, location: {}, batch processed {} records'.format(
-            stream_name, location, record_count))
-
-        # Update the state with the max_bookmark_value for the stream
-        if bookmark_field:
-            write_bookmark(state, stream_name, location, max_bookmark_value)
+    try:
+        for result in results:
+            if result is None:
+                if gap_tracker:
+                    continue # No data results: left as a gap
+                break # No data results
+            records_output, response_bookmarks, hash_updates, forecast_date = result
+            if records_output:
+                writer.write_serialized(*records_output)
+            if hash_updates:
+                record_dedup.update(state, hash_updates, bookmark_store)
+            if gap_tracker:
+                gap_tracker.add_day(state, sync_streams, location_group, bookmarks,
+                                    forecast_date, bookmark_store)
+
+            for location in location_group.members:
+                for sync_stream in sync_streams:
+                    bookmark_field = next(iter(
+                        flat_streams[sync_stream].get('replication_keys', [])), None)
+                    bookmark_key = (sync_stream, location.key)
+                    max_bookmark_value, record_count = response_bookmarks[bookmark_key]
+                    max_bookmark_values[bookmark_key] = get_later_bookmark(
+                        max_bookmark_values[bookmark_key], max_bookmark_value)
+
+                    with phase_timer.context(sync_stream, location.key):
+                        total_records = total_records + record_count
+                        checkpointer.records_written(record_count)
+                        LOGGER.info('Stream {}, location: {}, batch processed {} records'.format(
+                            sync_stream, location.key, record_count))
+
+                        # Update the state with the max_bookmark_value for the stream
+                        if bookmark_field:
+                            if record_dedup:
+                                record_dedup.prune(state, sync_stream, location.key,
+                                                   max_bookmark_values[bookmark_key],
+                                                   bookmark_store)
+                            write_bookmark(state, sync_stream, location.key,
+                                           max_bookmark_values[bookmark_key], checkpointer,
+                                           bookmark_store)
+
+        else:
+            # All dates through end_date were synced: the backfill shard is complete
+            if end_date and not (gap_tracker and get_group_date_list(
+                    state, sync_streams, location_group, start_date, end_date, bookmark_store,
+                    gap_tracker)):
+                state['complete'] = True
+    finally:
+        # Stop fetching (and transforming) ahead after an early stop
+        for stage in [results, responses]:
+            close = getattr(stage, 'close', None)
+            if close:
+                close()
 
     # Return total_records (for all pages)
     return total_records
 
 
+# Fetch (location, date) requests for all shards (see backfill.Shard) with a pool of
+#   max_workers threads.
+# Responses are yielded in shard, then date order, so records and bookmarks are written
+#   exactly as in a serial sync; at most max_workers * 2 requests are in flight (or buffered).
+# Shards finished in location_responses stop being scheduled (e.g. after a day without data).
+# A failed request is passed on as a FetchError, and raised when its shard reaches it.
+# gap_tracker: optional intervals.GapTracker; only missing days are fetched, and the responses
+#   of a shard are yielded as they complete, in any order
+def fetch_locations(client, state, stream_name, sync_streams, shard_urls,
+                    max_workers, location_responses, phase_timer=None, raw=False,
+                    projection_keys=None, bookmark_store=None, gap_tracker=None):
+    def generate_tasks():
+        for shard, url in shard_urls:
+            date_list = get_group_date_list(
+                get_shard_state(state, shard), sync_streams, shard.location_group,
+                shard.start_date, shard.end_date,
+                get_shard_bookmark_store(bookmark_store, shard), gap_tracker)
+            for bookmark_date in date_list:
+                if shard.key in location_responses.finished:
+                    break
+                yield stream_name, shard.key, url, bookmark_date
+
+    fetch_task = partial(try_fetch_forecast, client, phase_timer=phase_timer, raw=raw,
+                         projection_keys=projection_keys)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if gap_tracker:
+            yield from grouped_unordered_map(executor, fetch_task, generate_tasks(),
+                                             group=lambda task: task[1],
+                                             window=max_workers * 2)
+        else:
+            yield from ordered_map(executor, fetch_task, generate_tasks(),
+                                   window=max_workers * 2)
+
+
 # Currently syncing sets the stream currently being delivered in the state.
 # If the integration is interrupted, this state property is used to identify
 #  the starting point to continue from.
 # Reference: https://github.com/singer-io/singer-python/blob/master/singer/bookmarks.py#L41-L46
-def update_currently_syncing(state, stream_name):
+def update_currently_syncing(state, stream_name, checkpointer):
     if (stream_name is None) and ('currently_syncing' in state):
         del state['currently_syncing']
     else:
         singer.set_currently_syncing(state, stream_name)
-    singer.write_state(state)
+    checkpointer.update(state)
 
 
-def sync(client, config, catalog, state):
+# writer: MessageWriter for Singer messages (default: buffered stdout)
+# transform_pool: optional workers.TransformPool to reuse (e.g. by the daemon, see daemon.py),
+#   kept open; by default, one is created for this sync (config transform_workers)
+def sync(client, config, catalog, state, writer=None, phase_timer=None, transform_pool=None):
     start_date = config.get('start_date')
     language = config.get('language', 'en')
     units = config.get('units', 'auto')
-
-    # Stitch UI config parameters may be text areas, but limited to varchar(16384), 5461 chars,
-    #   approx. 227 lat,lon locations (without spaces, 6-digit precision)
-    # locations_list should be delimited like: lat1,lon1;lat2,lon2;lat3,lon3
-    #   commas separating lat,lon and semicolons ; separating locations
-    locations = config.get('location_list')
-
-    # Remove non-numeric chars except commas, semicolons, minus signs
-    #   and Split to list of locations by semicolon
-    location_list = re.sub('[^0-9,.;-]', '', locations).split(";")
-
-    # Get selected_streams from catalog, based on state last_stream
-    #   last_stream = Previous currently synced stream, if the load was interrupted
-    last_stream = singer.get_currently_syncing(state)
-    LOGGER.info('last/currently syncing stream: {}'.format(last_stream))
-    selected_streams = []
-    for stream in catalog.get_selected_streams(state):
-        selected_streams.append(stream.stream)
-    LOGGER.info('selected_streams: {}'.format(selected_streams))
-
-    if not selected_streams or selected_streams == []:
-        return
-
-    # Loop through endpoints in selected_streams
-    for stream_name, endpoint_config in STREAMS.items():
-        if stream_name in selected_streams:
-            LOGGER.info('START Syncing: {}'.format(stream_name))
-            update_currently_syncing(state, stream_name)
-            write_schema(catalog, stream_name)
-            bookmark_field = next(iter(endpoint_config.get('replication_keys', [])), None)
-            # Get exclusions based on catalog not selected
-            exclusions_list = 'currently,minutely'
-            if stream_name == 'forecast':
-                # Create exclusions_list from catalog breadcrumb
-                stream = catalog.get_stream(stream_name)
-                mdata = metadata.to_map(stream.metadata)
-                sections_all = ['hourly', 'daily', 'flags']
-                for section in sections_all:
-                    if not singer.metadata.get(mdata, ('properties', section), 'selected'):
-                        # metadata is selected for the dimension
-                        exclusions_list = '{},{}'.format(exclusions_list, section)
-
-            # Replace in url and query params
-            params = endpoint_config.get('params', {})
-            # Squash params and replace language and units
-            querystring = '&'.join(['%s=%s' % (key, value) for (key, value) in \
-                params.items()]).replace('<language>', language).replace(
-                    '<units>', units).replace('<exclusions_list>', exclusions_list)
-            endpoint_total = 0
-            # Loop for each lat,lon location in location_list
-            for location in location_list:
-                loc_path = endpoint_config.get('path').replace('<location>', location)
-                url = '{}/{}?{}'.format(
-                    client.base_url,
-                    loc_path,
-                    querystring)
-                total_records = sync_endpoint(
-                    client=client,
-                    catalog=catalog,
-                    state=state,
-                    start_date=start_date,
-                    stream_name=stream_name,
-                    url=url,
-                    location=location,
-                    bookmark_field=bookmark_field)
-
-                update_currently_syncing(state, None)
-                LOGGER.info('FINISHED Syncing: {}, location: {}, total_records: {}'.format(
+    # Multi-unit mode (a comma-separated list of units): fetch once in SI, convert locally
+    unit_converter = UnitConverter.from_config(config)
+    if unit_converter:
+        units = FETCH_UNITS
+        catalog = unit_converter.get_catalog(catalog)
+    # max_workers: number of concurrent API requests; 1 (default) syncs serially
+    max_workers = int(config.get('max_workers', 1))
+    # pipeline_queue_size: responses queued between the fetch, transform and emit stages;
+    #   0 runs them in turn
+    pipeline_queue_size = int(config.get('pipeline_queue_size', DEFAULT_PIPELINE_QUEUE_SIZE))
+    if writer is None:
+        writer = MessageWriter.from_config(config)
+    if phase_timer is None:
+        phase_timer = PhaseTimer.from_config(config)
+    # Per-location bookmarks in a local table (config bookmark_store_path), or None to keep
+    #   them in the state
+    bookmark_store = BookmarkStore.from_config(config, state)
+    # Closed (with the transform pool this sync creates) whether the sync completes or fails,
+    #   e.g. in the daemon, which retries failed syncs
+    owned_transform_pool = transform_pool is None
+    try:
+        checkpointer = StateCheckpointer.from_config(config, writer, phase_timer, bookmark_store)
+
+        # Stitch UI config parameters may be text areas, but limited to varchar(16384), 5461 chars,
+        #   approx. 227 lat,lon locations (without spaces, 6-digit precision); larger location
+        #   lists are read from a CSV or GeoJSON file (config location_file)
+        # Locations are normalized and de-duplicated, and optionally grouped by grid cell,
+        #   to fetch one API request per location group per day
+        location_groups = LocationRegistry.from_config(config).get_groups()
+        migrate_location_bookmarks(state, location_groups)
+
+        # Backfill mode (see backfill.py): sync the shards of the (location x date range) space
+        #   assigned to this process, each with its own bookmarks; a normal sync has one shard per
+        #   location group, from its bookmark through today.
+        backfill_plan = BackfillPlan.from_config(config, location_groups)
+        if backfill_plan:
+            shards = backfill_plan.get_assigned_shards()
+        else:
+            shards = [Shard(location_group, start_date) for location_group in location_groups]
+        shard_checkpointer = ShardCheckpointer(checkpointer, state)
+
+        # Get selected_streams from catalog, based on state last_stream
+        #   last_stream = Previous currently synced stream, if the load was interrupted
+        last_stream = singer.get_currently_syncing(state)
+        LOGGER.info('last/currently syncing stream: {}'.format(last_stream))
+        selected_streams = []
+        for stream in catalog.get_selected_streams(state):
+            selected_streams.append(stream.stream)
+        LOGGER.info('selected_streams: {}'.format(selected_streams))
+
+        if not selected_streams or selected_streams == []:
+            return
+
+        # Transform worker processes (config transform_workers), or None to transform in-process
+        if owned_transform_pool:
+            transform_pool = TransformPool.from_config(config, catalog)
+        # Content-hash dedup of re-fetched records (config record_dedup), or None
+        record_dedup = RecordDedup.from_config(config)
+        # Gap-aware day tracking (config gap_tracking), or None to sync from the bookmarks
+        gap_tracker = GapTracker.from_config(config)
+
+        # Loop through endpoints with selected_streams (the parent stream and/or its children)
+        for stream_name, endpoint_config in STREAMS.items():
+            sync_streams = [name for name in \
+                [stream_name] + list(endpoint_config.get('children', {})) \
+                    if name in selected_streams]
+            if sync_streams:
+                LOGGER.info('START Syncing: {}'.format(', '.join(sync_streams)))
+                update_currently_syncing(state, stream_name, checkpointer)
+                transformers = {}
+                for sync_stream in sync_streams:
+                    write_schema(catalog, sync_stream, writer, unit_converter)
+                    transformers[sync_stream] = RecordTransformer.from_catalog(catalog, sync_stream)
+                # Projection of the responses to the selected fields of the synced streams, applied
+                #   while decoding; unselected sections (and alerts) are excluded from the request
+                projection = Projection.from_catalog(catalog, sync_streams)
+                exclusions_list = 'currently,minutely'
+                if stream_name == 'forecast':
+                    exclusions_list = ','.join(projection.get_exclusions())
+
+                # Replace in url and query params
+                params = endpoint_config.get('params', {})
+                # Squash params and replace language and units
+                querystring = '&'.join(['%s=%s' % (key, value) for (key, value) in \
+                    params.items()]).replace('<language>', language).replace(
+                        '<units>', units).replace('<exclusions_list>', exclusions_list)
+                endpoint_total = 0
+                # Build the URL for each lat,lon location group shard (skipping completed backfill
+                #   shards)
+                shard_urls = []
+                for shard in shards:
+                    if is_shard_complete(state, shard):
+                        continue
+                    loc_path = endpoint_config.get('path').replace(
+                        '<location>', shard.location_group.key)
+                    url = '{}/{}?{}'.format(
+                        client.base_url,
+                        loc_path,
+                        querystring)
+                    shard_urls.append((shard, url))
+
+                # Concurrent mode: fetch location-days with a worker pool, in deterministic order
+                location_responses = LocationResponses()
+                if max_workers > 1:
+                    location_responses.attach(fetch_locations(
+                        client=client,
+                        state=state,
+                        stream_name=stream_name,
+                        sync_streams=sync_streams,
+                        shard_urls=shard_urls,
+                        max_workers=max_workers,
+                        location_responses=location_responses,
+                        phase_timer=phase_timer,
+                        raw=transform_pool is not None,
+                        projection_keys=projection.keys,
+                        bookmark_store=bookmark_store,
+                        gap_tracker=gap_tracker))
+
+                # Deferred retries of shards whose requests failed with a transient error (see
+                #   retry.DeferredRetryQueue): retried from their bookmark once due, between the
+                #   other shards, then after them
+                retry_queue = DeferredRetryQueue.from_config(config)
+
+                def get_shard_tasks():
+                    for shard, url in shard_urls:
+                        location_response = None
+                        if max_workers > 1:
+                            location_response = location_responses.for_location(shard.key)
+                        yield shard, url, location_response
+                        for retry_shard, retry_url in retry_queue.pop_ready():
+                            yield retry_shard, retry_url, None
+                    for retry_shard, retry_url in retry_queue.pop_ready(wait=True):
+                        yield retry_shard, retry_url, None
+
+                # Loop for each lat,lon location group shard
+                for shard, url, location_response in get_shard_tasks():
+                    try:
+                        total_records = sync_endpoint(
+                            client=client,
+                            catalog=catalog,
+                            state=get_shard_state(state, shard),
+                            start_date=shard.start_date,
+                            stream_name=stream_name,
+                            url=url,
+                            location_group=shard.location_group,
+                            sync_streams=sync_streams,
+                            responses=location_response,
+                            transformers=transformers,
+                            writer=writer,
+                            checkpointer=shard_checkpointer,
+                            phase_timer=phase_timer,
+                            end_date=shard.end_date,
+                            transform_pool=transform_pool,
+                            record_dedup=record_dedup,
+                            unit_converter=unit_converter,
+                            projection=projection,
+                            pipeline_queue_size=pipeline_queue_size,
+                            bookmark_store=get_shard_bookmark_store(bookmark_store, shard),
+                            gap_tracker=gap_tracker)
+                    except Exception as err: # pylint: disable=broad-except
+                        if not is_deferrable(ERROR_RETRY_POLICIES, err):
+                            raise
+                        retry_queue.defer(shard, url, err)
+                        total_records = 0
+                    location_responses.finish(shard.key)
+
+                    update_currently_syncing(state, None, checkpointer)
+                    LOGGER.info('FINISHED Syncing: {}, location: {}, total_records: {}'.format(
+                        stream_name,
+                        shard.key,
+                        total_records))
+                    endpoint_total = endpoint_total + total_records
+                location_responses.close()
+                checkpointer.checkpoint(state)
+
+                LOGGER.info('FINISHED Syncing: {}, total_records: {}'.format(
                     stream_name,
-                    location,
-                    total_records))
-                endpoint_total = endpoint_total + total_records
-
-            LOGGER.info('FINISHED Syncing: {}, total_records: {}'.format(
-                stream_name,
-                endpoint_total))
+                    endpoint_total))
+    finally:
+        if transform_pool and owned_transform_pool:
+            transform_pool.close()
+        if bookmark_store:
+            bookmark_store.close()
+    writer.flush()
+    phase_timer.report()
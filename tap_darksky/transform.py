@@ -1,3 +1,5 @@
+from functools import partial
+import json
 import re
 import time
 import pytz
@@ -5,6 +7,13 @@ import pytz
 import singer
 from singer.transform import unix_seconds_to_datetime
 from singer.utils import strptime_to_utc
+from tap_darksky.schema import get_schemas
+
+# ijson (optional, pip install tap-darksky[streaming]) parses responses incrementally
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 LOGGER = singer.get_logger()
 
@@ -15,37 +24,162 @@ def convert(name):
     return re.sub('([a-z0-9])([A-Z])', r'\1_\2', regsub).lower()
 
 
-# Convert keys in json array
-def convert_array(arr):
-    new_arr = []
-    for i in arr:
-        if isinstance(i, list):
-            new_arr.append(convert_array(i))
-        elif isinstance(i, dict):
-            new_arr.append(convert_json(i))
-        else:
-            new_arr.append(i)
-    return new_arr
+# Convert snake_case to camelCase (inverse of convert, for schema property names)
+def to_camel_case(name):
+    first, *rest = name.split('_')
+    return first + ''.join(word.capitalize() for word in rest)
 
 
-# Convert keys in json
-def convert_json(this_json):
-    out = {}
-    for key in this_json:
+# Collect all property names in a JSON schema (including nested objects and arrays)
+def get_schema_keys(schema):
+    keys = set()
+    nodes = [schema]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, dict):
+            keys.update(node.get('properties', {}).keys())
+            nodes.extend(node.values())
+        elif isinstance(node, list):
+            nodes.extend(node)
+    return keys
+
+
+# Key translation cache: API key -> snake_case key.
+# Seeded with the camelCase form of every property in the stream schemas; other keys are
+#   added as they are first seen (up to MAX_KEY_CACHE_SIZE).
+MAX_KEY_CACHE_SIZE = 10000
+
+def build_key_cache():
+    key_cache = {}
+    schemas, _ = get_schemas()
+    for schema in schemas.values():
+        for key in get_schema_keys(schema):
+            camel_key = to_camel_case(key)
+            # Only seed translations that convert would produce for the API key
+            if convert(camel_key) == key:
+                key_cache[camel_key] = key
+    return key_cache
+
+KEY_CACHE = build_key_cache()
+
+
+def convert_key(key):
+    new_key = KEY_CACHE.get(key)
+    if new_key is None:
         try:
             new_key = convert(key)
         except TypeError as err:
             LOGGER.error('Error key = {}'.format(key))
             raise err
-        if isinstance(this_json[key], dict):
-            out[new_key] = convert_json(this_json[key])
-        elif isinstance(this_json[key], list):
-            out[new_key] = convert_array(this_json[key])
+        if len(KEY_CACHE) < MAX_KEY_CACHE_SIZE:
+            KEY_CACHE[key] = new_key
+    return new_key
+
+
+# Convert keys in json (nested dicts and lists), in one iterative pass:
+#   each container is copied once, with its keys renamed through KEY_CACHE
+def convert_json(this_json):
+    out = {}
+    containers = [(this_json, out)]
+    while containers:
+        source, target = containers.pop()
+        if isinstance(source, dict):
+            items = ((convert_key(key), value) for key, value in source.items())
         else:
-            out[new_key] = this_json[key]
+            items = enumerate(source)
+        for new_key, value in items:
+            if isinstance(value, dict):
+                new_value = {}
+                containers.append((value, new_value))
+            elif isinstance(value, list):
+                new_value = []
+                containers.append((value, new_value))
+            else:
+                new_value = value
+            if isinstance(target, dict):
+                target[new_key] = new_value
+            else:
+                target.append(new_value)
     return out
 
 
+# Convert keys in json array
+def convert_array(arr):
+    return convert_json({'array': arr})['array']
+
+
+def convert_pairs(pairs):
+    return {convert_key(key): value for key, value in pairs}
+
+
+# Convert keys, keeping only the projected keys (see projection.Projection)
+def convert_projected_pairs(projection_keys, pairs):
+    result = {}
+    for key, value in pairs:
+        new_key = convert_key(key)
+        if new_key in projection_keys:
+            result[new_key] = value
+    return result
+
+
+# Build JSON from ijson parser events, converting keys as they are parsed
+# projection_keys: optional keys to keep; the values of other keys are skipped, not built
+def build_json(events, projection_keys=None):
+    root = []
+    containers = [root]
+    keys = [None]
+    skip_depth = 0
+    for event, value in events:
+        if skip_depth:
+            # Skipping the value of a key outside the projection
+            if event in ('start_map', 'start_array'):
+                skip_depth = skip_depth + 1
+            elif event in ('end_map', 'end_array'):
+                skip_depth = skip_depth - 1
+            if skip_depth == 1:
+                skip_depth = 0
+            continue
+        if event == 'map_key':
+            keys[-1] = convert_key(value)
+            if projection_keys is not None and keys[-1] not in projection_keys:
+                skip_depth = 1
+            continue
+        if event in ('end_map', 'end_array'):
+            containers.pop()
+            keys.pop()
+            continue
+        if event == 'start_map':
+            value = {}
+        elif event == 'start_array':
+            value = []
+        container = containers[-1]
+        if isinstance(container, dict):
+            container[keys[-1]] = value
+        else:
+            container.append(value)
+        if event in ('start_map', 'start_array'):
+            containers.append(value)
+            keys.append(None)
+    return root[0] if root else None
+
+
+# Decode a JSON response body (a file-like object, str or bytes) with keys converted to
+#   snake_case while parsing, so no camelCase copy of the response is built.
+# File-like bodies are parsed incrementally with ijson, if installed (without it, the body is
+#   read in full first).
+# projection_keys: optional keys to keep, at any depth (see projection.Projection); the
+#   others are dropped while parsing.
+def decode_json(body, projection_keys=None):
+    if ijson and hasattr(body, 'read'):
+        return build_json(ijson.basic_parse(body, use_float=True), projection_keys)
+    object_pairs_hook = convert_pairs
+    if projection_keys is not None:
+        object_pairs_hook = partial(convert_projected_pairs, projection_keys)
+    if hasattr(body, 'read'):
+        return json.load(body, object_pairs_hook=object_pairs_hook)
+    return json.loads(body, object_pairs_hook=object_pairs_hook)
+
+
 def get_min_max_times(this_json):
     time_zone = this_json.get('timezone', 'UTC')
     time_frames = ['daily', 'hourly']
@@ -76,8 +210,9 @@ def denest_daily_data(this_json):
     return new_json
 
 # Run all transforms: convert camelCase to snake_case
-def transform_json(this_json):
-    converted_json = convert_json(this_json)
+# convert_keys: False if the keys were already converted (e.g. by decode_json)
+def transform_json(this_json, convert_keys=True):
+    converted_json = convert_json(this_json) if convert_keys else this_json
     start_time, end_time, local_date = get_min_max_times(converted_json)
     converted_json['start_time'] = start_time
     converted_json['end_time'] = end_time
@@ -85,3 +220,18 @@ def transform_json(this_json):
     converted_json['forecast_date'] = '{}T00:00:00Z'.format(local_date)
     denested_json = denest_daily_data(converted_json)
     return denested_json
+
+
+# Parent fields added to each de-nested child record (see streams children)
+CHILD_PARENT_FIELDS = ['latitude', 'longitude', 'timezone', 'forecast_date', 'local_date']
+
+# De-nest a time frame data list (hourly or daily) from a transformed parent to flat child
+#   records, each with the parent location and date fields
+def transform_child_records(parent_json, child_data):
+    parent_fields = {key: parent_json.get(key) for key in CHILD_PARENT_FIELDS}
+    child_records = []
+    for child_record in child_data:
+        record = dict(parent_fields)
+        record.update(child_record)
+        child_records.append(record)
+    return child_records
@@ -0,0 +1,223 @@
+import copy
+from functools import lru_cache
+import re
+
+from singer import metadata, Transformer, UNIX_SECONDS_INTEGER_DATETIME_PARSING
+from singer.transform import string_to_datetime as singer_string_to_datetime
+from singer.transform import unix_seconds_to_datetime as singer_unix_seconds_to_datetime
+
+# Reference: singer.transform.Transformer, which this module compiles for a fixed schema.
+# https://github.com/singer-io/singer-python/blob/master/singer/transform.py
+
+# Returned by compiled transforms when the data does not match the schema
+FAIL = object()
+
+
+# Darksky times are repeated across locations and records (e.g. each hour of each day)
+@lru_cache(maxsize=65536)
+def unix_seconds_to_datetime(seconds):
+    return singer_unix_seconds_to_datetime(seconds)
+
+
+@lru_cache(maxsize=4096)
+def string_to_datetime(value):
+    return singer_string_to_datetime(value)
+
+
+# Same as Transformer()._transform_datetime (no integer parsing), without a Transformer
+def transform_datetime(value):
+    if value is None or value == '':
+        return None
+    return string_to_datetime(value)
+
+
+# Same as Transformer(UNIX_SECONDS_INTEGER_DATETIME_PARSING)._transform_datetime
+def transform_unix_datetime(value):
+    if value is None or value == '':
+        return FAIL
+    try:
+        result = unix_seconds_to_datetime(int(value))
+    except Exception: # pylint: disable=broad-except
+        try:
+            result = string_to_datetime(value)
+        except TypeError: # unhashable
+            result = singer_string_to_datetime(value)
+    return FAIL if result is None else result
+
+
+def transform_null(data):
+    if data is None or data == '':
+        return None
+    return FAIL
+
+
+def transform_string(data):
+    if data is None:
+        return FAIL
+    try:
+        return str(data)
+    except Exception: # pylint: disable=broad-except
+        return FAIL
+
+
+def transform_integer(data):
+    if isinstance(data, str):
+        data = data.replace(',', '')
+    try:
+        return int(data)
+    except Exception: # pylint: disable=broad-except
+        return FAIL
+
+
+def transform_number(data):
+    if data.__class__ is float:
+        return data
+    if isinstance(data, str):
+        data = data.replace(',', '')
+    try:
+        return float(data)
+    except Exception: # pylint: disable=broad-except
+        return FAIL
+
+
+def transform_boolean(data):
+    if isinstance(data, str) and data.lower() == 'false':
+        return False
+    try:
+        return bool(data)
+    except Exception: # pylint: disable=broad-except
+        return FAIL
+
+
+def transform_any(data):
+    return data
+
+
+def compile_first_match(transforms):
+    if len(transforms) == 1:
+        return transforms[0]
+
+    def transform_first_match(data):
+        for transform in transforms:
+            value = transform(data)
+            if value is not FAIL:
+                return value
+        return FAIL
+    return transform_first_match
+
+
+def compile_object(schema):
+    properties = {key: compile_schema(sub_schema) \
+        for key, sub_schema in schema.get('properties', {}).items()}
+    pattern_properties = [(re.compile(pattern), compile_schema(sub_schema)) \
+        for pattern, sub_schema in (schema.get('patternProperties') or {}).items()]
+
+    if not properties and not pattern_properties:
+        return lambda data: data if isinstance(data, dict) else FAIL
+
+    def transform_object(data):
+        if not isinstance(data, dict):
+            return FAIL
+        result = {}
+        for key, value in data.items():
+            transform = properties.get(key)
+            if transform is None and pattern_properties:
+                matches = [pattern_transform for pattern, pattern_transform \
+                    in pattern_properties if pattern.match(key)]
+                if matches:
+                    transform = compile_first_match(matches)
+            if transform is None:
+                continue # Not in schema: removed
+            value = transform(value)
+            if value is FAIL:
+                return FAIL
+            result[key] = value
+        return result
+    return transform_object
+
+
+def compile_array(schema):
+    transform_item = compile_schema(schema['items'])
+
+    def transform_array(data):
+        if not isinstance(data, list):
+            return FAIL
+        result = []
+        for item in data:
+            value = transform_item(item)
+            if value is FAIL:
+                return FAIL
+            result.append(value)
+        return result
+    return transform_array
+
+
+def compile_type(typ, schema):
+    if typ == 'null':
+        return transform_null
+    if schema.get('format') == 'date-time':
+        return transform_unix_datetime
+    if typ == 'object':
+        return compile_object(schema)
+    if typ == 'array':
+        return compile_array(schema)
+    return {
+        'string': transform_string,
+        'integer': transform_integer,
+        'number': transform_number,
+        'boolean': transform_boolean
+    }.get(typ, lambda data: FAIL)
+
+
+# Compile a JSON schema to a function: data -> transformed data (or FAIL)
+def compile_schema(schema):
+    if 'anyOf' in schema:
+        return compile_first_match([compile_schema(sub_schema) for sub_schema in schema['anyOf']])
+
+    if 'type' not in schema:
+        return transform_any
+
+    types = schema['type']
+    if not isinstance(types, list):
+        types = [types]
+    # Like the singer Transformer, try null last
+    types = [typ for typ in types if typ != 'null'] + (['null'] if 'null' in types else [])
+    return compile_first_match([compile_type(typ, schema) for typ in types])
+
+
+# Same field selection as the singer Transformer: fields are kept unless deselected (or
+#   unsupported); automatic fields are always kept
+def is_selected_field(stream_metadata, field_name):
+    selected = metadata.get(stream_metadata, ('properties', field_name), 'selected')
+    inclusion = metadata.get(stream_metadata, ('properties', field_name), 'inclusion')
+    return inclusion == 'automatic' or (selected is not False and inclusion != 'unsupported')
+
+
+# Record transformer compiled once per stream from the catalog schema and selection metadata.
+# Produces the same output as singer Transformer(UNIX_SECONDS_INTEGER_DATETIME_PARSING), without
+#   re-walking the schema and metadata for every record.
+class RecordTransformer(object):
+    def __init__(self, schema, stream_metadata):
+        self.schema = schema
+        self.metadata = stream_metadata
+        self.filtered_fields = []
+        for field_name in schema.get('properties', {}):
+            if not is_selected_field(stream_metadata, field_name):
+                self.filtered_fields.append(field_name)
+        self.__transform = compile_schema(schema)
+
+    @classmethod
+    def from_catalog(cls, catalog, stream_name):
+        stream = catalog.get_stream(stream_name)
+        return cls(stream.schema.to_dict(), metadata.to_map(stream.metadata))
+
+    def transform(self, record):
+        for field_name in self.filtered_fields:
+            record.pop(field_name, None)
+        transformed_record = self.__transform(record)
+        if transformed_record is FAIL:
+            # Re-run the singer Transformer to raise SchemaMismatch with the error details
+            with Transformer(integer_datetime_fmt=UNIX_SECONDS_INTEGER_DATETIME_PARSING) \
+                as transformer:
+                return transformer.transform(record, copy.deepcopy(self.schema), self.metadata)
+        return transformed_record
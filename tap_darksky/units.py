@@ -0,0 +1,155 @@
+import singer
+from singer.catalog import Catalog
+from tap_darksky.streams import flatten_streams
+
+LOGGER = singer.get_logger()
+
+# Darksky unit systems (except auto, which depends on the location)
+# Reference: https://darksky.net/dev/docs (Request Parameters, units)
+UNIT_SYSTEMS = ['si', 'us', 'ca', 'uk2']
+
+# Multi-unit mode fetches SI responses, and converts them to the other unit systems
+FETCH_UNITS = 'si'
+
+# Units of the forecast fields that depend on the unit system, by field path (section.field,
+#   hourly.data.field for hourly rows); the child streams (forecast_hourly, forecast_daily)
+#   are converted as their section.
+# Reference: https://darksky.net/dev/docs (Response Format, Data Point)
+UNIT_FIELDS = {
+    'hourly.data.precip_intensity': 'precip_intensity',
+    'hourly.data.temperature': 'temperature',
+    'hourly.data.apparent_temperature': 'temperature',
+    'hourly.data.dew_point': 'temperature',
+    'hourly.data.pressure': 'pressure',
+    'hourly.data.wind_speed': 'speed',
+    'hourly.data.wind_gust': 'speed',
+    'hourly.data.visibility': 'distance',
+    'daily.precip_intensity': 'precip_intensity',
+    'daily.precip_intensity_max': 'precip_intensity',
+    'daily.temperature_high': 'temperature',
+    'daily.temperature_low': 'temperature',
+    'daily.apparent_temperature_high': 'temperature',
+    'daily.apparent_temperature_low': 'temperature',
+    'daily.dew_point': 'temperature',
+    'daily.pressure': 'pressure',
+    'daily.wind_speed': 'speed',
+    'daily.visibility': 'distance',
+    'daily.temperature_max': 'temperature',
+    'daily.temperature_min': 'temperature',
+    'daily.apparent_temperature_max': 'temperature',
+    'daily.apparent_temperature_min': 'temperature',
+    'flags.nearest_station': 'distance'
+}
+
+# Conversions from SI, by unit system and unit (see UNIT_FIELDS):
+#   (scale, offset), the converted value is value * scale + offset
+UNIT_CONVERSIONS = {
+    'si': {},
+    'us': {
+        'temperature': (1.8, 32.0), # Celsius to Fahrenheit
+        'precip_intensity': (1 / 25.4, 0.0), # mm/h to in/h
+        'precip_accumulation': (1 / 2.54, 0.0), # cm to in
+        'speed': (3600 / 1609.344, 0.0), # m/s to mph
+        'distance': (1 / 1.609344, 0.0), # km to miles
+        'pressure': (1.0, 0.0) # hPa to millibars
+    },
+    'ca': {
+        'speed': (3.6, 0.0) # m/s to km/h
+    },
+    'uk2': {
+        'speed': (3600 / 1609.344, 0.0), # m/s to mph
+        'distance': (1 / 1.609344, 0.0) # km to miles
+    }
+}
+
+
+# Unit fields of a forecast section (hourly, daily, flags): {field: unit}
+def get_unit_fields(section):
+    prefix = '{}.data.'.format(section) if section == 'hourly' else '{}.'.format(section)
+    return {path[len(prefix):]: unit for path, unit in UNIT_FIELDS.items() \
+        if path.startswith(prefix)}
+
+
+# Convert the unit fields of each row (dict), one field (column) at a time, in place
+# conversions: [(field, scale, offset)]
+def convert_rows(rows, conversions):
+    for field, scale, offset in conversions:
+        for row in rows:
+            value = row.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                row[field] = value * scale + offset
+
+
+# Multi-unit mode (config units, e.g. "us,si"): each API response is fetched once, in SI,
+#   and the records of each stream are emitted in each unit system, with a units field
+#   (added to the catalog by get_catalog, and to the key properties, see sync.write_schema).
+# Picklable, for transform worker processes.
+class UnitConverter(object):
+    def __init__(self, unit_systems):
+        for unit_system in unit_systems:
+            if unit_system not in UNIT_SYSTEMS:
+                raise ValueError('Invalid units: {}, multiple units must be of: {}'.format(
+                    unit_system, ', '.join(UNIT_SYSTEMS)))
+        self.unit_systems = unit_systems
+        # Conversions by unit system and forecast section
+        self.conversions = {}
+        for unit_system in unit_systems:
+            unit_conversions = UNIT_CONVERSIONS[unit_system]
+            self.conversions[unit_system] = {}
+            for section in ['hourly', 'daily', 'flags']:
+                self.conversions[unit_system][section] = [
+                    (field, ) + unit_conversions[unit] \
+                        for field, unit in sorted(get_unit_fields(section).items()) \
+                            if unit in unit_conversions]
+
+    # Multi-unit mode is enabled by a comma-separated list of units in config units;
+    #   None otherwise
+    @classmethod
+    def from_config(cls, config):
+        unit_systems = [unit_system.strip() for unit_system in \
+            str(config.get('units', 'auto')).split(',') if unit_system.strip()]
+        if len(unit_systems) <= 1:
+            return None
+        LOGGER.info('Multi-unit mode: fetching {}, emitting {}'.format(
+            FETCH_UNITS, ', '.join(unit_systems)))
+        return cls(unit_systems)
+
+    # Catalog with a units field (always included) in each stream, for the SCHEMA messages
+    #   and record transformers of multi-unit mode; the schemas themselves have no units field
+    @staticmethod
+    def get_catalog(catalog):
+        catalog_dict = catalog.to_dict()
+        for stream in catalog_dict['streams']:
+            stream['schema']['properties']['units'] = {'type': ['null', 'string']}
+            if not any(entry['breadcrumb'] == ['properties', 'units'] \
+                for entry in stream['metadata']):
+                stream['metadata'].append({
+                    'breadcrumb': ['properties', 'units'],
+                    'metadata': {'inclusion': 'automatic'}})
+        return Catalog.from_dict(catalog_dict)
+
+    # Records of a stream in each unit system, converted from its SI records
+    def convert(self, stream_name, records):
+        data_key = flatten_streams()[stream_name].get('data_key')
+        converted_records = []
+        for unit_system in self.unit_systems:
+            conversions = self.conversions[unit_system]
+            if data_key:
+                rows = [dict(record, units=unit_system) for record in records]
+                convert_rows(rows, conversions[data_key])
+                converted_records.extend(rows)
+                continue
+            for record in records:
+                record = dict(record, units=unit_system)
+                hourly = record.get('hourly')
+                if isinstance(hourly, dict) and hourly.get('data'):
+                    record['hourly'] = dict(hourly, data=[dict(row) for row in hourly['data']])
+                    convert_rows(record['hourly']['data'], conversions['hourly'])
+                for section in ['daily', 'flags']:
+                    if isinstance(record.get(section), dict):
+                        record[section] = dict(record[section])
+                        convert_rows([record[section]], conversions[section])
+                if isinstance(record.get('flags'), dict):
+                    record['flags']['units'] = unit_system
+                converted_records.append(record)
+        return converted_records
@@ -0,0 +1,65 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import singer
+from singer.catalog import Catalog
+from tap_darksky.fetch import ordered_map
+from tap_darksky.transformer import RecordTransformer
+
+LOGGER = singer.get_logger()
+
+# Catalog and compiled transformers of a transform worker process (see init_worker)
+WORKER_STATE = {}
+
+
+def init_worker(catalog_dict):
+    WORKER_STATE['catalog'] = Catalog.from_dict(catalog_dict)
+    WORKER_STATE['transformers'] = {}
+
+
+def get_worker_catalog():
+    return WORKER_STATE['catalog']
+
+
+# RecordTransformer for a stream, compiled once per worker process
+def get_worker_transformer(stream_name):
+    transformers = WORKER_STATE['transformers']
+    if stream_name not in transformers:
+        transformers[stream_name] = RecordTransformer.from_catalog(
+            WORKER_STATE['catalog'], stream_name)
+    return transformers[stream_name]
+
+
+# Pool of transform worker processes (config transform_workers), so decoding, transforming
+#   and serializing records (CPU-bound, GIL-bound in threads) scale across cores.
+# map yields results in task order, with at most workers * 2 tasks in flight; the main
+#   process only writes the serialized output and state, in order.
+# Workers are started with spawn (not fork), as the tap already runs fetch threads.
+class TransformPool(object):
+    def __init__(self, catalog, workers):
+        self.workers = workers
+        self.__executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(catalog.to_dict(),))
+
+    # Transform workers are enabled by config transform_workers > 1; None otherwise
+    @classmethod
+    def from_config(cls, config, catalog):
+        workers = int(config.get('transform_workers', 1))
+        if workers <= 1:
+            return None
+        LOGGER.info('Transform workers: {} processes'.format(workers))
+        return cls(catalog, workers)
+
+    # Yields func(task) for each task, in order
+    def map(self, func, tasks):
+        return ordered_map(
+            self.__executor,
+            func,
+            ((task,) for task in tasks),
+            window=self.workers * 2)
+
+    def close(self):
+        self.__executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,88 @@
+from datetime import datetime, timezone
+import json
+
+import pytest
+from singer import metadata
+from singer.catalog import Catalog
+
+from tap_darksky.discover import discover
+from tap_darksky.transform import decode_json
+
+
+# A Darksky API response (camelCase keys, as the API returns them) for a location-day, in
+#   the America/Denver timezone (UTC-6 in summer time)
+def make_forecast(latitude, longitude, day):
+    base = int(datetime.strptime(day[0:10], '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+    # Local midnight
+    base = base + 6 * 3600
+    return {
+        'latitude': latitude,
+        'longitude': longitude,
+        'timezone': 'America/Denver',
+        'offset': -6,
+        'hourly': {
+            'summary': 'Clear',
+            'icon': 'clear-day',
+            'data': [{'time': base + 3600 * hour, 'temperature': 10.0 + hour,
+                      'precipIntensity': 0.1, 'windSpeed': 3, 'uvIndex': 1} \
+                for hour in range(24)]
+        },
+        'daily': {
+            'data': [{'time': base, 'summary': 'Clear', 'temperatureHigh': 20.5,
+                      'temperatureHighTime': base + 50000, 'temperatureLow': 5.0,
+                      'sunriseTime': base + 20000, 'moonPhase': 0.5}]
+        },
+        'flags': {'sources': ['cmc', 'gfs'], 'nearest-station': 1.8, 'units': 'si'}
+    }
+
+
+# Serves make_forecast responses for the URLs of sync (.../lat,lon,dateT00:00:00?...),
+#   decoded as DarkskyClient.get does
+class FakeClient(object):
+    def __init__(self):
+        self.base_url = 'https://api.darksky.net'
+        self.urls = []
+
+    def get(self, url, decode=True, projection_keys=None, **kwargs): # pylint: disable=unused-argument
+        self.urls.append(url)
+        latitude, longitude, forecast_date = url.split('?')[0].split('/')[-1].split(',')
+        body = json.dumps(make_forecast(float(latitude), float(longitude),
+                                        forecast_date)).encode('utf-8')
+        if not decode:
+            return body
+        return decode_json(body, projection_keys)
+
+
+@pytest.fixture
+def fake_client():
+    return FakeClient()
+
+
+# Stands in for the time module: time() is set by the test, sleep() advances it
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now = self.now + seconds
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
+
+
+# Catalog with the forecast stream selected
+@pytest.fixture
+def forecast_catalog():
+    catalog = discover().to_dict()
+    for stream in catalog['streams']:
+        if stream['stream'] == 'forecast':
+            mdata = metadata.write(metadata.to_map(stream['metadata']), (), 'selected', True)
+            stream['metadata'] = metadata.to_list(mdata)
+    return Catalog.from_dict(catalog)
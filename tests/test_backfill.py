@@ -0,0 +1,65 @@
+import json
+import sys
+
+from tap_darksky import backfill
+
+CONFIG = {
+    'location_list': '40.0,-105.0; 45.5,-122.4',
+    'start_date': '2020-01-01T00:00:00Z',
+    'backfill_end_date': '2020-01-20',
+    'backfill_shard_days': 10,
+    'backfill_shard_count': 2
+}
+
+# Shard 0 completed both ranges of 40,-105; shard 1 is part way through 45.5,-122.4
+SHARD_STATE_0 = {'backfill': {
+    '40,-105:2020-01-01:2020-01-10': {
+        'complete': True, 'bookmarks': {'forecast': {'40,-105': '2020-01-10T00:00:00Z'}}},
+    '40,-105:2020-01-11:2020-01-20': {
+        'complete': True, 'bookmarks': {'forecast': {'40,-105': '2020-01-20T00:00:00Z'}}}
+}}
+SHARD_STATE_1 = {'backfill': {
+    '45.5,-122.4:2020-01-01:2020-01-10': {
+        'bookmarks': {'forecast': {'45.5,-122.4': '2020-01-05T00:00:00Z'}}},
+    '45.5,-122.4:2020-01-11:2020-01-20': {
+        'complete': True, 'bookmarks': {'forecast': {'45.5,-122.4': '2020-01-20T00:00:00Z'}}}
+}}
+
+
+def write_json(path, value):
+    path.write_text(json.dumps(value))
+    return str(path)
+
+
+def test_merge_states():
+    plan = backfill.BackfillPlan.from_config(
+        CONFIG, backfill.LocationRegistry.from_config(CONFIG).get_groups())
+    state = {'bookmarks': {'forecast': {'45.5,-122.4': '2020-01-03T00:00:00Z'}}}
+    merged = plan.merge_states([SHARD_STATE_0, SHARD_STATE_1], state)
+    # An incomplete shard stops its location at its own progress, later shards are ignored
+    assert merged == {'bookmarks': {'forecast': {
+        '40,-105': '2020-01-20T00:00:00Z',
+        '45.5,-122.4': '2020-01-05T00:00:00Z'}}}
+
+
+def test_merge_keeps_later_bookmarks():
+    plan = backfill.BackfillPlan.from_config(
+        CONFIG, backfill.LocationRegistry.from_config(CONFIG).get_groups())
+    state = {'bookmarks': {'forecast': {'45.5,-122.4': '2020-02-01T00:00:00Z'}}}
+    merged = plan.merge_states([SHARD_STATE_1], state)
+    assert merged['bookmarks']['forecast']['45.5,-122.4'] == '2020-02-01T00:00:00Z'
+
+
+# The merge command line of the README: shard state files after the options
+def test_merge_command_line(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', [
+        'tap-darksky-backfill', 'merge',
+        '--config', write_json(tmp_path / 'config.json', CONFIG),
+        '--state', write_json(tmp_path / 'state.json', {}),
+        write_json(tmp_path / 'state_shard_0.json', SHARD_STATE_0),
+        write_json(tmp_path / 'state_shard_1.json', SHARD_STATE_1)])
+    backfill.main()
+    merged = json.loads(capsys.readouterr().out)
+    assert merged['bookmarks']['forecast'] == {
+        '40,-105': '2020-01-20T00:00:00Z',
+        '45.5,-122.4': '2020-01-05T00:00:00Z'}
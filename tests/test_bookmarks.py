@@ -0,0 +1,116 @@
+import copy
+import os
+
+from tap_darksky.bookmarks import BookmarkStore
+from tap_darksky.sync import get_bookmark
+
+
+def test_commit(tmp_path):
+    state = {}
+    store = BookmarkStore(str(tmp_path / 'bookmarks.db'), state)
+    store.set('forecast', 'a', '2019-06-02')
+    store.set('forecast', 'b', '2019-06-01')
+    store.set_value('fetched_days', 'forecast', 'a', {'2019-06-02': 1})
+    # Pending until committed, but read back
+    assert store.get('forecast', 'a') == '2019-06-02'
+    store.commit(state)
+    store.close()
+    assert state['bookmark_store'] == {
+        'checkpoint': 1,
+        'watermarks': {'forecast': '2019-06-01'},
+        'locations': {'forecast': 2}
+    }
+
+    store = BookmarkStore(str(tmp_path / 'bookmarks.db'), state)
+    assert store.get('forecast', 'a') == '2019-06-02'
+    assert store.get('forecast', 'b') == '2019-06-01'
+    assert store.get('forecast', 'c') is None
+    assert store.get_value('fetched_days', 'forecast', 'a') == {'2019-06-02': 1}
+    store.close()
+
+
+def test_rollback(tmp_path):
+    path = str(tmp_path / 'bookmarks.db')
+    state = {}
+    store = BookmarkStore(path, state)
+    store.set('forecast', 'a', '2019-06-01')
+    store.set('forecast', 'b', '2019-06-03')
+    store.set_value('fetched_days', 'forecast', 'a', {'2019-06-01': 1})
+    store.commit(state)
+    store.close()
+    confirmed = copy.deepcopy(state)
+
+    # A run whose STATE messages the target did not confirm
+    store = BookmarkStore(path, state)
+    store.set('forecast', 'a', '2019-06-05')
+    store.set('forecast', 'c', '2019-06-05')
+    store.set_value('fetched_days', 'forecast', 'a', {'2019-06-05': 1})
+    store.commit(state)
+    store.set('forecast', 'a', '2019-06-06')
+    store.commit(state)
+    store.close()
+    assert state['bookmark_store']['checkpoint'] == 3
+
+    # Restarted from the confirmed state: never ahead of it
+    store = BookmarkStore(path, confirmed)
+    assert store.get('forecast', 'a') == '2019-06-01'
+    assert store.get('forecast', 'b') == '2019-06-03'
+    # First written after the confirmed checkpoint: none, syncs from start_date
+    assert store.get('forecast', 'c') is None
+    assert store.get_fallback('forecast') is None
+    assert store.get_value('fetched_days', 'forecast', 'a') == {'2019-06-01': 1}
+    assert store.fallback == {}
+    store.close()
+
+
+def test_lost_table(tmp_path):
+    path = str(tmp_path / 'bookmarks.db')
+    state = {}
+    store = BookmarkStore(path, state)
+    store.set('forecast', 'a', '2019-06-02')
+    store.set('forecast', 'b', '2019-06-04')
+    store.commit(state)
+    store.close()
+    os.remove(path)
+
+    # Locations without a bookmark sync from the stream watermark, not start_date
+    store = BookmarkStore(path, state)
+    assert store.get('forecast', 'a') is None
+    assert store.get_fallback('forecast') == '2019-06-02'
+    store.set('forecast', 'a', '2019-06-05')
+    store.commit(state)
+    store.close()
+    # Until the lost bookmarks are written again, also after a restart
+    assert state['bookmark_store']['fallback'] == {'forecast': '2019-06-02'}
+    assert state['bookmark_store']['locations'] == {'forecast': 2}
+
+    store = BookmarkStore(path, state)
+    assert store.get_fallback('forecast') == '2019-06-02'
+    store.set('forecast', 'b', '2019-06-05')
+    store.commit(state)
+    assert 'fallback' not in state['bookmark_store']
+    assert state['bookmark_store']['watermarks'] == {'forecast': '2019-06-05'}
+    store.close()
+
+    # A location added after the recovery syncs from start_date
+    store = BookmarkStore(path, state)
+    assert store.get('forecast', 'c') is None
+    assert store.get_fallback('forecast') is None
+    store.close()
+
+
+def test_fallback_after_inline_bookmarks(tmp_path):
+    path = str(tmp_path / 'bookmarks.db')
+    state = {}
+    store = BookmarkStore(path, state)
+    store.set('forecast', 'a', '2019-06-02')
+    store.set('forecast', 'b', '2019-06-04')
+    store.commit(state)
+    store.close()
+    os.remove(path)
+
+    state['bookmarks'] = {'forecast': {'c': '2019-06-03'}}
+    store = BookmarkStore(path, state)
+    assert get_bookmark(state, 'forecast', 'c', None, store) == '2019-06-03'
+    assert get_bookmark(state, 'forecast', 'a', None, store) == '2019-06-02'
+    store.close()
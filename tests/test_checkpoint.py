@@ -0,0 +1,144 @@
+from datetime import date, timedelta
+import io
+import json
+
+import pytest
+from singer import metadata
+from singer.catalog import Catalog
+from singer.utils import strptime_to_utc
+
+from tap_darksky.checkpoint import StateCheckpointer
+from tap_darksky.discover import discover
+from tap_darksky.output import MessageWriter
+from tap_darksky.sync import sync
+
+
+class StateWriter(object):
+    def __init__(self):
+        self.states = []
+
+    def write_state(self, state):
+        self.states.append(json.loads(json.dumps(state)))
+
+
+def update(checkpointer, state, day, records=1):
+    checkpointer.records_written(records)
+    state['bookmarks'] = {'forecast': {'40,-105': day}}
+    checkpointer.update(state)
+
+
+def test_every_update():
+    writer = StateWriter()
+    checkpointer = StateCheckpointer(writer)
+    state = {}
+    for day in ['2020-01-01', '2020-01-02']:
+        update(checkpointer, state, day)
+    assert [state['bookmarks']['forecast']['40,-105'] for state in writer.states] == [
+        '2020-01-01', '2020-01-02']
+    # Unchanged state is not written again
+    checkpointer.checkpoint(state)
+    assert len(writer.states) == 2
+
+
+def test_records():
+    writer = StateWriter()
+    checkpointer = StateCheckpointer(writer, policy='records', interval=5)
+    state = {}
+    for day in range(1, 8):
+        update(checkpointer, state, '2020-01-0{}'.format(day), records=2)
+    # Written once 5 records were written (after 3 updates, then 3 more)
+    assert [state['bookmarks']['forecast']['40,-105'] for state in writer.states] == [
+        '2020-01-03', '2020-01-06']
+    checkpointer.checkpoint(state)
+    assert writer.states[-1]['bookmarks']['forecast']['40,-105'] == '2020-01-07'
+
+
+def test_seconds(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('tap_darksky.checkpoint.time.time', lambda: now[0])
+    writer = StateWriter()
+    checkpointer = StateCheckpointer(writer, policy='seconds', interval=60)
+    state = {}
+    for day in range(1, 5):
+        now[0] = now[0] + 25
+        update(checkpointer, state, '2020-01-0{}'.format(day))
+    # Written at most once per 60 seconds
+    assert [state['bookmarks']['forecast']['40,-105'] for state in writer.states] == [
+        '2020-01-03']
+
+
+def test_stream_end():
+    writer = StateWriter()
+    checkpointer = StateCheckpointer(writer, policy='stream_end')
+    state = {}
+    for day in range(1, 5):
+        update(checkpointer, state, '2020-01-0{}'.format(day))
+    assert writer.states == []
+    checkpointer.checkpoint(state)
+    assert writer.states[0]['bookmarks']['forecast']['40,-105'] == '2020-01-04'
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        StateCheckpointer(StateWriter(), policy='never')
+
+
+def get_catalog(stream_names):
+    catalog = discover().to_dict()
+    for stream in catalog['streams']:
+        if stream['stream'] in stream_names:
+            mdata = metadata.to_map(stream['metadata'])
+            mdata = metadata.write(mdata, (), 'selected', True)
+            stream['metadata'] = metadata.to_list(mdata)
+    return Catalog.from_dict(catalog)
+
+
+# Every STATE message is covered by the records written before it: no bookmark is later than
+#   the last record written for its stream and location
+@pytest.mark.parametrize('extra_config', [
+    {},
+    {'state_checkpoint_policy': 'records', 'state_checkpoint_interval': 30},
+    {'state_checkpoint_policy': 'stream_end'},
+    {'max_workers': 3},
+    {'max_workers': 3, 'pipeline_queue_size': 0},
+    {'location_precision': 2, 'state_checkpoint_policy': 'records',
+     'state_checkpoint_interval': 50, 'pipeline_queue_size': 2}
+])
+def test_state_never_ahead_of_records(fake_client, extra_config):
+    config = {
+        'secret_key': 'key',
+        'language': 'en',
+        'units': 'si',
+        'user_agent': 'test',
+        'location_list': '40.0,-105.0; 45.5,-122.4',
+        'start_date': '{}T00:00:00Z'.format(date.today() - timedelta(days=4))
+    }
+    config.update(extra_config)
+    output = io.StringIO()
+    sync(client=fake_client,
+         config=config,
+         catalog=get_catalog(['forecast', 'forecast_hourly']),
+         state={},
+         writer=MessageWriter(stream=output))
+
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    written = {}
+    states = 0
+    for message in messages:
+        if message['type'] == 'RECORD':
+            record = message['record']
+            key = (message['stream'], '{:g},{:g}'.format(record['latitude'], record['longitude']))
+            written[key] = max(written.get(key, ''), record['forecast_date'])
+        elif message['type'] == 'STATE':
+            states = states + 1
+            for stream, bookmarks in message['value'].get('bookmarks', {}).items():
+                for location, bookmark in bookmarks.items():
+                    assert strptime_to_utc(bookmark) <= \
+                        strptime_to_utc(written[(stream, location)])
+    assert states
+    assert len(fake_client.urls) == 10
+    # The final state covers all records
+    assert {(stream, location): strptime_to_utc(bookmark) for stream, bookmarks \
+        in messages[-1]['value']['bookmarks'].items() \
+            for location, bookmark in bookmarks.items()} == {
+                key: strptime_to_utc(value) for key, value in written.items()}
@@ -0,0 +1,10 @@
+import pytest
+
+from tap_darksky import check_location_config
+
+
+def test_location_list_or_file():
+    check_location_config({'location_list': '40.0,-105.0'})
+    check_location_config({'location_file': 'locations.csv'})
+    with pytest.raises(Exception, match='location_list or location_file'):
+        check_location_config({'location_list': ''})
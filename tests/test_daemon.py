@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+from tap_darksky.daemon import DaemonOutput
+
+
+def test_output_file_per_sync(tmp_path):
+    output = DaemonOutput(path=str(tmp_path), keep=3)
+    for number in range(5):
+        with output.open() as stream:
+            stream.write('{}\n'.format(number))
+    names = sorted(os.listdir(str(tmp_path)))
+    # Syncs in the same second get their own files; the newest keep files are kept
+    assert len(names) == 3
+    assert [(tmp_path / name).read_text() for name in names] == ['2\n', '3\n', '4\n']
+
+
+def test_failed_sync_output_not_published(tmp_path):
+    output = DaemonOutput(path=str(tmp_path))
+    with output.open() as stream:
+        stream.write('complete\n')
+    with pytest.raises(RuntimeError):
+        with output.open() as stream:
+            stream.write('partial\n')
+            raise RuntimeError('sync failed')
+    names = os.listdir(str(tmp_path))
+    assert len(names) == 1
+    assert (tmp_path / names[0]).read_text() == 'complete\n'
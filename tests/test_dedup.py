@@ -0,0 +1,42 @@
+from tap_darksky.bookmarks import BookmarkStore
+from tap_darksky.dedup import RecordDedup
+from tap_darksky.locations import LocationRegistry
+
+LOCATION_GROUP = LocationRegistry.from_config({'location_list': '40.0,-105.0'}).get_groups()[0]
+RECORDS = [{'forecast_date': '2020-01-02T00:00:00Z', 'temperature': 1.0}]
+
+
+def write_records(record_dedup, state, records, bookmark_store=None):
+    record_hashes = record_dedup.for_group(state, ['forecast'], LOCATION_GROUP, bookmark_store)
+    changed = record_hashes.is_changed('forecast', '40,-105', 'forecast_date', records)
+    record_dedup.update(state, record_hashes.pop_updates(), bookmark_store)
+    return changed
+
+
+def test_unchanged_records_in_state():
+    record_dedup = RecordDedup()
+    state = {}
+    assert write_records(record_dedup, state, RECORDS)
+    assert not write_records(record_dedup, state, RECORDS)
+    assert write_records(record_dedup, state, [dict(RECORDS[0], temperature=2.0)])
+    assert list(state['record_hashes']['forecast']['40,-105']) == ['2020-01-02']
+    record_dedup.prune(state, 'forecast', '40,-105', '2020-01-03T00:00:00Z')
+    assert state['record_hashes']['forecast']['40,-105'] == {}
+
+
+def test_unchanged_records_in_bookmark_store(tmp_path):
+    record_dedup = RecordDedup()
+    state = {'record_hashes': {'forecast': {'40,-105': {'2020-01-01': '0000000000000000'}}}}
+    bookmark_store = BookmarkStore(str(tmp_path / 'bookmarks.db'), state)
+    assert write_records(record_dedup, state, RECORDS, bookmark_store)
+    # Moved from the state to the store
+    assert 'record_hashes' not in state
+    bookmark_store.commit(state)
+    bookmark_store.close()
+
+    bookmark_store = BookmarkStore(str(tmp_path / 'bookmarks.db'), state)
+    assert not write_records(record_dedup, state, RECORDS, bookmark_store)
+    record_dedup.prune(state, 'forecast', '40,-105', '2020-01-02T00:00:00Z', bookmark_store)
+    assert list(bookmark_store.get_value('record_hashes', 'forecast', '40,-105')) == [
+        '2020-01-02']
+    bookmark_store.close()
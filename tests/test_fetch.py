@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+
+from tap_darksky.fetch import grouped_unordered_map, ordered_map
+
+
+def delayed(group, delay, value): # pylint: disable=unused-argument
+    time.sleep(delay)
+    return value
+
+
+def test_ordered_map():
+    tasks = [('a', 0.3, 1), ('a', 0.0, 2), ('b', 0.1, 3), ('b', 0.0, 4), ('c', 0.0, 5)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        # In task order, whatever order the calls complete in
+        assert list(ordered_map(executor, delayed, tasks, window=4)) == [1, 2, 3, 4, 5]
+
+
+def test_ordered_map_window():
+    submitted = []
+
+    def record(value):
+        submitted.append(value)
+        return value
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = ordered_map(executor, record, ((value, ) for value in range(100)), window=3)
+        assert next(results) == 0
+        # Lazy: at most window calls are submitted ahead of the consumer
+        assert len(submitted) <= 4
+        results.close()
+
+
+def test_ordered_map_error():
+    def fail(value):
+        if value == 2:
+            raise ValueError(value)
+        return value
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = ordered_map(executor, fail, [(0, ), (1, ), (2, ), (3, )], window=2)
+        assert [next(results), next(results)] == [0, 1]
+        # Raised when its result is reached
+        with pytest.raises(ValueError):
+            next(results)
+
+
+def test_grouped_unordered_map():
+    tasks = [('a', 0.3, 'a1'), ('a', 0.0, 'a2'), ('b', 0.0, 'b1'), ('b', 0.1, 'b2'),
+             ('c', 0.0, 'c1')]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(grouped_unordered_map(executor, delayed, tasks,
+                                             group=lambda task: task[0], window=4))
+    # In completion order within a group; groups in task order, though b1 completes first
+    assert results == ['a2', 'a1', 'b1', 'b2', 'c1']
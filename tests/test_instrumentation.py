@@ -0,0 +1,44 @@
+from tap_darksky.instrumentation import PhaseTimer
+
+
+def time_locations(phase_timer, count):
+    for index in range(count):
+        with phase_timer.context('forecast', '40,-{}'.format(index)):
+            with phase_timer.phase('request'):
+                pass
+            with phase_timer.phase('decode'):
+                pass
+
+
+def test_totals_by_stream(monkeypatch):
+    logged = []
+    monkeypatch.setattr('tap_darksky.instrumentation.metrics.log',
+                        lambda logger, point: logged.append(point))
+    phase_timer = PhaseTimer.from_config({})
+    time_locations(phase_timer, 1000)
+    # Not per location, by default
+    assert sorted(phase_timer.totals) == [('decode', 'forecast', None),
+                                          ('request', 'forecast', None)]
+    assert phase_timer.totals[('request', 'forecast', None)][0] == 1000
+    phase_timer.report()
+    assert len(logged) == 2
+    assert 'location' not in logged[0].tags
+
+
+def test_totals_by_location(monkeypatch):
+    logged = []
+    monkeypatch.setattr('tap_darksky.instrumentation.metrics.log',
+                        lambda logger, point: logged.append(point))
+    phase_timer = PhaseTimer.from_config({'phase_metrics_by_location': 'true'})
+    time_locations(phase_timer, 3)
+    assert len(phase_timer.totals) == 6
+    assert phase_timer.get_phase_totals()['request'][0] == 3
+    phase_timer.report()
+    assert sorted(point.tags['location'] for point in logged) == \
+        ['40,-0', '40,-0', '40,-1', '40,-1', '40,-2', '40,-2']
+
+
+def test_disabled():
+    phase_timer = PhaseTimer.from_config({'phase_metrics': 'false'})
+    time_locations(phase_timer, 3)
+    assert phase_timer.totals == {}
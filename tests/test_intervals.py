@@ -0,0 +1,77 @@
+import pytest
+
+from tap_darksky.bookmarks import BookmarkStore
+from tap_darksky.intervals import DayIntervals, GapTracker
+from tap_darksky.locations import LocationRegistry
+
+
+def test_add_merges_adjacent_and_overlapping():
+    intervals = DayIntervals()
+    for day in ['2020-01-03', '2020-01-01', '2020-01-02', '2020-01-10']:
+        intervals.add(day)
+    assert intervals.to_list() == [['2020-01-01', '2020-01-03'], ['2020-01-10', '2020-01-10']]
+    intervals.add_range('2020-01-04', '2020-01-09')
+    assert intervals.to_list() == [['2020-01-01', '2020-01-10']]
+
+
+def test_add_range_spanning_intervals():
+    intervals = DayIntervals([['2020-01-01', '2020-01-02'], ['2020-01-05', '2020-01-06'],
+                              ['2020-01-09', '2020-01-09'], ['2020-02-01', '2020-02-02']])
+    intervals.add_range('2020-01-02', '2020-01-10')
+    assert intervals.to_list() == [['2020-01-01', '2020-01-10'], ['2020-02-01', '2020-02-02']]
+    # An empty range adds nothing
+    intervals.add_range('2020-03-02', '2020-03-01')
+    assert intervals.to_list() == [['2020-01-01', '2020-01-10'], ['2020-02-01', '2020-02-02']]
+
+
+def test_contains_and_missing():
+    intervals = DayIntervals([['2020-01-02', '2020-01-03'], ['2020-01-05', '2020-01-05']])
+    assert '2020-01-02T00:00:00Z' in intervals
+    assert '2020-01-04' not in intervals
+    assert '2020-01-01' not in intervals
+    days = ['2020-01-0{}'.format(day) for day in range(1, 7)]
+    assert intervals.get_missing(days) == ['2020-01-01', '2020-01-04', '2020-01-06']
+
+
+@pytest.fixture
+def location_group():
+    return LocationRegistry.from_config({'location_list': '40.0,-105.0'}).get_groups()[0]
+
+
+def test_gap_tracker_from_bookmark(location_group):
+    date_list = ['2020-01-0{}'.format(day) for day in range(1, 6)]
+    bookmarks = {('forecast', '40,-105'): '2020-01-03T00:00:00Z'}
+    # Without fetched days, the days before the bookmark count as fetched
+    assert GapTracker().get_date_list({}, ['forecast'], location_group, bookmarks,
+                                      date_list) == ['2020-01-03', '2020-01-04', '2020-01-05']
+
+
+def test_gap_tracker_state(location_group):
+    state = {}
+    gap_tracker = GapTracker()
+    for day in ['2020-01-01', '2020-01-02', '2020-01-04']:
+        gap_tracker.add_day(state, ['forecast'], location_group, {}, day)
+    assert state['fetched_days'] == {'forecast': {'40,-105': [['2020-01-01', '2020-01-02'],
+                                                              ['2020-01-04', '2020-01-04']]}}
+    date_list = ['2020-01-0{}'.format(day) for day in range(1, 6)]
+    assert gap_tracker.get_date_list(state, ['forecast'], location_group, {},
+                                     date_list) == ['2020-01-03', '2020-01-05']
+
+
+def test_gap_tracker_bookmark_store(tmp_path, location_group):
+    state = {'fetched_days': {'forecast': {'40,-105': [['2020-01-01', '2020-01-02']]}}}
+    bookmark_store = BookmarkStore(str(tmp_path / 'bookmarks.db'), state)
+    gap_tracker = GapTracker()
+    gap_tracker.add_day(state, ['forecast'], location_group, {}, '2020-01-04', bookmark_store)
+    # Moved from the state to the store
+    assert 'fetched_days' not in state
+    assert bookmark_store.get_value('fetched_days', 'forecast', '40,-105') == [
+        ['2020-01-01', '2020-01-02'], ['2020-01-04', '2020-01-04']]
+    bookmark_store.commit(state)
+    bookmark_store.close()
+
+    bookmark_store = BookmarkStore(str(tmp_path / 'bookmarks.db'), state)
+    date_list = ['2020-01-0{}'.format(day) for day in range(1, 6)]
+    assert gap_tracker.get_date_list(state, ['forecast'], location_group, {}, date_list,
+                                     bookmark_store) == ['2020-01-03', '2020-01-05']
+    bookmark_store.close()
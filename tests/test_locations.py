@@ -0,0 +1,23 @@
+from tap_darksky.locations import LocationRegistry
+from tap_darksky.sync import migrate_location_bookmarks
+
+
+def test_migrate_location_bookmarks():
+    location_groups = LocationRegistry.from_config({
+        'location_list': '40.0,-105.0; 40.00,-105.00; 45.5,-122.4; 38.840544,-105.0444233',
+        'location_precision': 4}).get_groups()
+    state = {'bookmarks': {'forecast': {
+        '40.0,-105.0': '2020-01-05T00:00:00Z',
+        '40.00,-105.00': '2020-01-03T00:00:00Z',
+        '45.5,-122.4': '2020-01-04T00:00:00Z',
+        '38.840544,-105.0444233': '2020-01-01T00:00:00Z',
+        '38.8405,-105.0444': '2020-01-02T00:00:00Z'
+    }}}
+    migrate_location_bookmarks(state, location_groups)
+    # Aliases are removed: the earliest alias bookmark moves to the normalized key, unless it
+    #   already has one
+    assert state == {'bookmarks': {'forecast': {
+        '40,-105': '2020-01-03T00:00:00Z',
+        '45.5,-122.4': '2020-01-04T00:00:00Z',
+        '38.8405,-105.0444': '2020-01-02T00:00:00Z'
+    }}}
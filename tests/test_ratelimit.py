@@ -0,0 +1,109 @@
+import multiprocessing
+import threading
+
+import pytest
+import requests
+
+from tap_darksky.client import DarkskyClient, DarkskyQuotaExceededError, Server429Error
+from tap_darksky.ratelimit import RateLimiter
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr('tap_darksky.ratelimit.time', fake_clock)
+    return fake_clock
+
+
+def test_token_bucket(clock):
+    limiter = RateLimiter(rate=10, period=1)
+    # A burst of rate calls, then one call per period / rate
+    assert [limiter.try_acquire() for _ in range(10)] == [0] * 10
+    assert limiter.try_acquire() == pytest.approx(0.1)
+    assert limiter.acquire()
+    assert clock.sleeps == [pytest.approx(0.1)]
+    clock.now = clock.now + 0.35
+    assert [limiter.try_acquire() for _ in range(4)] == [0, 0, 0, pytest.approx(0.05)]
+
+
+def test_threads(clock):
+    limiter = RateLimiter(rate=10, period=1)
+    granted = []
+
+    def take():
+        for _ in range(10):
+            if limiter.try_acquire() == 0:
+                granted.append(1)
+
+    threads = [threading.Thread(target=take) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # One bucket for all threads
+    assert len(granted) == 10
+    clock.now = clock.now + 0.5
+    take()
+    assert len(granted) == 15
+
+
+def test_shared_file(clock, tmp_path):
+    path = str(tmp_path / 'ratelimit.json')
+    limiter = RateLimiter(rate=10, period=1, path=path)
+    other = RateLimiter(rate=10, period=1, path=path)
+    assert [limiter.try_acquire() for _ in range(6)] == [0] * 6
+    assert [other.try_acquire() for _ in range(4)] == [0] * 4
+    assert limiter.try_acquire() > 0
+    # A pause stops every limiter sharing the file
+    other.pause(30)
+    clock.now = clock.now + 10
+    assert limiter.try_acquire() == pytest.approx(20)
+
+
+def take_tokens(path, granted):
+    limiter = RateLimiter(rate=10, period=3600, path=path)
+    for _ in range(10):
+        if limiter.try_acquire() == 0:
+            with granted.get_lock():
+                granted.value = granted.value + 1
+
+
+def test_processes(tmp_path):
+    path = str(tmp_path / 'ratelimit.json')
+    context = multiprocessing.get_context('fork')
+    granted = context.Value('i', 0)
+    processes = [context.Process(target=take_tokens, args=(path, granted)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    # One bucket for all processes (locked file)
+    assert granted.value == 10
+
+
+def test_call_limit(clock, monkeypatch): # pylint: disable=unused-argument
+    limiter = RateLimiter(rate=10, period=1, call_limit=3)
+    assert [limiter.acquire() for _ in range(4)] == [True, True, True, False]
+    # Reset the next (UTC) day
+    monkeypatch.setattr('tap_darksky.ratelimit.utc_today', lambda: '2099-01-01')
+    assert limiter.acquire()
+    # Calls reported by the API count towards the limit
+    limiter.update_from_headers({'X-Forecast-API-Calls': '3'})
+    assert not limiter.acquire()
+
+    client = DarkskyClient('key', rate_limiter=limiter)
+    with pytest.raises(DarkskyQuotaExceededError):
+        client.acquire_rate_limit()
+
+
+def test_retry_after(clock):
+    limiter = RateLimiter(rate=10, period=1)
+    client = DarkskyClient('key', rate_limiter=limiter)
+    response = requests.Response()
+    response.status_code = 429
+    response.headers['Retry-After'] = '7'
+    with pytest.raises(Server429Error):
+        client.check_rate_limit(response)
+    # Every call waits for Retry-After, then for tokens
+    assert limiter.try_acquire() == pytest.approx(7)
+    assert limiter.acquire()
+    assert clock.now == pytest.approx(1007.1)
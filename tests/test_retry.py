@@ -0,0 +1,204 @@
+from datetime import date, timedelta
+import io
+import threading
+
+import pytest
+import requests
+
+from tap_darksky.backfill import Shard
+from tap_darksky.client import DarkskyClient, DarkskyNotFoundError, ERROR_RETRY_POLICIES, \
+    Server5xxError
+from tap_darksky.locations import LocationGroup
+from tap_darksky.output import MessageWriter
+from tap_darksky.retry import call_with_retries, CircuitBreaker, DeferredRetryQueue, \
+    is_deferrable
+from tap_darksky.sync import sync
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr('tap_darksky.retry.time', fake_clock)
+    monkeypatch.setattr('tap_darksky.retry.backoff.full_jitter', lambda value: value)
+    return fake_clock
+
+
+class Failing(object):
+    def __init__(self, error, failures=None):
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls = self.calls + 1
+        if self.failures is None or self.calls <= self.failures:
+            raise self.error
+        return 'ok'
+
+
+def test_retries(clock):
+    func = Failing(Server5xxError(), failures=2)
+    assert call_with_retries(func, ERROR_RETRY_POLICIES) == 'ok'
+    # Exponential backoff, inline
+    assert clock.sleeps == [1, 2]
+
+
+def test_retries_used_up_deferred(clock):
+    shard = Shard(LocationGroup('40,-105'), '2019-06-01')
+    queue = DeferredRetryQueue(tries=2, delay=30)
+    func = Failing(Server5xxError())
+    attempts = []
+    error = None
+    while True:
+        try:
+            call_with_retries(func, ERROR_RETRY_POLICIES)
+        except Exception as err: # pylint: disable=broad-except
+            assert is_deferrable(ERROR_RETRY_POLICIES, err)
+            attempts.append(func.calls)
+            try:
+                queue.defer(shard, 'url', err)
+            except Server5xxError as final_error:
+                error = final_error
+                break
+        assert list(queue.pop_ready(wait=True)) == [(shard, 'url')]
+    # 3 tries inline, then 2 deferred retries of 3 tries, then the last error is raised
+    assert attempts == [3, 6, 9]
+    assert isinstance(error, Server5xxError)
+    assert queue.deferred == 2
+    assert clock.sleeps == [1, 2, 30, 1, 2, 60, 1, 2]
+
+
+def test_deferred_order(clock):
+    queue = DeferredRetryQueue(tries=3, delay=10)
+    shards = [Shard(LocationGroup(key), '2019-06-01') for key in ['a', 'b']]
+    queue.defer(shards[0], 'a', Server5xxError())
+    queue.defer(shards[1], 'b', Server5xxError())
+    # Not due yet
+    assert list(queue.pop_ready()) == []
+    clock.now = clock.now + 10
+    assert [url for _, url in queue.pop_ready()] == ['a', 'b']
+    assert len(queue) == 0
+
+
+def test_not_retried(clock):
+    func = Failing(DarkskyNotFoundError('RESPONSE: not found'))
+    pauses = []
+    breaker = CircuitBreaker(lambda seconds, reason: pauses.append(seconds), threshold=1)
+    with pytest.raises(DarkskyNotFoundError):
+        call_with_retries(func, ERROR_RETRY_POLICIES, breaker)
+    assert func.calls == 1
+    assert clock.sleeps == []
+    assert not is_deferrable(ERROR_RETRY_POLICIES, DarkskyNotFoundError())
+    # Client errors do not trip the breaker
+    assert pauses == []
+
+
+class FakeSession(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.requests = 0
+
+    def request(self, method, url, **kwargs): # pylint: disable=unused-argument
+        self.requests = self.requests + 1
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.url = url
+        response._content = b'{"code": 404, "error": "Not found"}' # pylint: disable=protected-access
+        return response
+
+    def close(self):
+        pass
+
+
+def test_client_4xx_not_retried(clock):
+    client = DarkskyClient('key')
+    session = FakeSession(404)
+    client._DarkskyClient__session = session # pylint: disable=protected-access
+    with pytest.raises(DarkskyNotFoundError):
+        client.get('https://api.darksky.net/forecast/<secret_key>/40,-105,2019-06-01T00:00:00')
+    assert session.requests == 1
+    assert clock.sleeps == []
+
+
+def test_breaker(clock): # pylint: disable=unused-argument
+    pauses = []
+    breaker = CircuitBreaker(lambda seconds, reason: pauses.append(seconds), threshold=2,
+                             cooldown=10, max_cooldown=25)
+    for _ in range(2):
+        breaker.before_request()
+        breaker.after_request(failed=True)
+    # Opened after threshold consecutive failures
+    assert pauses == [10]
+    # Half-open: one probe; failed, it opens again for twice as long (up to max_cooldown)
+    breaker.before_request()
+    breaker.after_request(failed=True)
+    assert pauses == [10, 20]
+    breaker.before_request()
+    breaker.after_request(failed=True)
+    assert pauses == [10, 20, 25]
+    # A successful probe closes it, and resets the cooldown
+    breaker.before_request()
+    breaker.after_request(failed=False)
+    breaker.before_request()
+    breaker.after_request(failed=True)
+    assert pauses == [10, 20, 25]
+    breaker.before_request()
+    breaker.after_request(failed=True)
+    assert pauses == [10, 20, 25, 10]
+    assert breaker.trips == 4
+
+
+def test_breaker_probe(clock): # pylint: disable=unused-argument
+    breaker = CircuitBreaker(lambda seconds, reason: None, threshold=1, cooldown=10)
+    breaker.before_request()
+    breaker.after_request(failed=True)
+    # This request probes the API; another waits for its result
+    breaker.before_request()
+    waited = threading.Event()
+
+    def other_request():
+        breaker.before_request()
+        waited.set()
+        breaker.after_request(failed=False)
+
+    thread = threading.Thread(target=other_request)
+    thread.start()
+    assert not waited.wait(0.1)
+    breaker.after_request(failed=False)
+    thread.join(1)
+    assert waited.is_set()
+
+
+def test_sync_deferred_retry(fake_client, forecast_catalog, clock, monkeypatch):
+    get = fake_client.get
+    failures = []
+
+    # A location fails twice (with its inline tries used up), then succeeds, deferred
+    def flaky_get(url, **kwargs):
+        if '/40,-105,' in url and len(failures) < 2:
+            failures.append(url)
+            raise Server5xxError()
+        return get(url, **kwargs)
+
+    monkeypatch.setattr(fake_client, 'get', flaky_get)
+    config = {
+        'secret_key': 'key',
+        'user_agent': 'test',
+        'location_list': '40,-105; 45.5,-122.4',
+        'start_date': '{}T00:00:00Z'.format(date.today() - timedelta(days=1)),
+        'retry_deferred_tries': 2,
+        'retry_deferred_delay': 5
+    }
+    state = {}
+    sync(client=fake_client, config=config, catalog=forecast_catalog, state=state,
+         writer=MessageWriter(stream=io.StringIO()))
+    assert len(failures) == 2
+    assert clock.sleeps == [5, 10]
+    assert set(state['bookmarks']['forecast']) == {'40,-105', '45.5,-122.4'}
+
+    # Once the deferred retries are used up, the sync fails with the last error
+    failures.clear()
+    config['retry_deferred_tries'] = 1
+    with pytest.raises(Server5xxError):
+        sync(client=fake_client, config=config, catalog=forecast_catalog, state={},
+             writer=MessageWriter(stream=io.StringIO()))
+    assert len(failures) == 2
@@ -0,0 +1,44 @@
+from datetime import date, timedelta
+import io
+
+import pytest
+
+from tap_darksky.bookmarks import BookmarkStore
+from tap_darksky.output import MessageWriter
+from tap_darksky.sync import sync
+
+
+class FakeTransformPool(object):
+    def __init__(self):
+        self.closed = False
+
+    def map(self, function, *args, **kwargs): # pylint: disable=unused-argument
+        raise ValueError('Transform failed')
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_sync_closes(fake_client, forecast_catalog, monkeypatch, tmp_path):
+    transform_pool = FakeTransformPool()
+    monkeypatch.setattr('tap_darksky.sync.TransformPool.from_config',
+                        lambda config, catalog: transform_pool)
+    closed = []
+    close = BookmarkStore.close
+    monkeypatch.setattr(BookmarkStore, 'close', lambda store: closed.append(close(store)))
+    config = {
+        'secret_key': 'key',
+        'user_agent': 'test',
+        'location_list': '40.0,-105.0',
+        'start_date': '{}T00:00:00Z'.format(date.today() - timedelta(days=2)),
+        'bookmark_store_path': str(tmp_path / 'bookmarks.db')
+    }
+    with pytest.raises(ValueError):
+        sync(client=fake_client,
+             config=config,
+             catalog=forecast_catalog,
+             state={},
+             writer=MessageWriter(stream=io.StringIO()))
+    # Worker processes and the store file are not left open
+    assert transform_pool.closed
+    assert len(closed) == 1
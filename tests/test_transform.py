@@ -0,0 +1,33 @@
+import io
+import json
+
+import pytest
+
+from tap_darksky.transform import convert_json, decode_json
+from conftest import make_forecast
+
+BODY = json.dumps(make_forecast(40.0, -105.0, '2020-01-02')).encode('utf-8')
+
+
+def test_decode_converts_keys():
+    decoded = decode_json(BODY)
+    assert decoded == convert_json(json.loads(BODY))
+    assert decoded['daily']['data'][0]['temperature_high'] == 20.5
+
+
+def test_decode_incrementally():
+    pytest.importorskip('ijson')
+    assert decode_json(io.BytesIO(BODY)) == convert_json(json.loads(BODY))
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_decode_projection(streaming):
+    if streaming:
+        pytest.importorskip('ijson')
+    projection_keys = {'latitude', 'longitude', 'daily', 'data', 'time', 'temperature_high'}
+    body = io.BytesIO(BODY) if streaming else BODY
+    assert decode_json(body, projection_keys) == {
+        'latitude': 40.0,
+        'longitude': -105.0,
+        'daily': {'data': [{'time': 1577944800, 'temperature_high': 20.5}]}
+    }
@@ -0,0 +1,70 @@
+import copy
+import json
+
+import pytest
+from singer import metadata, Transformer, UNIX_SECONDS_INTEGER_DATETIME_PARSING
+from singer.transform import SchemaMismatch
+
+from tap_darksky.discover import discover
+from tap_darksky.sync import transform_stream_records
+from tap_darksky.transform import decode_json
+from tap_darksky.transformer import RecordTransformer
+from conftest import make_forecast
+
+STREAM_NAMES = ['forecast', 'forecast_hourly', 'forecast_daily']
+
+
+def get_stream(stream_name, deselected=()):
+    stream = discover().get_stream(stream_name)
+    mdata = metadata.to_map(stream.metadata)
+    for field_name in deselected:
+        mdata = metadata.write(mdata, ('properties', field_name), 'selected', False)
+    return stream.schema.to_dict(), mdata
+
+
+def singer_transform(record, schema, mdata):
+    with Transformer(integer_datetime_fmt=UNIX_SECONDS_INTEGER_DATETIME_PARSING) as transformer:
+        return transformer.transform(copy.deepcopy(record), schema, mdata)
+
+
+def get_records():
+    data = decode_json(json.dumps(make_forecast(40.0, -105.0, '2020-01-02')).encode('utf-8'))
+    return transform_stream_records(STREAM_NAMES, data)
+
+
+@pytest.mark.parametrize('stream_name', STREAM_NAMES)
+def test_same_as_singer_transformer(stream_name):
+    schema, mdata = get_stream(stream_name)
+    transformer = RecordTransformer(schema, mdata)
+    records = get_records()[stream_name]
+    assert records
+    for record in records:
+        assert transformer.transform(copy.deepcopy(record)) == \
+            singer_transform(record, schema, mdata)
+
+
+def test_deselected_fields():
+    schema, mdata = get_stream('forecast_daily', deselected=['summary', 'temperature_high'])
+    transformer = RecordTransformer(schema, mdata)
+    record = get_records()['forecast_daily'][0]
+    transformed = transformer.transform(copy.deepcopy(record))
+    assert 'summary' not in transformed and 'temperature_high' not in transformed
+    assert transformed == singer_transform(record, schema, mdata)
+
+
+def test_coercion():
+    schema, mdata = get_stream('forecast_daily')
+    transformer = RecordTransformer(schema, mdata)
+    record = {'latitude': '40.5', 'temperature_high': '1,020.5', 'uv_index': '3',
+              'summary': 12, 'icon': '', 'time': 1577944800, 'unknown_field': 1}
+    transformed = transformer.transform(copy.deepcopy(record))
+    assert transformed == singer_transform(record, schema, mdata)
+    assert transformed['temperature_high'] == 1020.5
+    assert transformed['time'] == '2020-01-02T06:00:00.000000Z'
+    assert 'unknown_field' not in transformed
+
+
+def test_mismatch_raises():
+    schema, mdata = get_stream('forecast_daily')
+    with pytest.raises(SchemaMismatch):
+        RecordTransformer(schema, mdata).transform({'temperature_high': 'warm'})
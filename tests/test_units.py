@@ -0,0 +1,78 @@
+import json
+
+from singer import metadata
+
+from tap_darksky.discover import discover
+from tap_darksky.units import UnitConverter
+
+
+def test_schemas_without_multi_unit_fields():
+    catalog = discover()
+    for stream in catalog.streams:
+        schema = stream.schema.to_dict()
+        assert 'units' not in schema['properties']
+        assert '"unit"' not in json.dumps(schema)
+
+
+def test_multi_unit_catalog():
+    catalog = UnitConverter.get_catalog(discover())
+    for stream in catalog.streams:
+        assert stream.schema.to_dict()['properties']['units'] == {'type': ['null', 'string']}
+        mdata = metadata.to_map(stream.metadata)
+        assert metadata.get(mdata, ('properties', 'units'), 'inclusion') == 'automatic'
+
+
+def test_convert_forecast():
+    converter = UnitConverter(['si', 'us'])
+    record = {
+        'hourly': {'data': [{'temperature': 10.0, 'humidity': 0.5}]},
+        'daily': {'temperature_high': 20.0, 'wind_speed': 1.0},
+        'flags': {'nearest_station': 1.609344, 'units': 'si'}
+    }
+    si_record, us_record = converter.convert('forecast', [record])
+    assert si_record['units'] == 'si'
+    assert si_record['hourly']['data'][0]['temperature'] == 10.0
+    assert us_record['units'] == 'us'
+    assert us_record['hourly']['data'][0] == {'temperature': 50.0, 'humidity': 0.5}
+    assert us_record['daily']['temperature_high'] == 68.0
+    assert abs(us_record['daily']['wind_speed'] - 2.2369362920544) < 1e-9
+    assert us_record['flags'] == {'nearest_station': 1.0, 'units': 'us'}
+    # The SI record is not converted in place
+    assert record['daily']['temperature_high'] == 20.0
+
+
+# Temperature fields (not their times) of the hourly and daily rows of a stream schema
+def get_temperature_fields(schema):
+    return [field for field in schema['properties'] \
+        if ('temperature' in field or field == 'dew_point') and not field.endswith('_time')]
+
+
+def get_stream_schema(stream_name):
+    for stream in discover().streams:
+        if stream.tap_stream_id == stream_name:
+            return stream.schema.to_dict()
+    return None
+
+
+def test_convert_temperature_fields():
+    converter = UnitConverter(['us'])
+    forecast = get_stream_schema('forecast')['properties']
+    sections = {
+        'hourly': forecast['hourly']['properties']['data']['anyOf'][0]['items'],
+        'daily': forecast['daily']
+    }
+    for section, schema in sections.items():
+        fields = get_temperature_fields(schema)
+        assert fields
+        record = {section: {field: 10.0 for field in fields}}
+        if section == 'hourly':
+            record[section] = {'data': [record[section]]}
+        us_record = converter.convert('forecast', [record])[0]
+        rows = us_record['hourly']['data'] if section == 'hourly' else [us_record[section]]
+        assert rows[0] == {field: 50.0 for field in fields}
+
+    for stream_name in ['forecast_hourly', 'forecast_daily']:
+        fields = get_temperature_fields(get_stream_schema(stream_name))
+        assert fields
+        us_record = converter.convert(stream_name, [{field: 10.0 for field in fields}])[0]
+        assert us_record == dict({field: 50.0 for field in fields}, units='us')